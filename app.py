@@ -1,11 +1,39 @@
+import time
+_import_started = time.perf_counter()
+
+import io
 import os
 import json
+import functools
 import base64
+import hashlib
+import atexit
 import shutil
-from flask import Flask, render_template, request, jsonify, send_file
+import threading
+from urllib.parse import urlencode
+from markupsafe import escape
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, make_response
 from werkzeug.utils import secure_filename
-from datetime import datetime
-from template_strings import nctu, academic
+from template_strings import registry
+from template_strings.utils import css_options
+from template_strings.model import parse_sections, validate_options, image_urls, embed_images, ValidationError
+from services.image_store import ImageStore
+from services.image_cache import DataURICache
+from services.image_resolver import ImageResolver
+from services.render_cache import RenderCache, fingerprint
+from services.render_pool import RenderPool
+from services.lru import SizedLRU
+from services.compression import Compressor, BodyTooLarge, UnsupportedEncoding
+from services.doc_sessions import SessionStore, PatchError, VersionConflict
+from services.llm_client import LLMGateway, make_backend, MODEL_NAME, REPHRASE_PROMPT
+from services.llm_cache import LLMResponseCache
+from services.html_fix import FIX_HTML_PROMPT, split_fragments, mask_images, restore_images, clean_reply
+from services.warmup import Warmup
+from services.jobs import JobQueue
+from services.pdf_export import PDFExporter
+from services import pdf_export
+from services import export_bundle, image_variants
+
 app = Flask(__name__)
 # Absolute path to ensure it always finds the folder
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -13,62 +41,283 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['IMAGE_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+app.config['IMAGE_RESOLVE_WORKERS'] = 8
+# Digest index of the image store, shared by every worker process
+app.config['IMAGE_INDEX_PATH'] = os.path.join(BASE_DIR, 'instance', 'images.sqlite3')
+app.config['RENDER_CACHE_MAX_BYTES'] = 128 * 1024 * 1024
+# Finished generate-document responses, keyed by their ETag
+app.config['RESULT_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+# Negotiated gzip/br/zstd for responses of at least this size; levels favour latency over ratio
+app.config['COMPRESS_MIN_BYTES'] = 1024
+app.config['COMPRESS_LEVELS'] = {'br': 4, 'zstd': 3, 'gzip': 5}
+# Encoded bodies of responses with a strong ETag, so cached ones are sent precompressed
+app.config['COMPRESS_CACHE_MAX_BYTES'] = 32 * 1024 * 1024
+# Processes that render section HTML for large documents (0 = render in the request thread)
+app.config['RENDER_POOL_WORKERS'] = int(os.environ.get('RENDER_POOL_WORKERS', '2'))
+app.config['RENDER_POOL_MIN_NODES'] = 24
+# 'gemini', or 'fake' to run the AI endpoints offline against a canned model
+app.config['LLM_BACKEND'] = os.environ.get('LLM_BACKEND', 'gemini')
+app.config['LLM_MODEL'] = MODEL_NAME
+app.config['LLM_FAKE_LATENCY'] = float(os.environ.get('LLM_FAKE_LATENCY', '0.2'))
+app.config['LLM_MAX_CONCURRENCY'] = 8
+app.config['LLM_BATCH_WINDOW'] = 0.03
+app.config['LLM_TIMEOUT'] = 180
+app.config['FIX_HTML_PARALLEL'] = 4
+app.config['LLM_STREAM_HEARTBEAT'] = 10
+# Answers to repeated rephrase / fix-html requests are served from disk
+app.config['LLM_CACHE_PATH'] = os.path.join(BASE_DIR, 'instance', 'llm_cache.sqlite3')
+app.config['LLM_CACHE_TTL'] = 7 * 24 * 60 * 60
+app.config['LLM_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+# Processes rendering PDF pages for export_mode 'pdf', in chunks of this many pages
+app.config['PDF_WORKERS'] = int(os.environ.get('PDF_WORKERS', '2'))
+app.config['PDF_PAGES_PER_CHUNK'] = 8
+# Background rendering jobs; state lives in SQLite so any worker can answer polls
+app.config['JOBS_PATH'] = os.path.join(BASE_DIR, 'instance', 'jobs.sqlite3')
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_TTL'] = 15 * 60
+app.config['JOB_POLL_INTERVAL'] = 0.25
+# Document sessions (edited through JSON Patch), shared by every worker like the jobs
+app.config['SESSIONS_PATH'] = os.path.join(BASE_DIR, 'instance', 'sessions.sqlite3')
+# Preload the model client and templates in the background once a worker starts
+app.config['WARMUP'] = os.environ.get('WARMUP', '1') != '0'
+
+# inline: Base64 images in the HTML; assets: keep /static/uploads links;
+# bundle: zip of the HTML plus each referenced image stored once;
+# pdf: rendered server-side (needs the optional weasyprint and pypdf)
+EXPORT_MODES = ('inline', 'assets', 'bundle', 'pdf')
+# Which stored rendition of an upload each purpose uses (see image_variants)
+IMAGE_VARIANTS = {'preview': 'preview', 'export': 'print'}
+# What a document session stores; everything else is a per-render option
+DOCUMENT_FIELDS = ('sections', 'formatting', 'include_toc', 'template')
 
 # Create upload folder if it doesn't exist
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+image_store = ImageStore(UPLOAD_FOLDER, app.config['IMAGE_INDEX_PATH'], url_prefix='/static/uploads')
+data_uri_cache = DataURICache(app.config['IMAGE_CACHE_MAX_BYTES'])
+image_resolver = ImageResolver(image_store, data_uri_cache, app.config['IMAGE_RESOLVE_WORKERS'])
+render_cache = RenderCache(app.config['RENDER_CACHE_MAX_BYTES'])
+result_cache = SizedLRU(app.config['RESULT_CACHE_MAX_BYTES'], sizeof=lambda entry: len(entry[0]))
+compressor = Compressor(app.config['COMPRESS_MIN_BYTES'], app.config['COMPRESS_LEVELS'],
+                        app.config['COMPRESS_CACHE_MAX_BYTES'])
+render_pool = RenderPool(app.config['RENDER_POOL_WORKERS'], app.config['RENDER_POOL_MIN_NODES'])
+doc_sessions = SessionStore(app.config['SESSIONS_PATH'])
+pdf_exporter = PDFExporter(app.config['PDF_WORKERS'], app.config['PDF_PAGES_PER_CHUNK'], base_url=BASE_DIR + os.sep,
+                           asset_root=UPLOAD_FOLDER)
+job_queue = JobQueue(app.config['JOBS_PATH'], app.config['JOB_WORKERS'], app.config['JOB_TTL'])
+
+_llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    """The process-wide LLM gateway, started on first use (so after any fork)."""
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            backend = make_backend(app.config['LLM_BACKEND'], model_name=app.config['LLM_MODEL'],
+                                   latency=app.config['LLM_FAKE_LATENCY'])
+            _llm = LLMGateway(backend, app.config['LLM_MAX_CONCURRENCY'], app.config['LLM_BATCH_WINDOW'])
+        return _llm
+
+def warm_templates():
+    """Render a tiny document with every template so first requests find warm caches."""
+    sample = parse_sections([{'id': 'warmup', 'title': 'Warmup',
+                              'blocks': [{'type': 'text', 'content': '**Warm** *up* [link](#)'}]}])
+    for template in registry.load_all():
+        template.generate_full_html(sample, {}, True)
+    app.jinja_env.get_template('index.html')
+
+# Started by the gunicorn post_worker_init hook (gunicorn.conf.py) or by
+# `python app.py`; never before a fork, since it starts the gateway thread
+warmup = Warmup()
+if app.config['LLM_BACKEND'] == 'gemini':
+    warmup.imports('gemini client', 'google.generativeai', 'google.generativeai.client',
+                   'google.ai.generativelanguage_v1beta.services.generative_service.async_client')
+warmup.add('llm gateway', get_llm).add('templates', warm_templates).add('render pool', render_pool.start)
+
+def shutdown():
+    """Stop the background threads and render processes of this worker."""
+    job_queue.shutdown()
+    render_pool.shutdown(wait=False)
+    pdf_exporter.shutdown(wait=False)
+    image_resolver.shutdown()
+    if _llm is not None:
+        _llm.close()
+
+def create_app():
+    """Application factory: `gunicorn -c gunicorn.conf.py` loads `app:create_app()`.
+
+    Services are module-level singletons configured above; they start their
+    threads and processes lazily or from warm-up, i.e. in the serving process
+    after any fork, so the factory is safe to call before forking too, and
+    more than once: shutdown is registered with atexit a single time.
+    """
+    atexit.unregister(shutdown)
+    atexit.register(shutdown)
+    return app
+
+SSE_HEARTBEAT = ': keep-alive\n\n'
+
+def sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def sse_response(events):
+    """Stream EVENTS unbuffered; heartbeats keep proxies and workers from timing out."""
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+llm_cache = LLMResponseCache(app.config['LLM_CACHE_PATH'], app.config['LLM_CACHE_TTL'], app.config['LLM_CACHE_MAX_BYTES'])
+
+def llm_cache_key(kind, text, instruction=''):
+    return llm_cache.make_key(kind, text, instruction, f"{app.config['LLM_BACKEND']}:{app.config['LLM_MODEL']}")
+
+DEFAULT_FIX_INSTRUCTION = 'Fix grammar, make the tone professional, and ensure HTML structure is clean.'
+
+def plan_html_fix(data, instruction):
+    """Split a fix-html payload into page fragments.
+
+    Returns (parts, output, pending): OUTPUT starts as the original text of
+    every part with cached answers already filled in, and PENDING lists
+    (index, masked, uris, key) for the fragments the model still has to see.
+    Each page's content goes out on its own with images masked; fragments
+    answered before, or produced by an earlier fix, are not resent.
+    """
+    parts = split_fragments(data.get('html', ''))
+    output = [text for text, _ in parts]
+    pending = []
+    for i, (text, editable) in enumerate(parts):
+        if not editable or not text.strip():
+            continue
+        masked, uris = mask_images(text)
+        key = llm_cache_key('fix-html', masked, instruction)
+        cached = None if data.get('no_cache') else llm_cache.get(key)
+        if cached is not None:
+            output[i] = restore_images(cached, uris)
+        else:
+            pending.append((i, masked, uris, key))
+    return parts, output, pending
+
+def fix_prompts(pending, instruction):
+    return [FIX_HTML_PROMPT.format(instruction=instruction, html=masked) for _, masked, _, _ in pending]
+
+def finish_html_fix(output, job, reply, instruction):
+    """Store the model's REPLY for JOB and put it into OUTPUT; False if unusable."""
+    i, _, uris, key = job
+    fixed = clean_reply(reply)
+    if not fixed:
+        return False
+    llm_cache.put(key, fixed)
+    llm_cache.put(llm_cache_key('fix-html', fixed, instruction), fixed)
+    output[i] = restore_images(fixed, uris)
+    return True
+
+def fix_summary(parts, pending, failed):
+    return {'fragments': sum(1 for _, editable in parts if editable), 'resubmitted': len(pending), 'failed': failed}
+
 @app.route('/api/fix-html', methods=['POST'])
 def fix_html():
     """Refine full HTML content using Google Gemini API"""
     try:
         data = request.json
-        html_content = data.get('html', '')
         api_key = data.get('api_key', '')
-        instruction = data.get('instruction', 'Fix grammar, make the tone professional, and ensure HTML structure is clean.')
+        instruction = data.get('instruction', DEFAULT_FIX_INSTRUCTION)
 
-        if not html_content:
+        if not data.get('html'):
             return jsonify({'error': 'No HTML provided'}), 400
         if not api_key:
             return jsonify({'error': 'No API key provided'}), 400
 
-        import google.generativeai as genai
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        parts, output, pending = plan_html_fix(data, instruction)
+        replies = get_llm().generate_many(api_key, fix_prompts(pending, instruction), timeout=app.config['LLM_TIMEOUT'],
+                                          limit=app.config['FIX_HTML_PARALLEL']) if pending else []
 
-        # Prompt engineering to ensure it returns ONLY valid HTML matching the style
-        prompt = f"""
-        You are an expert HTML and Content Editor. 
-        Your task is to refine the following HTML content based on this instruction: "{instruction}"
-        
-        Rules:
-        1. Correct any grammar or spelling errors in the text content.
-        2. Improve the professional tone of the text.
-        3. DO NOT remove existing CSS classes (like 'title', 'content-block', 'page').
-        4. DO NOT remove structural divs (like 'page', 'page-content').
-        5. Return ONLY the raw HTML code inside the <body> tag. Do not return Markdown formatting (no ```html).
-        
-        Input HTML:
-        {html_content}
-        """
+        failed = [reply for job, reply in zip(pending, replies)
+                  if isinstance(reply, Exception) or not finish_html_fix(output, job, reply, instruction)]
+        if pending and len(failed) == len(pending):
+            error = next((r for r in failed if isinstance(r, Exception)), None)
+            return jsonify({'error': str(error) if error else 'No response from Gemini'}), 500 if error else 400
 
-        response = model.generate_content(prompt)
-        
-        if not response.text:
-            return jsonify({'error': 'No response from Gemini'}), 400
-
-        # clean up if Gemini wraps in markdown
-        cleaned_html = response.text.replace('```html', '').replace('```', '').strip()
-        
-        return jsonify({'success': True, 'fixed_html': cleaned_html})
+        return jsonify({'success': True, 'fixed_html': ''.join(output), **fix_summary(parts, pending, len(failed))})
 
     except Exception as e:
         print(f"HTML Fix Error: {e}")
         return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fix-html/stream', methods=['POST'])
+def fix_html_stream():
+    """Server-Sent Events variant of /api/fix-html.
+
+    Emits `start` with the fragment counts, `delta` events
+    ({"fragment": n, "text": ...}) as the model writes, and finally `done`
+    with the reassembled document (or `error`).
+    """
+    data = request.json or {}
+    api_key = data.get('api_key', '')
+    instruction = data.get('instruction', DEFAULT_FIX_INSTRUCTION)
+    if not data.get('html'):
+        return jsonify({'error': 'No HTML provided'}), 400
+    if not api_key:
+        return jsonify({'error': 'No API key provided'}), 400
+
+    parts, output, pending = plan_html_fix(data, instruction)
+
+    def events():
+        yield sse('start', fix_summary(parts, pending, 0))
+        chunks = [[] for _ in pending]
+        failed = 0
+        try:
+            for n, item in get_llm().stream(api_key, fix_prompts(pending, instruction),
+                                            idle_timeout=app.config['LLM_TIMEOUT'],
+                                            limit=app.config['FIX_HTML_PARALLEL'],
+                                            heartbeat=app.config['LLM_STREAM_HEARTBEAT']):
+                if n is None:
+                    yield SSE_HEARTBEAT
+                elif isinstance(item, str):
+                    chunks[n].append(item)
+                    yield sse('delta', {'fragment': n, 'text': item})
+                elif isinstance(item, Exception) or not finish_html_fix(output, pending[n], ''.join(chunks[n]), instruction):
+                    failed += 1
+        except Exception as e:
+            print(f"HTML Fix Stream Error: {e}")
+            yield sse('error', {'error': str(e)})
+            return
+        if pending and failed == len(pending):
+            yield sse('error', {'error': 'No response from Gemini'})
+            return
+        yield sse('done', {'fixed_html': ''.join(output), **fix_summary(parts, pending, failed)})
+
+    return sse_response(events())
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.before_request
+def decode_request():
+    """Accept gzip/zstd request bodies (e.g. large section trees); MAX_CONTENT_LENGTH applies raw and decoded."""
+    try:
+        compressor.prepare_request(request.environ, app.config['MAX_CONTENT_LENGTH'])
+    except BodyTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except UnsupportedEncoding as e:
+        return jsonify({'error': str(e)}), 415
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# Registered before the other after_request hooks so that it runs last
+@app.after_request
+def compress_response(response):
+    return compressor.compress_response(response, request.accept_encodings)
+
+@app.after_request
+def cache_uploads(response):
+    """Stored uploads are named by content hash, so their URLs can be cached forever."""
+    if request.endpoint == 'static' and response.status_code in (200, 304) and image_store.digest_from_url(request.path):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/api/upload-image', methods=['POST'])
 def upload_image():
     try:
@@ -78,51 +327,120 @@ def upload_image():
         if file.filename == '': 
             return jsonify({'error': 'No selected file'}), 400
         
-        ext = os.path.splitext(file.filename)[1]
-        filename = secure_filename(f"img_{int(datetime.now().timestamp())}{ext}")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        # Content-addressed: identical bytes map to the same stored file
+        digest, created = image_store.put(file.read(), secure_filename(file.filename))
         
-        file.save(filepath)
+        # Downscaled print/preview renditions are made once per distinct image
+        if created:
+            try:
+                image_variants.generate_variants(image_store, digest)
+            except Exception as e:
+                print(f"Variant Error: {e}")
         
         # Return URL relative to static
-        return jsonify({'success': True, 'url': f'/static/uploads/{filename}'})
+        return jsonify({'success': True, 'url': image_store.url_for(digest), 'hash': digest, 'deduplicated': not created})
     except Exception as e:
         print(f"Upload Error: {e}")
         return jsonify({'error': str(e)}), 500
 
-def prepare_images_for_export(blocks):
-    """Encode images found in BLOCKS to Base64."""
-    if not blocks: return []
-    
-    for blk in blocks:
-        if blk.get('type') == 'image':
-            url = blk.get('url') or blk.get('src', '')
-            
-            if url.startswith('/static/uploads/'):
-                # Strip leading slash for os.path.join if needed, 
-                # but better to assume it maps to UPLOAD_FOLDER
-                filename = os.path.basename(url)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                
-                if os.path.exists(filepath):
-                    try:
-                        with open(filepath, 'rb') as f:
-                            b64 = base64.b64encode(f.read()).decode()
-                            ext = os.path.splitext(filepath)[1].lower().replace('.', '')
-                            mime = 'image/jpeg' if ext in ['jpg', 'jpeg'] else 'image/png'
-                            blk['src'] = f"data:{mime};base64,{b64}"
-                    except Exception as e:
-                        print(f"Error encoding {filepath}: {e}")
-            else:
-                blk['src'] = url
-    return blocks
-
-def process_section_images(section):
-    if 'blocks' in section:
-        section['blocks'] = prepare_images_for_export(section['blocks'])
-    if 'subsections' in section:
-        for subsec in section['subsections']:
-            process_section_images(subsec)
+@app.route('/api/upload-image/<digest>', methods=['DELETE'])
+def release_image(digest):
+    """Drop one upload of DIGEST; the stored files are deleted with the last one."""
+    try:
+        if not image_store.release(digest):
+            return jsonify({'error': 'Unknown image'}), 404
+        return jsonify({'success': True})
+    except Exception as e:
+        print(f"Release Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def resolve_images(urls, embed=True, purpose='export'):
+    """{url: Base64 data URI} for the uploads among URLS ({url: rendition URL} if not EMBED)."""
+    return image_resolver.resolve_urls(urls, embed, IMAGE_VARIANTS.get(purpose, 'print'))
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'image_store': image_store.stats(),
+        'data_uri_cache': data_uri_cache.stats(),
+        'render_cache': render_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'render_pool': render_pool.stats(),
+        'pdf_export': pdf_exporter.stats(),
+        'document_sessions': doc_sessions.stats(),
+        'jobs': job_queue.stats(),
+        'llm': _llm.stats() if _llm else None,
+        'llm_cache': llm_cache.stats(),
+        'stylesheets': registry.stats(),
+        'compression': compressor.stats(),
+    })
+
+@app.route('/api/stylesheets/<name>.css', methods=['GET'])
+def stylesheet(name):
+    """A template's stylesheet for the formatting options in the query string.
+
+    Links carry the content version (`v`); when it matches, the response
+    may be cached forever.  The strong ETag answers revalidations with 304.
+    """
+    if name not in registry.names():
+        return jsonify({'error': f'Unknown template: {name}'}), 404
+    css, version = registry.get_template(name).stylesheet(request.args)
+    response = Response(css, mimetype='text/css')
+    response.set_etag(version)
+    response.headers['Cache-Control'] = ('public, max-age=31536000, immutable' if request.args.get('v') == version
+                                         else 'no-cache')
+    return response.make_conditional(request)
+
+@app.route('/api/warmup', methods=['GET'])
+def warmup_stats():
+    """Start-up breakdown of this worker; `ready` turns true once warm-up finished."""
+    stats = warmup.stats()
+    return jsonify({'ready': stats['state'] == 'done', 'pid': os.getpid(), **stats})
+
+@app.route('/api/rephrase/stream', methods=['POST'])
+def rephrase_stream():
+    """Server-Sent Events variant of /api/rephrase: `delta` events, then `done`."""
+    data = request.json or {}
+    text = data.get('text', '')
+    api_key = data.get('api_key', '')
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    if not api_key:
+        return jsonify({'error': 'No API key provided'}), 400
+
+    cache_key = llm_cache_key('rephrase', text)
+    cached = None if data.get('no_cache') else llm_cache.get(cache_key)
+
+    def events():
+        if cached is not None:
+            yield sse('delta', {'text': cached})
+            yield sse('done', {'rephrased': cached, 'cached': True})
+            return
+        # Streamed answers skip the gateway's batching: each text gets its own call
+        chunks = []
+        try:
+            for n, item in get_llm().stream(api_key, [REPHRASE_PROMPT.format(text=text)],
+                                            idle_timeout=app.config['LLM_TIMEOUT'],
+                                            heartbeat=app.config['LLM_STREAM_HEARTBEAT']):
+                if n is None:
+                    yield SSE_HEARTBEAT
+                elif isinstance(item, str):
+                    chunks.append(item)
+                    yield sse('delta', {'text': item})
+                elif isinstance(item, Exception):
+                    raise item
+        except Exception as e:
+            print(f"Rephrase Stream Error: {e}")
+            yield sse('error', {'error': str(e)})
+            return
+        rephrased = ''.join(chunks).strip()
+        if not rephrased:
+            yield sse('error', {'error': 'No response from Gemini'})
+            return
+        llm_cache.put(cache_key, rephrased)
+        yield sse('done', {'rephrased': rephrased})
+
+    return sse_response(events())
 
 @app.route('/api/rephrase', methods=['POST'])
 def rephrase_text():
@@ -137,23 +455,20 @@ def rephrase_text():
         if not api_key:
             return jsonify({'error': 'No API key provided'}), 400
         
-        import google.generativeai as genai
+        cache_key = llm_cache_key('rephrase', text)
+        if not data.get('no_cache'):
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return jsonify({'success': True, 'rephrased': cached, 'cached': True})
         
-        # Configure API key
-        genai.configure(api_key=api_key)
+        # Requests arriving together may share one model call (see LLMGateway)
+        rephrased = get_llm().rephrase(api_key, text, timeout=app.config['LLM_TIMEOUT'])
         
-        # Create model
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # Generate response
-        prompt = f"Please rephrase the following text to be more professional and clear while maintaining the original meaning. Keep the same language (Chinese or English). Only return the rephrased text without any explanations:\n\n{text}"
-        
-        response = model.generate_content(prompt)
-        
-        if not response.text:
+        if not rephrased:
             return jsonify({'error': 'No response from Gemini'}), 400
         
-        return jsonify({'success': True, 'rephrased': response.text.strip()})
+        llm_cache.put(cache_key, rephrased)
+        return jsonify({'success': True, 'rephrased': rephrased})
         
     except Exception as e:
         print(f"Rephrase Error: {e}")
@@ -161,28 +476,424 @@ def rephrase_text():
 
 
 
+def _no_progress(stage, done=0, total=0):
+    pass
+
+@functools.lru_cache(maxsize=4096)
+def image_size(url):
+    """(width, height) of an uploaded image, for figure heights in the layout pass."""
+    if not url or url.startswith('data:'):
+        return None
+    filepath = image_store.resolve_url(url)
+    return image_variants.dimensions(filepath) if filepath else None
+
+def build_document(data, sections, progress=_no_progress):
+    """Render a generate-document payload to HTML.
+
+    SECTIONS are DATA's sections parsed by parse_document.  Returns (html,
+    render_cache_header).  PROGRESS(stage, done, total) is called as the
+    planning, images, rendering and assembling stages advance.
+    """
+    formatting = data.get('formatting') or {}
+    include_toc = bool(data.get('include_toc'))
+    template = registry.get_template(data.get('template'))
+    export_mode = data.get('export_mode') or 'inline'
+    purpose = data.get('purpose') or 'export'
+
+    # Paginate first, so the page breaks are part of what gets cached.  The
+    # layout is the only walk over the tree: its node list drives the render
+    # cache and its image references the image prep.  Only sections whose
+    # content changed are re-rendered (and need their images prepared); the
+    # rest are spliced in from the render cache
+    progress('planning')
+    layout = template.layout_document(sections, formatting, include_toc, image_size)
+    render_pass = render_cache.begin(template.render_section_content, template.name, formatting, export_mode, purpose)
+    changed = render_pass.plan(layout.nodes)
+    progress('images', 0, len(changed))
+    resolved = resolve_images(layout.image_urls(n for n, _ in changed), embed=export_mode == 'inline', purpose=purpose)
+    progress('rendering', 0, len(changed))
+    render_pass.render_misses(render_pool, lambda done, total: progress('rendering', done, total),
+                              prepare=lambda node: embed_images(node, resolved))
+    progress('assembling')
+    full_html = template.generate_full_html(layout.sections, formatting, include_toc, render_tree=render_pass.render_tree,
+                                            layout=layout,
+                                            stylesheet=document_stylesheet(template, formatting, export_mode, purpose))
+    return full_html, render_pass.header()
+
+def document_stylesheet(template, formatting, export_mode, purpose):
+    """Styles for a document's head: previews link the shared stylesheet, anything saved keeps it inline."""
+    if purpose != 'preview' or export_mode not in ('inline', 'assets'):
+        return None
+    _, version = template.stylesheet(formatting)
+    query = urlencode(css_options(formatting) + (('v', version),))
+    return f'<link rel="stylesheet" href="{escape(f"/api/stylesheets/{template.name}.css?{query}")}">'
+
+def source_version(*paths):
+    """Hash of the Python sources under PATHS; output changes with them, so ETags do too."""
+    digest = hashlib.blake2b(digest_size=8)
+    for path in paths:
+        names = sorted(os.listdir(path)) if os.path.isdir(path) else ['']
+        for name in names:
+            if name.endswith('.py') or not name:
+                with open(os.path.join(path, name) if name else path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+RENDER_VERSION = source_version(os.path.join(BASE_DIR, 'template_strings'), os.path.join(BASE_DIR, 'services'),
+                                os.path.abspath(__file__))
+
+def image_versions(urls, purpose):
+    """What the output depends on for each image in URLS.
+
+    Uploads in the store are content-addressed, so the URL of the rendition
+    in use is enough; flat legacy files count by size and mtime; data URIs
+    are their own content and are already part of the sections.
+    """
+    versions = set()
+    variant = IMAGE_VARIANTS.get(purpose, 'print')
+    for url in urls:
+        if not url or url.startswith('data:'):
+            continue
+        if image_store.digest_from_url(url):
+            versions.add((url, image_store.variant_url(url, variant)))
+            continue
+        filepath = image_store.resolve_url(url)
+        stat = os.stat(filepath) if filepath else None
+        versions.add((url, (stat.st_size, stat.st_mtime_ns) if stat else None))
+    return sorted(versions, key=str)
+
+def document_etag(data, sections):
+    """Strong ETag of a generate-document payload: the canonical request plus the images it uses."""
+    purpose = data.get('purpose') or 'export'
+    request_part = {k: data.get(k) for k in DOCUMENT_FIELDS + ('export_mode', 'purpose', 'filename')}
+    return fingerprint('document', RENDER_VERSION, request_part, image_versions(image_urls(sections), purpose))
+
+def parse_document(data):
+    """(sections, None) for a valid payload, or (None, error response) naming the invalid field."""
+    try:
+        validate_options(data)
+        return parse_sections(data.get('sections')), None
+    except ValidationError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+
+def not_modified(etag):
+    """304 for a conditional request that already holds ETAG, else None.
+
+    generate-document is a POST only because its input is large; it is safe
+    and idempotent, so clients may revalidate it like a GET.
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def export_mode_error(export_mode):
+    """Error response if EXPORT_MODE cannot be served here, else None."""
+    if export_mode not in EXPORT_MODES:
+        return jsonify({'error': f'Unknown export_mode: {export_mode}'}), 400
+    if export_mode == 'pdf' and not pdf_export.available():
+        return jsonify({'error': 'PDF export needs weasyprint and pypdf installed on the server'}), 501
+    return None
+
+def document_response(data, full_html, render_header, pdf=None):
+    """The HTTP response for rendered HTML in DATA's export_mode (JSON, zip or PDF)."""
+    export_mode = data.get('export_mode') or 'inline'
+    download_name = secure_filename(data.get('filename') or '') or 'document'
+    if export_mode == 'bundle':
+        bundle = export_bundle.build_bundle(full_html, image_store.resolve_url)
+        response = send_file(bundle, mimetype='application/zip', as_attachment=True,
+                             download_name=download_name + '.zip')
+    elif export_mode == 'pdf':
+        if pdf is None:
+            pdf = pdf_exporter.export(full_html, image_store.resolve_url)
+        response = send_file(io.BytesIO(pdf), mimetype='application/pdf', as_attachment=True,
+                             download_name=download_name + '.pdf')
+    elif export_mode == 'assets':
+        response = jsonify({'success': True, 'html': full_html, 'assets': export_bundle.asset_urls(full_html)})
+    else:
+        response = jsonify({'success': True, 'html': full_html})
+    response.headers['X-Render-Cache'] = render_header
+    return response
+
+def render_document(data):
+    """Render a generate-document payload into a response (JSON, zip or PDF).
+
+    Responses carry a strong ETag: a request holding it gets 304, and
+    identical payloads are answered from the result cache.
+    """
+    sections, error = parse_document(data)
+    if error:
+        return error
+    error = export_mode_error(data.get('export_mode') or 'inline')
+    if error:
+        return error
+    etag = document_etag(data, sections)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    cached = result_cache.get(etag)
+    if cached is not None:
+        response = Response(cached[0], headers=cached[1])
+        response.headers['X-Result-Cache'] = 'hit'
+    else:
+        full_html, render_header = build_document(data, sections)
+        response = document_response(data, full_html, render_header)
+        response.direct_passthrough = False  # send_file responses; the body is in memory anyway
+        result_cache.put(etag, (response.get_data(), [(k, v) for k, v in response.headers.items()
+                                                       if k not in ('Content-Length', 'ETag')]))
+        response.headers['X-Result-Cache'] = 'miss'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def stream_document_response(data):
+    """Stream a generate-document payload as text/html, one page per chunk."""
+    sections, error = parse_document(data)
+    if error:
+        return error
+    formatting = data.get('formatting') or {}
+    include_toc = bool(data.get('include_toc'))
+    template = registry.get_template(data.get('template'))
+    export_mode = data.get('export_mode') or 'inline'
+    purpose = data.get('purpose') or 'export'
+    if export_mode not in ('inline', 'assets'):
+        return jsonify({'error': f'export_mode {export_mode} cannot be streamed'}), 400
+    etag = document_etag(data, sections)
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+
+    def prepare(section):
+        # Images are resolved per page into a copy of the section, so each
+        # page's data URIs can be freed as soon as it has been sent
+        resolved = resolve_images(image_urls([section]), embed=export_mode == 'inline', purpose=purpose)
+        return embed_images(section, resolved, deep=True)
+
+    layout = template.layout_document(sections, formatting, include_toc, image_size)
+    chunks = template.iter_full_html(layout.sections, formatting, include_toc, prepare=prepare, layout=layout,
+                                     stylesheet=document_stylesheet(template, formatting, export_mode, purpose))
+    response = Response(stream_with_context(chunks), mimetype='text/html',
+                        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'private, no-cache',
+                                 'X-Document-Pages': str(layout.pages)})
+    response.set_etag(etag)
+    return response
+
 @app.route('/api/generate-document', methods=['POST'])
 def generate_document():
     try:
-        data = request.json
-        sections = data.get('sections', [])
-        formatting = data.get('formatting', {})
-        include_toc = data.get('include_toc', False)
-        template = data.get('template', 'nctu')  # NEW: default to nctu
-        
-        for section in sections:
-            process_section_images(section)
+        return render_document(request.json)
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        # Select template
-        if template == 'academic':
-            full_html = academic.generate_full_html(sections, formatting, include_toc)
-        else:
-            full_html = nctu.generate_full_html(sections, formatting, include_toc)
-            
-        return jsonify({'success': True, 'html': full_html})
+@app.route('/api/export-pdf', methods=['POST'])
+def export_pdf():
+    """generate-document payload in, PDF out (same as export_mode 'pdf')."""
+    try:
+        data = request.json or {}
+        return render_document(dict(data, export_mode='pdf') if isinstance(data, dict) else data)
+    except Exception as e:
+        print(f"PDF Export Error: {e}")
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/api/generate-document/stream', methods=['POST'])
+def stream_document():
+    """Stream the generated document as text/html, one page per chunk."""
+    try:
+        return stream_document_response(request.get_json(silent=True))
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# --- DOCUMENT SESSIONS: upload once, then send JSON Patch diffs ---
+@app.route('/api/documents', methods=['POST'])
+def create_document_session():
+    data = request.json or {}
+    _, error = parse_document(data)
+    if error:
+        return error
+    document = {k: data[k] for k in DOCUMENT_FIELDS if k in data}
+    document.setdefault('sections', [])
+    sid, version = doc_sessions.create(document)
+    return jsonify({'success': True, 'session_id': sid, 'version': version})
+
+def validate_session_document(document):
+    """Raise unless a patched session DOCUMENT can still be rendered."""
+    if not isinstance(document, dict):
+        raise PatchError('The document must remain an object')
+    validate_options(document)
+    parse_sections(document.get('sections'))
+
+@app.route('/api/documents/<sid>', methods=['PATCH'])
+def patch_document_session(sid):
+    try:
+        data = request.json or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object with ops'}), 400
+        version = doc_sessions.patch(sid, data.get('ops', []), data.get('base_version'),
+                                     validate=validate_session_document)
+    except VersionConflict as e:
+        return jsonify({'error': str(e), 'version': e.current}), 409
+    except (PatchError, ValidationError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({'error': str(e)}), 500
+    if version is None:
+        return jsonify({'error': 'Unknown or expired document session'}), 404
+    return jsonify({'success': True, 'version': version})
+
+@app.route('/api/documents/<sid>', methods=['DELETE'])
+def delete_document_session(sid):
+    if not doc_sessions.delete(sid):
+        return jsonify({'error': 'Unknown or expired document session'}), 404
+    return jsonify({'success': True})
+
+def _session_payload(sid):
+    """The stored document of session SID merged with this request's render options."""
+    stored = doc_sessions.get(sid)
+    if stored is None:
+        return None, None
+    document, version = stored
+    options = request.get_json(silent=True) or {}
+    if not isinstance(options, dict):
+        raise ValidationError('request body', 'must be a JSON object')
+    document.update({k: v for k, v in options.items() if k != 'sections'})
+    return document, version
+
+@app.route('/api/documents/<sid>/render', methods=['POST'])
+def render_document_session(sid):
+    try:
+        payload, version = _session_payload(sid)
+        if payload is None:
+            return jsonify({'error': 'Unknown or expired document session'}), 404
+        response = make_response(render_document(payload))
+        response.headers['X-Document-Version'] = str(version)
+        return response
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/documents/<sid>/stream', methods=['POST'])
+def stream_document_session(sid):
+    try:
+        payload, version = _session_payload(sid)
+        if payload is None:
+            return jsonify({'error': 'Unknown or expired document session'}), 404
+        response = make_response(stream_document_response(payload))
+        response.headers['X-Document-Version'] = str(version)
+        return response
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# --- BACKGROUND JOBS ---
+def submit_document_job(payload):
+    """Queue PAYLOAD for rendering; identical payloads share one job."""
+    sections, error = parse_document(payload)
+    if error:
+        return error
+    export_mode = payload.get('export_mode') or 'inline'
+    error = export_mode_error(export_mode)
+    if error:
+        return error
+
+    def run(progress):
+        full_html, render_header = build_document(payload, sections, progress)
+        result = {'html': full_html, 'render_cache': render_header,
+                  'export_mode': export_mode, 'filename': payload.get('filename')}
+        if export_mode == 'pdf':
+            progress('pdf')
+            result['pdf'] = base64.b64encode(pdf_exporter.export(full_html, image_store.resolve_url)).decode()
+            result['html'] = ''  # only the PDF is served
+        return result
+
+    # Keyed like the HTTP cache, so a renderer change or a re-uploaded image starts a fresh job
+    job_id, coalesced = job_queue.submit(document_etag(payload, sections), run)
+    return jsonify({'success': True, 'job_id': job_id, 'coalesced': coalesced}), 202
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Render a generate-document payload in the background; poll or stream /api/jobs/<id>."""
+    try:
+        return submit_document_job(request.json or {})
+    except Exception as e:
+        print(f"Job Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/documents/<sid>/jobs', methods=['POST'])
+def create_session_job(sid):
+    try:
+        payload, _ = _session_payload(sid)
+        if payload is None:
+            return jsonify({'error': 'Unknown or expired document session'}), 404
+        return submit_document_job(payload)
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Job Error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events: `progress` on every change, then `done` or `error`."""
+    if job_queue.get(job_id) is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+
+    def events():
+        last, quiet = None, 0.0
+        while True:
+            job = job_queue.get(job_id)
+            if job is None:
+                yield sse('error', {'error': 'Unknown or expired job'})
+                return
+            if job['state'] == 'done':
+                yield sse('done', job)
+                return
+            if job['state'] == 'error':
+                yield sse('error', job)
+                return
+            current = (job['state'], job['stage'], job['done'], job['total'])
+            if current != last:
+                last, quiet = current, 0.0
+                yield sse('progress', job)
+            elif quiet >= app.config['LLM_STREAM_HEARTBEAT']:
+                quiet = 0.0
+                yield SSE_HEARTBEAT
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
+            quiet += app.config['JOB_POLL_INTERVAL']
+
+    return sse_response(events())
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job['state'] == 'error':
+        return jsonify({'error': job['error']}), 500
+    result = job_queue.result(job_id)
+    if result is None:
+        return jsonify({'error': 'Job is not finished', **job}), 409
+    pdf = base64.b64decode(result['pdf']) if result.get('pdf') else None
+    return document_response(result, result['html'], result['render_cache'], pdf)
+
+warmup.record('app import', (time.perf_counter() - _import_started) * 1000)
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # With the debug reloader only the serving child process warms up
+    if app.config['WARMUP'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warmup.start()
+    create_app().run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""Benchmark: the per-document stages on documents with thousands of sections.
+
+The layout pass is the one walk over the section tree; it hands the later
+stages a flat node list and the image URLs per node.  This times
+each stage on top of it: the layout itself, render-cache planning, image
+reference lookup, a cold render and a warm (all cached) assembly, per
+template.
+
+    python benchmarks/bench_document_model.py [sections ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_strings import nctu, academic  # noqa: E402
+from template_strings.model import parse_sections  # noqa: E402
+from services.render_cache import RenderCache  # noqa: E402
+
+
+def make_document(sections):
+    return [{
+        'id': f's{i}', 'title': f'Section {i}', 'type': ('autobiography', 'study_plan', 'other')[i % 3],
+        'blocks': [
+            {'type': 'text', 'content': 'Short paragraph with **bold** text.'},
+            {'type': 'image', 'images': [{'url': f'/static/uploads/{i}.png', 'caption': 'Figure'}]},
+        ],
+        'subsections': [{'id': f's{i}-{j}', 'title': 'Detail', 'level': 2,
+                         'blocks': [{'type': 'text', 'content': 'Body text.'}]} for j in range(2)],
+    } for i in range(sections)]
+
+
+def timed(fn):
+    t = time.perf_counter()
+    out = fn()
+    return (time.perf_counter() - t) * 1000, out
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 3000]
+    print(f"{'sections':>8} {'template':<10} {'layout':>8} {'plan':>8} {'images':>8} {'cold':>9} {'warm':>9} {'html':>9}")
+    for n in sizes:
+        doc = parse_sections(make_document(n))
+        for name, module in (('nctu', nctu), ('academic', academic)):
+            cache = RenderCache()
+            layout_ms, layout = timed(lambda: module.layout_document(doc, {}, True))
+            render_pass = cache.begin(module.render_section_content, name)
+            plan_ms, changed = timed(lambda: render_pass.plan(layout.nodes))
+            refs_ms, _ = timed(lambda: layout.image_urls(n for n, _ in changed))
+            cold_ms, _ = timed(lambda: module.generate_full_html(layout.sections, {}, True, layout=layout,
+                                                                 render_tree=render_pass.render_tree))
+            render_pass = cache.begin(module.render_section_content, name)
+            render_pass.plan(layout.nodes)
+            warm_ms, html = timed(lambda: module.generate_full_html(layout.sections, {}, True, layout=layout,
+                                                                    render_tree=render_pass.render_tree))
+            print(f"{n:8d} {name:<10} {layout_ms:6.0f}ms {plan_ms:6.0f}ms {refs_ms:6.1f}ms {cold_ms:7.0f}ms "
+                  f"{warm_ms:7.0f}ms {len(html) / 1e6:7.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
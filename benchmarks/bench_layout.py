@@ -0,0 +1,89 @@
+"""Benchmark: the pagination pass on a ~200-page document.
+
+Times layout_document (height estimation, splitting, page breaks) on its
+own and as part of a full generate_full_html, per template.  The layout
+pass is what makes TOC page numbers exact, so it has to stay a small
+fraction of the render for interactive previews.  Before timing, it
+checks that every TOC page number matches the page the section is
+actually rendered on, with and without pageBreakBefore on sections.
+
+    python benchmarks/bench_layout.py [sections]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_strings import nctu, academic  # noqa: E402
+from template_strings.model import parse_sections  # noqa: E402
+
+
+def make_document(sections):
+    return [{
+        'id': f's{i}', 'title': f'Section {i}',
+        'blocks': [
+            {'type': 'text', 'content': ('本段落用來測試分頁的中文內容，包含 **粗體** 與一般文字。' * 30 + '\n') * 3},
+            {'type': 'list', 'listStyle': '1', 'content': '\n'.join(f'Item {k}: ' + 'word ' * 25 for k in range(12))},
+            {'type': 'table', 'tableData': [['Name', 'Value', 'Note']] + [[f'r{r}', str(r * 7), 'text ' * (r % 9)]
+                                                                       for r in range(30)]},
+            {'type': 'image', 'images': [{'url': '/static/uploads/x.png', 'caption': 'Figure'}] * 2},
+        ],
+        'subsections': [{'id': f's{i}-{j}', 'title': 'Detail', 'level': 2,
+                         'blocks': [{'type': 'text', 'content': 'Lorem ipsum dolor sit amet. ' * 60}]}
+                        for j in range(2)],
+    } for i in range(sections)]
+
+
+def with_page_breaks(sections):
+    """The document with pageBreakBefore set on every other section and subsection."""
+    for i, sec in enumerate(sections):
+        sec['pageBreakBefore'] = i % 2 == 1
+        for j, sub in enumerate(sec['subsections']):
+            sub['pageBreakBefore'] = j % 2 == 0
+    return sections
+
+
+def check_toc_pages(name, module, doc):
+    """Fail loudly if a TOC entry points at another page than its heading is on, or a page is empty."""
+    layout = module.layout_document(doc, {}, True)
+    pages = module.generate_full_html(layout.sections, {}, True, layout=layout).split('<div class="page">')[1:]
+    assert len(pages) == layout.pages, f"{name}: {len(pages)} pages rendered, layout counted {layout.pages}"
+    for i, page in enumerate(pages[layout.toc_pages:], layout.toc_pages + 1):
+        content = page.split('<div class="page-content">', 1)[1].split('<div class="page-number">')[0]
+        assert '<img' in content or re.sub(r'<[^>]+>', '', content).strip(), f"{name}: page {i} is empty"
+    for numbering, _ in layout.nodes:
+        heading = f'<span class="section-number">{numbering}</span>'
+        actual = next(i for i, page in enumerate(pages, 1) if heading in page)
+        assert actual == layout.page_number(numbering), \
+            f"{name}: TOC says {numbering} is on page {layout.page_number(numbering)}, it is on page {actual}"
+
+
+def bench(fn, repeat=5):
+    best, out = float('inf'), None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000, out
+
+
+def main():
+    sections = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    doc = parse_sections(make_document(sections))
+    for name, module in (('nctu', nctu), ('academic', academic)):
+        for checked in (doc, parse_sections(with_page_breaks(make_document(min(sections, 12))))):
+            check_toc_pages(name, module, checked)
+    print("TOC page numbers match the rendered pages (with and without pageBreakBefore)")
+    print(f"{sections} sections")
+    print(f"{'template':<10} {'pages':>6} {'layout':>10} {'full render':>12} {'layout share':>13}")
+    for name, module in (('nctu', nctu), ('academic', academic)):
+        layout_ms, layout = bench(lambda: module.layout_document(doc, {}, True))
+        render_ms, _ = bench(lambda: module.generate_full_html(layout.sections, {}, True, layout=layout))
+        total = layout_ms + render_ms
+        print(f"{name:<10} {layout.pages:6d} {layout_ms:8.2f} ms {total:9.2f} ms {layout_ms / total:12.1%}")
+
+
+if __name__ == '__main__':
+    main()
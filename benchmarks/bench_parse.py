@@ -0,0 +1,93 @@
+"""Benchmark: decoding and parsing a large draft, and what the model costs in memory.
+
+A draft as the editor sends it (every block carries the fields of all block
+types) is decoded with json and, if installed, orjson, then validated into
+the document model (template_strings/model.py).  Memory is traced for the
+decoded dict tree and for the model on its own; layout and render time are
+measured on the model.
+
+    python benchmarks/bench_parse.py [sections]
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_strings import nctu  # noqa: E402
+from template_strings.model import parse_sections  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def editor_block(kind, **fields):
+    """A block with the defaults app.js gives every new block."""
+    return dict({'id': 'blk-1700000000000-abcd', 'type': kind, 'content': '', 'align': 'left', 'listStyle': '1',
+                 'url': '', 'caption': '', 'width': 100, 'rows': 3, 'cols': 3, 'tableData': None,
+                 'layout': 'standalone', 'imageCount': 1, 'images': [], 'groupWidth': 50}, **fields)
+
+
+def make_draft(sections):
+    return {'sections': [{
+        'id': f'sec-{i}', 'title': f'Section {i}', 'type': 'other', 'customColor': None, 'level': 1,
+        'blocks': [
+            editor_block('text', content='本段落用來測試解析的中文內容，包含 **粗體** 與一般文字。' * 4),
+            editor_block('list', content='\n'.join(f'Item {k}: some words here' for k in range(6))),
+            editor_block('table', tableData=[['Name', 'Value', 'Note']] + [[f'r{r}', str(r), 'text'] for r in range(8)]),
+            editor_block('image', images=[{'url': f'/static/uploads/ab/{i:064x}.png', 'caption': 'Figure'}]),
+        ],
+        'subsections': [{'id': f'sec-{i}-{j}', 'title': 'Detail', 'type': 'other', 'customColor': None, 'level': 2,
+                         'blocks': [editor_block('text', content='Lorem ipsum dolor sit amet. ' * 5)],
+                         'subsections': []} for j in range(2)],
+    } for i in range(sections)], 'formatting': {}, 'include_toc': True}
+
+
+def timed(fn, repeat=3):
+    best, out = float('inf'), None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000, out
+
+
+def traced(fn):
+    """(result, bytes still allocated by FN once it returns)."""
+    tracemalloc.start()
+    out = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return out, size
+
+
+def main():
+    sections = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    raw = json.dumps(make_draft(sections), ensure_ascii=False).encode('utf-8')
+    print(f"{sections} sections, {len(raw) / 1e6:.1f} MB of JSON")
+
+    json_ms, data = timed(lambda: json.loads(raw))
+    print(f"{'decode (json)':<24} {json_ms:8.1f} ms")
+    if orjson:
+        orjson_ms, _ = timed(lambda: orjson.loads(raw))
+        print(f"{'decode (orjson)':<24} {orjson_ms:8.1f} ms  {json_ms / orjson_ms:.1f}x")
+    parse_ms, doc = timed(lambda: parse_sections(data['sections']))
+    print(f"{'validate + parse':<24} {parse_ms:8.1f} ms")
+
+    _, tree_bytes = traced(lambda: json.loads(raw)['sections'])
+    _, model_bytes = traced(lambda: parse_sections(json.loads(raw)['sections']))
+    print(f"{'dict tree':<24} {tree_bytes / 1e6:8.1f} MB")
+    print(f"{'document model':<24} {model_bytes / 1e6:8.1f} MB  {model_bytes / tree_bytes:.0%} of the dicts")
+
+    layout_ms, layout = timed(lambda: nctu.layout_document(doc, {}, True))
+    render_ms, _ = timed(lambda: nctu.generate_full_html(layout.sections, {}, True, layout=layout))
+    print(f"{'layout (nctu)':<24} {layout_ms:8.1f} ms")
+    print(f"{'render (nctu)':<24} {render_ms:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark: rendering large `tableData` blocks.
+
+Compares the previous cell-by-cell string concatenation (with the inline
+style repeated on every nctu cell) against utils.render_table, reporting
+time and HTML size per template.
+
+    python benchmarks/bench_tables.py [rows] [cols]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_strings import nctu, academic  # noqa: E402
+from template_strings.model import parse_sections  # noqa: E402
+from benchmarks.bench_text_formatting import legacy_format, make_table  # noqa: E402
+
+
+def legacy_nctu_table(table_data, col):
+    table_html = '<table class="content-table" style="width:100%; border-collapse:collapse; margin:10px 0;">'
+    for row_idx, row in enumerate(table_data):
+        table_html += '<tr>'
+        for cell in row:
+            cell_content = legacy_format(cell, col) if cell else '&nbsp;'
+            if row_idx == 0:
+                table_html += f'<th style="border:1px solid #ddd; padding:8px; background:{col}15; font-weight:600; text-align:left;">{cell_content}</th>'
+            else:
+                table_html += f'<td style="border:1px solid #ddd; padding:8px;">{cell_content}</td>'
+        table_html += '</tr>'
+    return table_html + '</table>'
+
+
+def bench(label, fn, repeat=3):
+    best, out = float('inf'), ''
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    print(f"{label:<36} {best * 1000:9.2f} ms {len(out) / 1024:10.1f} KB")
+    return best, len(out)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    cols = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    table = make_table(rows, cols)
+    section, = parse_sections([{'title': 'Data', 'type': 'resume', 'blocks': [{'type': 'table', 'tableData': table}]}])
+    col = nctu.get_section_color(section)
+    print(f"{rows} rows x {cols} cols")
+
+    old_t, old_n = bench('legacy nctu concatenation', lambda: legacy_nctu_table(table, col))
+    new_t, new_n = bench('nctu render_section_content', lambda: nctu.render_section_content(section, '1'))
+    bench('academic render_section_content', lambda: academic.render_section_content(section, '1'))
+    print(f"nctu: {old_t / new_t:.1f}x faster, {100 * (1 - new_n / old_n):.0f}% smaller")
+    pages = nctu.generate_full_html([section], {}, False).count('class="page"')
+    print(f"nctu pages for the table: {pages}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Microbenchmark: inline text formatting on large tables.
+
+Compares the previous per-call re.sub implementation with the precompiled
+formatter in template_strings.utils, for the table cells of a pasted data
+table (many repeated values) and for the full nctu table render.  First
+checks that both templates still format mixed * / ** / link input exactly
+as the previous implementation did.
+
+    python benchmarks/bench_text_formatting.py [rows] [cols]
+"""
+import os
+import re
+import sys
+import html
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_strings import nctu, academic, utils  # noqa: E402
+from template_strings.model import parse_sections  # noqa: E402
+
+
+def legacy_format(text, theme_color):
+    if not text: return ""
+    s = html.escape(text)
+    s = re.sub(r'\*\*(.*?)\*\*', f'<strong style="color: {theme_color}">\\1</strong>', s)
+    s = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2" target="_blank" style="text-decoration: underline; color: inherit;">\1</a>', s)
+    return s.replace('\n', '<br>')
+
+
+def legacy_academic_format(text):
+    if not text: return ""
+    s = html.escape(text)
+    s = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', s)
+    s = re.sub(r'\*(.*?)\*', r'<em>\1</em>', s)
+    s = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2" target="_blank" style="color: #000; text-decoration: underline;">\1</a>', s)
+    return s.replace('\n', '<br>')
+
+
+def mixed_inputs(count=20000, seed=7):
+    """Fixed cases plus random strings of *, **, link syntax and text."""
+    cases = ['2*3 and **bold**', '**a*b**', '*a **b** c*', '***x***', '**a [b** c](d)', '[**a**](b)',
+             '**[a](b)**', '[x](http://a*b*c)', '* item *', '5 * 3 * 2', '**unclosed', 'a ** b * c **']
+    rng = random.Random(seed)
+    tokens = ['*', '**', '***', '[', ']', '(', ')', '](', 'a', 'bc', ' ', '\n', '<', '&', '中']
+    cases += [''.join(rng.choice(tokens) for _ in range(rng.randint(1, 12))) for _ in range(count)]
+    return cases
+
+
+def check_equivalence(color):
+    """Fail loudly if either template formats any mixed input differently from before."""
+    for text in mixed_inputs():
+        for label, new, old in (('academic', academic.process_text_formatting(text), legacy_academic_format(text)),
+                                ('nctu', utils.process_text_formatting(text, color), legacy_format(text, color))):
+            assert new == old, f"{label} output changed for {text!r}:\n  old {old!r}\n  new {new!r}"
+    print(f"{len(mixed_inputs())} mixed inputs format as before (academic and nctu)")
+
+
+def make_table(rows, cols):
+    statuses = ['**OK**', 'pending', 'failed', 'see [docs](https://example.com)', 'n/a']
+    data = [[f'Column {c}' for c in range(cols)]]
+    for r in range(rows):
+        data.append([str(r) if c == 0 else statuses[(r + c) % len(statuses)] if c % 2 else f'value {r % 50}' for c in range(cols)])
+    return data
+
+
+def bench(label, fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    print(f"{label:<44} {best * 1000:9.2f} ms")
+    return best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    cols = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    table = make_table(rows, cols)
+    cells = [cell for row in table for cell in row]
+    color = '#3498db'
+    check_equivalence(color)
+    print(f"{rows} rows x {cols} cols = {len(cells)} cells")
+
+    old = bench('legacy re.sub per cell', lambda: [legacy_format(c, color) for c in cells])
+    formatter = utils.get_formatter(color)
+
+    def cold():
+        formatter._cached.cache_clear()
+        [utils.process_text_formatting(c, color) for c in cells]
+    new_cold = bench('precompiled, cold memo', cold)
+    new_warm = bench('precompiled, warm memo', lambda: [utils.process_text_formatting(c, color) for c in cells])
+    print(f"speedup: {old / new_cold:.1f}x cold, {old / new_warm:.1f}x warm")
+
+    section, = parse_sections([{'title': 'Data', 'blocks': [{'type': 'table', 'tableData': table}]}])
+    bench('nctu.render_section_content (table)', lambda: nctu.render_section_content(section, '1'))
+
+
+if __name__ == '__main__':
+    main()
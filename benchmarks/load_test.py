@@ -0,0 +1,178 @@
+"""Load test: document generation under concurrent long LLM requests.
+
+Runs the app against the offline fake model (LLM_BACKEND=fake) on a WSGI
+server with a bounded number of threads, like a gunicorn gthread worker,
+while some clients keep /api/rephrase busy and others generate documents.
+Two configurations are compared:
+
+    baseline   4 threads, rendering in the request thread (the old setup)
+    tuned      gunicorn.conf.py defaults: 32 threads, render process pool
+
+    python benchmarks/load_test.py [--duration 15] [--llm-clients 12] [--doc-clients 4]
+    python benchmarks/load_test.py --url http://127.0.0.1:8000   # a running server
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CONFIGS = {
+    'baseline': {'threads': 4, 'RENDER_POOL_WORKERS': '0'},
+    'tuned': {'threads': 32, 'RENDER_POOL_WORKERS': '2'},
+}
+
+
+# --- SERVER ---
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """wsgiref server handling requests on a fixed number of threads."""
+
+    request_queue_size = 256
+
+    def __init__(self, address, threads):
+        super().__init__(address, QuietHandler)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve(port, threads):
+    import app
+    server = ThreadPoolWSGIServer(('127.0.0.1', port), threads)
+    server.set_app(app.create_app())
+    app.warmup.start(background=False)
+    print('ready', flush=True)
+    server.serve_forever()
+
+
+# --- CLIENTS ---
+def post(url, payload):
+    req = urllib.request.Request(url, json.dumps(payload).encode(), {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        return resp.read()
+
+
+def make_document(n, sections=60):
+    # Fresh text on every request, so the render cache cannot answer it
+    return {'template': 'nctu', 'include_toc': True, 'sections': [{
+        'id': f's{i}', 'title': f'Section {i}',
+        'blocks': [{'type': 'text', 'content': f'Request {n}: **bold** *italic* [link](#) ' * 20},
+                   {'type': 'table', 'tableData': [['A', 'B', 'C']] + [[f'{n}', f'**{r}**', 'x'] for r in range(20)]}],
+        'subsections': [{'id': f's{i}-{j}', 'title': 'Detail', 'blocks': [{'type': 'text', 'content': f'{n} detail ' * 30}]}
+                        for j in range(2)],
+    } for i in range(sections)]}
+
+
+def run_load(base, duration, llm_clients, doc_clients):
+    stop = time.time() + duration
+    latencies, rephrased, errors = [], [0], [0]
+    lock = threading.Lock()
+
+    def llm_client(c):
+        i = 0
+        while time.time() < stop:
+            i += 1
+            try:
+                post(base + '/api/rephrase', {'text': f'client {c} text {i}', 'api_key': 'load-test', 'no_cache': True})
+                with lock:
+                    rephrased[0] += 1
+            except Exception:
+                with lock:
+                    errors[0] += 1
+
+    def doc_client(c):
+        i = 0
+        while time.time() < stop:
+            i += 1
+            t = time.perf_counter()
+            try:
+                post(base + '/api/generate-document', make_document(c * 100000 + i))
+                with lock:
+                    latencies.append(time.perf_counter() - t)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=llm_client, args=(c,)) for c in range(llm_clients)]
+    threads += [threading.Thread(target=doc_client, args=(c,)) for c in range(doc_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else float('nan')
+    return {'docs': len(latencies), 'docs_per_s': len(latencies) / duration, 'p50_ms': pick(0.5),
+            'p95_ms': pick(0.95), 'rephrased': rephrased[0], 'errors': errors[0]}
+
+
+def start_server(name, port, latency):
+    config = CONFIGS[name]
+    env = dict(os.environ, LLM_BACKEND='fake', LLM_FAKE_LATENCY=str(latency),
+               RENDER_POOL_WORKERS=config['RENDER_POOL_WORKERS'])
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port), str(config['threads'])],
+                            cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True)
+    proc.stdout.readline()  # "ready"
+    return proc
+
+
+def report(name, result):
+    print(f"{name:<10} {result['docs']:6d} docs {result['docs_per_s']:7.2f}/s  p50 {result['p50_ms']:8.0f} ms  "
+          f"p95 {result['p95_ms']:8.0f} ms  {result['rephrased']:5d} rephrases  {result['errors']} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url')
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--llm-clients', type=int, default=12)
+    parser.add_argument('--doc-clients', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=2.0, help='fake model latency in seconds')
+    parser.add_argument('--serve', nargs=2, type=int, metavar=('PORT', 'THREADS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(*args.serve)
+
+    print(f"{args.duration:.0f}s, {args.llm_clients} rephrase clients ({args.latency}s model latency), "
+          f"{args.doc_clients} document clients")
+    if args.url:
+        return report('server', run_load(args.url.rstrip('/'), args.duration, args.llm_clients, args.doc_clients))
+
+    results = {}
+    for port, name in enumerate(CONFIGS, start=5601):
+        proc = start_server(name, port, args.latency)
+        try:
+            results[name] = run_load(f'http://127.0.0.1:{port}', args.duration, args.llm_clients, args.doc_clients)
+        finally:
+            proc.terminate()
+            proc.wait()
+        report(name, results[name])
+    if results['baseline']['docs']:
+        print(f"document throughput: {results['tuned']['docs'] / results['baseline']['docs']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
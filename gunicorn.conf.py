@@ -0,0 +1,41 @@
+# Production server: gunicorn -c gunicorn.conf.py
+# Every setting below can be tuned through the environment.
+import os
+import multiprocessing
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Threads rather than greenlets: a request waiting on Gemini only parks its
+# thread (the call itself runs on the LLM gateway's event loop), so plenty of
+# threads per worker keep long rephrases from starving document generation,
+# whose CPU-heavy part runs in the render pool's processes (RENDER_POOL_WORKERS
+# per worker).
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+
+# gthread workers heartbeat independently of request length, so long SSE
+# streams are not killed by this; it only catches hung workers
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+# On SIGTERM, in-flight requests get this long to finish
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = max_requests // 10
+
+
+def post_worker_init(worker):
+    """Runs in every worker right after fork, once the app is loaded.
+
+    Preloads the model client and templates on a background thread so the
+    first AI request of a fresh worker does not pay for imports and setup.
+    """
+    import app
+    if app.app.config['WARMUP']:
+        app.warmup.start()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
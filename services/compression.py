@@ -0,0 +1,182 @@
+import io
+import re
+import zlib
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+from .lru import SizedLRU
+
+# Levels tuned for latency: most of the ratio at a fraction of the CPU of the maximum
+DEFAULT_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 5}
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript',
+                      'image/svg+xml')
+# An encoded representation's ETag is the identity ETag plus a suffix: "abc" -> "abc-br"
+ETAG_SUFFIX_RE = re.compile(r'-(?:br|zstd|gzip)"')
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+def encodings():
+    """Content codings this server can produce, in order of preference."""
+    return [name for name, module in (('br', brotli), ('zstd', zstandard), ('gzip', gzip)) if module]
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def iter_compressed(chunks, encoding, level, charset='utf-8'):
+    """Compress a streamed body, flushing after every chunk so each page still arrives on its own."""
+    if encoding == 'br':
+        c = brotli.Compressor(quality=level)
+        step, finish = (lambda b: c.process(b) + c.flush()), c.finish
+    elif encoding == 'zstd':
+        c = zstandard.ZstdCompressor(level=level).compressobj()
+        step, finish = (lambda b: c.compress(b) + c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)), c.flush
+    else:
+        c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        step, finish = (lambda b: c.compress(b) + c.flush(zlib.Z_SYNC_FLUSH)), c.flush
+    for chunk in chunks:
+        out = step(chunk.encode(charset) if isinstance(chunk, str) else chunk)
+        if out:
+            yield out
+    yield finish()
+
+
+def _read_capped(reader, limit):
+    """Up to LIMIT + 1 bytes from a decompressing READER, so an oversized body is detected without inflating it."""
+    out = bytearray()
+    while len(out) <= limit:
+        chunk = reader.read(limit + 1 - len(out))
+        if not chunk:
+            break
+        out += chunk
+    return bytes(out)
+
+
+def decompress(data, encoding, limit):
+    """Decode a request body; raises BodyTooLarge past LIMIT bytes, UnsupportedEncoding or ValueError.
+
+    Output stops just past LIMIT, so a small, highly compressed body cannot
+    inflate into unbounded memory.  br is not accepted for requests: the
+    brotli module has no way to bound its output.
+    """
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        d = zlib.decompressobj(zlib.MAX_WBITS if encoding == 'deflate' else 16 + zlib.MAX_WBITS)
+        decode, error = (lambda b: d.decompress(b, limit + 1)), zlib.error
+    elif encoding == 'zstd' and zstandard:
+        # A stream reader ignores the frame's declared content size instead of allocating it
+        decode, error = (lambda b: _read_capped(zstandard.ZstdDecompressor().stream_reader(io.BytesIO(b)), limit)), \
+            zstandard.ZstdError
+    else:
+        raise UnsupportedEncoding(f'Unsupported Content-Encoding: {encoding}')
+    try:
+        out = decode(data)
+    except error as e:
+        raise ValueError(f'Invalid {encoding} body: {e}')
+    if len(out) > limit:
+        raise BodyTooLarge(f'Decompressed body exceeds {limit} bytes')
+    return out
+
+
+class Compressor:
+    """Negotiated response compression and compressed (gzip, zstd) request bodies.
+
+    Responses of a compressible type and at least MIN_SIZE bytes are
+    encoded with the client's best match among br, zstd (when those
+    modules are installed) and gzip; streamed ones are compressed chunk by
+    chunk.  A response with a strong ETag is compressed once per encoding
+    and kept in a bounded cache, so cached documents and stylesheets are
+    served precompressed.  Its ETag gets an encoding suffix, which is
+    stripped from If-None-Match again before the view compares it.
+    """
+
+    def __init__(self, min_size=1024, levels=None, cache_bytes=32 * 1024 * 1024):
+        self.min_size = min_size
+        self.levels = dict(DEFAULT_LEVELS, **(levels or {}))
+        self.cache = SizedLRU(cache_bytes)
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.requests_decoded = 0
+
+    # --- REQUESTS ---
+    def prepare_request(self, environ, limit):
+        """Decode a compressed body in ENVIRON and normalize If-None-Match; call before the body is read."""
+        if environ.get('HTTP_IF_NONE_MATCH'):
+            environ['HTTP_IF_NONE_MATCH'] = ETAG_SUFFIX_RE.sub('"', environ['HTTP_IF_NONE_MATCH'])
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding in ('', 'identity'):
+            return
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        if length > limit:
+            raise BodyTooLarge(f'Request body exceeds {limit} bytes')
+        # Without a Content-Length (chunked), read no more than one byte past the limit
+        raw = environ['wsgi.input'].read(length or limit + 1)
+        if len(raw) > limit:
+            raise BodyTooLarge(f'Request body exceeds {limit} bytes')
+        body = decompress(raw, encoding, limit)
+        environ['wsgi.input'] = io.BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+        del environ['HTTP_CONTENT_ENCODING']
+        self.requests_decoded += 1
+
+    # --- RESPONSES ---
+    def compress_response(self, response, accept_encodings):
+        """Encode RESPONSE for the request's ACCEPT_ENCODINGS (a werkzeug Accept) where it pays off."""
+        if (response.status_code < 200 or response.status_code in (204, 206, 304) or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = accept_encodings.best_match(encodings()) if accept_encodings else None
+        if encoding is None:
+            return response
+        level = self.levels[encoding]
+        etag, weak = response.get_etag()
+
+        if response.is_streamed:
+            response.response = iter_compressed(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            key = (etag, encoding) if etag and not weak else None
+            body = self.cache.get(key) if key else None
+            if body is None:
+                body = compress(data, encoding, level)
+                if key:
+                    self.cache.put(key, body)
+            response.set_data(body)
+            self.bytes_in += len(data)
+            self.bytes_out += len(body)
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak)
+        response.headers['Content-Encoding'] = encoding
+        self.responses += 1
+        return response
+
+    def stats(self):
+        return {'encodings': encodings(), 'levels': self.levels, 'min_size': self.min_size,
+                'responses': self.responses, 'requests_decoded': self.requests_decoded,
+                'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+                'precompressed': self.cache.stats()}
@@ -0,0 +1,192 @@
+import copy
+import json
+import time
+import uuid
+
+from .sqlite_store import SQLiteStore
+
+DEFAULT_TTL = 2 * 60 * 60
+DEFAULT_MAX_SESSIONS = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    document TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    touched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched);
+"""
+
+
+class PatchError(ValueError):
+    pass
+
+
+class VersionConflict(Exception):
+    def __init__(self, current):
+        super().__init__(f"Document is at version {current}")
+        self.current = current
+
+
+# --- JSON PATCH (RFC 6902 subset: add, remove, replace, move, copy, test) ---
+def parse_pointer(path):
+    if path == '':
+        return []
+    if not path.startswith('/'):
+        raise PatchError(f"Invalid JSON pointer: {path!r}")
+    return [t.replace('~1', '/').replace('~0', '~') for t in path[1:].split('/')]
+
+
+def _index(container, token, allow_end=False):
+    if token == '-' and allow_end:
+        return len(container)
+    if not token.isdigit():
+        raise PatchError(f"Invalid array index: {token!r}")
+    i = int(token)
+    if i > len(container) or (i == len(container) and not allow_end):
+        raise PatchError(f"Array index out of range: {i}")
+    return i
+
+
+def _walk(doc, tokens):
+    node = doc
+    for token in tokens:
+        try:
+            node = node[_index(node, token)] if isinstance(node, list) else node[token]
+        except (KeyError, TypeError):
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+    return node
+
+
+def _remove(doc, tokens):
+    parent = _walk(doc, tokens[:-1])
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, tokens[-1]))
+    if not isinstance(parent, dict) or tokens[-1] not in parent:
+        raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+    return parent.pop(tokens[-1])
+
+
+def _add(doc, tokens, value, replace=False):
+    if not tokens:
+        return value
+    parent = _walk(doc, tokens[:-1])
+    if isinstance(parent, list):
+        i = _index(parent, tokens[-1], allow_end=not replace)
+        if replace:
+            parent[i] = value
+        else:
+            parent.insert(i, value)
+    elif isinstance(parent, dict):
+        if replace and tokens[-1] not in parent:
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+        parent[tokens[-1]] = value
+    else:
+        raise PatchError(f"Cannot add to /{'/'.join(tokens[:-1])}")
+    return doc
+
+
+def apply_patch(doc, ops):
+    """Apply the JSON Patch OPS to DOC in place and return the result."""
+    if not isinstance(ops, list):
+        raise PatchError("ops must be a list")
+    for op in ops:
+        if not isinstance(op, dict) or not isinstance(op.get('path', ''), str) or not isinstance(op.get('from', ''), str):
+            raise PatchError(f"Invalid patch operation: {op!r}")
+        kind = op.get('op')
+        tokens = parse_pointer(op.get('path', ''))
+        if kind == 'add':
+            doc = _add(doc, tokens, op.get('value'))
+        elif kind == 'replace':
+            doc = _add(doc, tokens, op.get('value'), replace=True)
+        elif kind == 'remove':
+            if not tokens:
+                raise PatchError("Cannot remove the document root")
+            _remove(doc, tokens)
+        elif kind in ('move', 'copy'):
+            src = parse_pointer(op.get('from', ''))
+            if kind == 'move' and tokens[:len(src)] == src and tokens != src:
+                raise PatchError("Cannot move a value into itself")
+            value = _remove(doc, src) if kind == 'move' else copy.deepcopy(_walk(doc, src))
+            doc = _add(doc, tokens, value)
+        elif kind == 'test':
+            if _walk(doc, tokens) != op.get('value'):
+                raise PatchError(f"Test failed at {op.get('path')}")
+        else:
+            raise PatchError(f"Unknown op: {kind!r}")
+    return doc
+
+
+# --- SESSIONS ---
+class SessionStore(SQLiteStore):
+    """Documents that clients edit by sending patches, kept in a SQLite file.
+
+    Any server worker can patch or render a session another one created.
+    Sessions expire after TTL seconds without use; beyond MAX_SESSIONS the
+    least recently used ones are dropped.
+    """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+
+    def create(self, document):
+        """Store DOCUMENT; returns (session_id, version)."""
+        sid, now = uuid.uuid4().hex, time.time()
+
+        def run(db):
+            db.execute('DELETE FROM sessions WHERE touched < ?', (now - self.ttl,))
+            db.execute('INSERT INTO sessions VALUES (?, ?, 1, ?)', (sid, json.dumps(document), now))
+            db.execute('DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY touched DESC '
+                       'LIMIT -1 OFFSET ?)', (self.max_sessions,))
+        self._transaction(run)
+        return sid, 1
+
+    def get(self, sid):
+        """(document, version) of session SID, or None if unknown or expired; the document is a fresh copy."""
+        now = time.time()
+
+        def run(db):
+            row = db.execute('SELECT document, version FROM sessions WHERE id = ? AND touched >= ?',
+                             (sid, now - self.ttl)).fetchone()
+            if row:
+                db.execute('UPDATE sessions SET touched = ? WHERE id = ?', (now, sid))
+            return row
+        row = self._transaction(run)
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def patch(self, sid, ops, base_version=None, validate=None):
+        """Apply OPS to session SID atomically; returns the new version, or None if the session is unknown.
+
+        Raises PatchError on a bad op and VersionConflict when BASE_VERSION
+        is stale.  VALIDATE(document) is called on the patched copy before
+        it is stored; if it raises, the session keeps its previous document
+        and version.
+        """
+        now = time.time()
+
+        def run(db):
+            row = db.execute('SELECT document, version FROM sessions WHERE id = ? AND touched >= ?',
+                             (sid, now - self.ttl)).fetchone()
+            if row is None:
+                return None
+            if base_version is not None and base_version != row[1]:
+                raise VersionConflict(row[1])
+            document = apply_patch(json.loads(row[0]), ops)
+            if validate:
+                validate(document)
+            db.execute('UPDATE sessions SET document = ?, version = ?, touched = ? WHERE id = ?',
+                       (json.dumps(document), row[1] + 1, now, sid))
+            return row[1] + 1
+        return self._transaction(run)
+
+    def delete(self, sid):
+        return self._execute('DELETE FROM sessions WHERE id = ?', (sid,)) > 0
+
+    def stats(self):
+        count = self._query('SELECT COUNT(*) FROM sessions WHERE touched >= ?', (time.time() - self.ttl,))[0]
+        return {'sessions': count, 'ttl': self.ttl, 'max_sessions': self.max_sessions}
@@ -0,0 +1,58 @@
+import io
+import os
+import re
+import hashlib
+import zipfile
+
+ASSET_SRC_RE = re.compile(r'''(src=["'])(/static/uploads/[^"']+)(["'])''')
+ASSET_DIR = 'assets'
+
+
+def asset_urls(html_doc):
+    """Distinct upload URLs referenced by HTML_DOC, in document order."""
+    return list(dict.fromkeys(m.group(2) for m in ASSET_SRC_RE.finditer(html_doc)))
+
+
+def _file_digest(filepath):
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_bundle(html_doc, resolve_path, index_name='index.html'):
+    """Package HTML_DOC and the uploads it links to as a zip archive.
+
+    Every /static/uploads reference is rewritten to a relative
+    assets/<hash><ext> path, and each distinct image is stored once no matter
+    how often it appears.  RESOLVE_PATH maps an upload URL to a file on disk
+    (or None for a missing file, which is left untouched).  Returns a BytesIO
+    positioned at the start.
+    """
+    rewrites = {}
+    members = {}
+    for url in asset_urls(html_doc):
+        filepath = resolve_path(url)
+        if not filepath:
+            continue
+        # Store URLs already carry the content hash; legacy names are hashed here
+        digest, ext = os.path.splitext(os.path.basename(filepath))
+        if len(digest) != 64:
+            digest = _file_digest(filepath)
+        name = f"{ASSET_DIR}/{digest}{ext.lower()}"
+        members[name] = filepath
+        rewrites[url] = name
+
+    def _rewrite(m):
+        return m.group(1) + rewrites.get(m.group(2), m.group(2)) + m.group(3)
+    html_doc = ASSET_SRC_RE.sub(_rewrite, html_doc)
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr(index_name, html_doc, compress_type=zipfile.ZIP_DEFLATED)
+        # Images are already compressed; storing them avoids wasted CPU
+        for name, filepath in members.items():
+            zf.write(filepath, name, compress_type=zipfile.ZIP_STORED)
+    buf.seek(0)
+    return buf
@@ -0,0 +1,94 @@
+import re
+
+FIX_HTML_PROMPT = """
+You are an expert HTML and Content Editor.
+Your task is to refine the following HTML content based on this instruction: "{instruction}"
+
+Rules:
+1. Correct any grammar or spelling errors in the text content.
+2. Improve the professional tone of the text.
+3. DO NOT remove existing CSS classes (like 'title', 'content-block', 'page').
+4. DO NOT remove structural divs (like 'page', 'page-content').
+5. Keep every image placeholder (like __IMG_0__) exactly as it is.
+6. Return ONLY the raw HTML code. Do not return Markdown formatting (no ```html).
+
+Input HTML:
+{html}
+"""
+
+DIV_RE = re.compile(r'<(/?)div\b([^>]*)>', re.IGNORECASE)
+CLASS_RE = re.compile(r'''class\s*=\s*["']([^"']*)["']''', re.IGNORECASE)
+DATA_URI_RE = re.compile(r'data:[\w.+-]+/[\w.+-]+(?:;[\w=.+-]+)*,[A-Za-z0-9+/=%\s]*?(?=["\')])')
+PLACEHOLDER_RE = re.compile(r'__IMG_(\d+)__')
+
+
+def _classes(attrs):
+    m = CLASS_RE.search(attrs)
+    return m.group(1).split() if m else []
+
+
+def div_spans(html, cls):
+    """(start, inner_start, inner_end, end) of every outermost <div> carrying class CLS."""
+    spans, depth, start, inner = [], 0, None, None
+    for m in DIV_RE.finditer(html):
+        if m.group(1):
+            if depth:
+                depth -= 1
+                if not depth:
+                    spans.append((start, inner, m.start(), m.end()))
+        elif depth:
+            depth += 1
+        elif cls in _classes(m.group(2)):
+            depth, start, inner = 1, m.start(), m.end()
+    return spans
+
+
+def split_fragments(html):
+    """Split HTML into [(text, editable)] parts that join back to HTML.
+
+    Editable parts are the inner HTML of each .page-content (or of each
+    .page when a page has no content div); chrome such as sidebars, nav
+    pills and page numbers is passed through untouched.  A document without
+    pages is one editable part.
+    """
+    pages = div_spans(html, 'page')
+    if not pages:
+        return [(html, True)]
+    parts, pos = [], 0
+    for _, start, end, _ in pages:
+        inner = html[start:end]
+        spans = [(s, e) for _, s, e, _ in div_spans(inner, 'page-content')] or [(0, len(inner))]
+        for s, e in spans:
+            # Surrounding whitespace stays with the chrome; model replies are stripped
+            while s < e and inner[s].isspace():
+                s += 1
+            while e > s and inner[e - 1].isspace():
+                e -= 1
+            parts.append((html[pos:start + s], False))
+            parts.append((inner[s:e], True))
+            pos = start + e
+    parts.append((html[pos:], False))
+    return [(text, editable) for text, editable in parts if text or editable]
+
+
+def mask_images(fragment):
+    """Swap data URIs for short placeholders; returns (masked, uris)."""
+    uris = []
+
+    def swap(m):
+        uris.append(m.group(0))
+        return f"__IMG_{len(uris) - 1}__"
+
+    return DATA_URI_RE.sub(swap, fragment), uris
+
+
+def restore_images(fragment, uris):
+    def put_back(m):
+        i = int(m.group(1))
+        return uris[i] if i < len(uris) else m.group(0)
+
+    return PLACEHOLDER_RE.sub(put_back, fragment)
+
+
+def clean_reply(text):
+    return (text or '').replace('```html', '').replace('```', '').strip()
@@ -0,0 +1,37 @@
+import os
+import base64
+import mimetypes
+
+from .lru import SizedLRU
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def guess_mime(filepath):
+    return mimetypes.guess_type(filepath)[0] or 'image/png'
+
+
+class DataURICache(SizedLRU):
+    """Bounded LRU of Base64 data URIs for files on disk.
+
+    Entries are keyed by (path, mtime, size), so a file replaced on disk is
+    simply a miss.  The bound is on the total length of cached URIs; the
+    least recently used ones are dropped first.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(max_bytes)
+
+    def get(self, filepath):
+        """Return the data URI for FILEPATH, reading and encoding it on a miss."""
+        st = os.stat(filepath)
+        key = (filepath, st.st_mtime_ns, st.st_size)
+        uri = super().get(key)
+        if uri is not None:
+            return uri
+
+        with open(filepath, 'rb') as f:
+            b64 = base64.b64encode(f.read()).decode()
+        uri = f"data:{guess_mime(filepath)};base64,{b64}"
+        self.put(key, uri)
+        return uri
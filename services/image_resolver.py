@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+UPLOAD_PREFIX = '/static/uploads/'
+
+
+class ImageResolver:
+    """Resolve every image of a document in one pass.
+
+    Distinct upload URLs are turned into data URIs exactly once per document,
+    however often they are referenced, and the reads run concurrently on a
+    shared thread pool.
+    """
+
+    def __init__(self, store, cache, max_workers=8):
+        self.store = store
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-resolve')
+
+    def _encode(self, url, variant=None):
+        url = self.store.variant_url(url, variant)
+        filepath = self.store.resolve_url(url)
+        if not filepath:
+            return url
+        try:
+            return self.cache.get(filepath)
+        except Exception as e:
+            print(f"Error encoding {filepath}: {e}")
+            return url
+
+    def resolve_urls(self, urls, embed=True, variant=None):
+        """{url: data URI} for the upload URLs among URLS (see model.embed_images).
+
+        VARIANT picks a stored rendition ('print', 'preview') where one
+        exists; without EMBED the URLs map to that rendition's URL instead.
+        """
+        urls = list(dict.fromkeys(url for url in urls if url.startswith(UPLOAD_PREFIX)))
+        if not embed:
+            return {url: self.store.variant_url(url, variant) for url in urls}
+        if len(urls) == 1:
+            return {urls[0]: self._encode(urls[0], variant)}
+        return dict(zip(urls, self._pool.map(lambda url: self._encode(url, variant), urls)))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
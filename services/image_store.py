@@ -0,0 +1,241 @@
+import os
+import json
+import sqlite3
+import hashlib
+import tempfile
+
+from .sqlite_store import SQLiteStore
+
+LEGACY_INDEX_NAME = 'index.json'
+EXT_ALIASES = {'.jpeg': '.jpg', '.jpe': '.jpg'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    digest TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    name TEXT,
+    refs INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS variants (
+    digest TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    PRIMARY KEY (digest, name)
+);
+"""
+
+
+def normalize_ext(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return EXT_ALIASES.get(ext, ext)
+
+
+class ImageStore(SQLiteStore):
+    """Content-addressed image store.
+
+    Every upload is keyed by the SHA-256 of its bytes and written once to
+    ROOT/<hash[:2]>/<hash><ext>; uploading the same picture again is a hash
+    plus one index lookup.  Derived renditions (see image_variants) sit next
+    to the original as <hash>.<variant><ext>.  The index is a SQLite file at
+    INDEX_PATH, so every server worker sees uploads made through the others.
+    It counts the uploads of each image; release() drops one, and the files
+    go with the last.
+    """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, root, index_path, url_prefix='/static/uploads'):
+        super().__init__(index_path)
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    # --- INDEX ---
+    def _opened(self, db):
+        self._migrate(db)
+        self._import_legacy(db)
+
+    def _migrate(self, db):
+        """Add the refs column to an index created before uploads were counted."""
+        columns = [row[1] for row in db.execute('PRAGMA table_info(images)')]
+        if 'refs' not in columns:
+            try:
+                db.execute('ALTER TABLE images ADD COLUMN refs INTEGER NOT NULL DEFAULT 1')
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+
+    def _import_legacy(self, db):
+        """Fill an empty index from the old index.json, or from the sharded directories on disk."""
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if db.execute('SELECT 1 FROM images LIMIT 1').fetchone() is None:
+                images, variants = self._read_legacy_index() or self._scan_shards()
+                db.executemany('INSERT OR IGNORE INTO images VALUES (?, ?, ?, ?, ?)', images)
+                db.executemany('INSERT OR IGNORE INTO variants VALUES (?, ?, ?)', variants)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def _read_legacy_index(self):
+        path = os.path.join(self.root, LEGACY_INDEX_NAME)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Image index unreadable, rebuilding: {e}")
+            return None
+        images = [(d, e['ext'], e['size'], (e.get('names') or [None])[0], e.get('refs', 1))
+                  for d, e in entries.items()]
+        variants = [(d, v, ext) for d, e in entries.items() for v, ext in e.get('variants', {}).items()]
+        return images, variants
+
+    def _scan_shards(self):
+        """Index rows for the files in the sharded directories on disk."""
+        images, variants = [], []
+        if not os.path.isdir(self.root):
+            return images, variants
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                parts = name.split('.')
+                if not parts[0].startswith(shard):
+                    continue
+                if len(parts) > 2:
+                    variants.append((parts[0], parts[1], '.' + parts[-1]))
+                else:
+                    ext = '.' + parts[1] if len(parts) == 2 else ''
+                    images.append((parts[0], ext, os.path.getsize(os.path.join(shard_dir, name)), None, 1))
+        return images, variants
+
+    # --- PATHS ---
+    def _filename(self, digest, variant=None):
+        """File name of DIGEST (or one of its variants), or None if unknown."""
+        if variant:
+            row = self._query('SELECT ext FROM variants WHERE digest = ? AND name = ?', (digest, variant))
+            return f"{digest}.{variant}{row[0]}" if row else None
+        row = self._query('SELECT ext FROM images WHERE digest = ?', (digest,))
+        return digest + row[0] if row else None
+
+    def path_for(self, digest, variant=None):
+        name = self._filename(digest, variant)
+        return os.path.join(self.root, digest[:2], name) if name else None
+
+    def url_for(self, digest, variant=None):
+        name = self._filename(digest, variant)
+        return f"{self.url_prefix}/{digest[:2]}/{name}" if name else None
+
+    def _parse_url(self, url):
+        """Split a store URL into (digest, variant); (None, None) if it is not one."""
+        if not url or not url.startswith(self.url_prefix + '/'):
+            return None, None
+        parts = url[len(self.url_prefix) + 1:].split('/')
+        if len(parts) != 2:
+            return None, None
+        names = parts[1].split('.')
+        digest = names[0]
+        if len(digest) != 64 or not digest.startswith(parts[0]):
+            return None, None
+        if self._query('SELECT 1 FROM images WHERE digest = ?', (digest,)) is None:
+            return None, None
+        return digest, (names[1] if len(names) > 2 else None)
+
+    def digest_from_url(self, url):
+        """Return the content hash encoded in a store URL, or None."""
+        return self._parse_url(url)[0]
+
+    def variant_url(self, url, variant):
+        """URL of the VARIANT rendition of URL, or URL itself if there is none."""
+        digest, _ = self._parse_url(url)
+        if digest and variant:
+            return self.url_for(digest, variant) or url
+        return url
+
+    def resolve_url(self, url):
+        """Map an upload URL to a file path, or None if it is not stored here.
+
+        Hashed URLs are answered from the index; flat legacy names
+        (img_<timestamp>.jpg) still fall back to a filesystem check.
+        """
+        digest, variant = self._parse_url(url)
+        if digest:
+            return self.path_for(digest, variant)
+        if url and url.startswith(self.url_prefix + '/'):
+            filepath = os.path.join(self.root, os.path.basename(url))
+            if os.path.exists(filepath):
+                return filepath
+        return None
+
+    # --- WRITES ---
+    def _write(self, digest, name, data, prefix):
+        shard_dir = os.path.join(self.root, digest[:2])
+        os.makedirs(shard_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=shard_dir, prefix=prefix)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(shard_dir, name))
+
+    def put(self, data, filename=''):
+        """Store DATA (bytes), returning (digest, created); a repeat upload adds a reference."""
+        digest = hashlib.sha256(data).hexdigest()
+        ext = normalize_ext(filename)
+
+        def store(db):
+            if db.execute('UPDATE images SET refs = refs + 1 WHERE digest = ?', (digest,)).rowcount:
+                return False
+            # The file goes first so an indexed image always exists; holding
+            # the write lock keeps a concurrent release() from deleting it
+            # before the row lands
+            self._write(digest, digest + ext, data, '.upload-')
+            db.execute('INSERT INTO images VALUES (?, ?, ?, ?, 1)', (digest, ext, len(data), filename or None))
+            return True
+        return digest, self._transaction(store)
+
+    def release(self, digest):
+        """Drop one reference to DIGEST; the last one removes the image and its variants.
+
+        Returns False if DIGEST is not stored.
+        """
+        def drop(db):
+            row = db.execute('SELECT ext, refs FROM images WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                return False
+            ext, refs = row
+            if refs > 1:
+                db.execute('UPDATE images SET refs = refs - 1 WHERE digest = ?', (digest,))
+                return True
+            names = [f"{digest}.{name}{vext}" for name, vext in
+                     db.execute('SELECT name, ext FROM variants WHERE digest = ?', (digest,))]
+            db.execute('DELETE FROM variants WHERE digest = ?', (digest,))
+            db.execute('DELETE FROM images WHERE digest = ?', (digest,))
+            # Removed before COMMIT, so a put() of the same bytes waiting on
+            # the lock writes a fresh file afterwards
+            for name in [digest + ext] + names:
+                try:
+                    os.remove(os.path.join(self.root, digest[:2], name))
+                except FileNotFoundError:
+                    pass
+            return True
+        return self._transaction(drop)
+
+    def add_variant(self, digest, variant, data, ext):
+        """Store a derived rendition (e.g. a downscaled copy) of DIGEST."""
+        def store(db):
+            if db.execute('SELECT 1 FROM images WHERE digest = ?', (digest,)).fetchone() is None:
+                return False
+            self._write(digest, f"{digest}.{variant}{ext}", data, '.variant-')
+            db.execute('INSERT OR REPLACE INTO variants VALUES (?, ?, ?)', (digest, variant, ext))
+            return True
+        return self.url_for(digest, variant) if self._transaction(store) else None
+
+    def stats(self):
+        with self._lock:
+            db = self._conn()
+            images, total, refs = db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refs), 0) FROM images').fetchone()
+            variants = db.execute('SELECT COUNT(*) FROM variants').fetchone()[0]
+        return {'images': images, 'bytes': total, 'references': refs, 'variants': variants}
@@ -0,0 +1,93 @@
+import io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it uploads are served as-is
+    Image = None
+
+A4_WIDTH_IN = 210 / 25.4
+
+# name -> (target DPI across a full A4 width, format for opaque images)
+VARIANTS = {
+    'print': (200, 'JPEG'),
+    'preview': (96, 'WEBP'),
+}
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp', 'PNG': '.png'}
+
+
+def available():
+    return Image is not None
+
+
+def dimensions(path):
+    """(width, height) of the image at PATH, read from its header; None if unknown."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except (OSError, ValueError):
+        return None
+
+
+def max_width(dpi):
+    return int(round(A4_WIDTH_IN * dpi))
+
+
+def _encode(img, fmt):
+    buf = io.BytesIO()
+    if fmt == 'JPEG':
+        img.convert('RGB').save(buf, 'JPEG', quality=85, optimize=True, progressive=True)
+    elif fmt == 'WEBP':
+        img.save(buf, 'WEBP', quality=78, method=4)
+    else:
+        img.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+
+def make_variants(data):
+    """Return {name: (bytes, ext)} for the downscaled versions of image DATA.
+
+    Each variant is capped at the pixel width of an A4 page at its DPI,
+    EXIF orientation is applied and all metadata is dropped.  Images with
+    transparency keep it (PNG for print, WebP for preview).  A variant that
+    would not be smaller than the original is skipped, so callers fall back
+    to the original file.
+    """
+    if Image is None:
+        return {}
+    try:
+        src = Image.open(io.BytesIO(data))
+        src = ImageOps.exif_transpose(src)
+    except Exception as e:
+        print(f"Variant decode error: {e}")
+        return {}
+    has_alpha = src.mode in ('RGBA', 'LA') or (src.mode == 'P' and 'transparency' in src.info)
+    src = src.convert('RGBA' if has_alpha else 'RGB')
+
+    out = {}
+    for name, (dpi, fmt) in VARIANTS.items():
+        if has_alpha and fmt == 'JPEG':
+            fmt = 'PNG'
+        img = src
+        limit = max_width(dpi)
+        if img.width > limit:
+            img = img.resize((limit, max(1, round(img.height * limit / img.width))), Image.LANCZOS)
+        encoded = _encode(img, fmt)
+        if len(encoded) < len(data):
+            out[name] = (encoded, EXTENSIONS[fmt])
+    return out
+
+
+def generate_variants(store, digest):
+    """Create and register the variants of a stored image; returns their names."""
+    if Image is None:
+        return []
+    filepath = store.path_for(digest)
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    created = []
+    for name, (encoded, ext) in make_variants(data).items():
+        store.add_variant(digest, name, encoded, ext)
+        created.append(name)
+    return created
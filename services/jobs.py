@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .sqlite_store import SQLiteStore
+
+DEFAULT_TTL = 15 * 60
+
+INTERRUPTED = 'Job was interrupted'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    stage TEXT,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    pid INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key);
+"""
+
+
+def process_alive(pid):
+    """Whether process PID still exists on this host (None, for jobs from before pids were kept, does not)."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue(SQLiteStore):
+    """Background jobs run on worker threads, tracked in a SQLite file.
+
+    Status, progress and results live in the database, so any server worker
+    can answer polls for a job another one is running.  Submitting a KEY
+    that already has a queued, running or finished job returns that job
+    instead of starting a new one; failed jobs are not reused.  Finished
+    jobs are dropped TTL seconds after their last update.  Each job records
+    the pid of the worker whose threads run it; an unfinished job counts as
+    failed only once that process is gone, however long it has been queued.
+    """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path, workers=2, ttl=DEFAULT_TTL):
+        super().__init__(path)
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='jobs')
+
+    def _opened(self, db):
+        # Job tables created before owners were recorded lack the pid column
+        if 'pid' not in [row[1] for row in db.execute('PRAGMA table_info(jobs)')]:
+            try:
+                db.execute('ALTER TABLE jobs ADD COLUMN pid INTEGER')
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+
+    def _interrupted(self, state, pid):
+        return state in ('queued', 'running') and not process_alive(pid)
+
+    def submit(self, key, func):
+        """Queue FUNC(progress) under KEY; returns (job_id, coalesced).
+
+        FUNC reports through progress(stage, done=0, total=0) and returns a
+        JSON-serialisable result.
+        """
+        now = time.time()
+
+        def run(db):
+            db.execute("DELETE FROM jobs WHERE state IN ('done', 'error') AND updated < ?", (now - self.ttl,))
+            row = db.execute("SELECT id, state, pid FROM jobs WHERE key = ? AND state != 'error' "
+                             "ORDER BY created DESC LIMIT 1", (key,)).fetchone()
+            if row and not self._interrupted(row[1], row[2]):
+                return row[0], True
+            if row:
+                db.execute("UPDATE jobs SET state = 'error', error = ?, updated = ? WHERE id = ?",
+                           (INTERRUPTED, now, row[0]))
+            job_id = uuid.uuid4().hex
+            db.execute("INSERT INTO jobs (id, key, state, created, updated, pid) VALUES (?, ?, 'queued', ?, ?, ?)",
+                       (job_id, key, now, now, os.getpid()))
+            return job_id, False
+        job_id, coalesced = self._transaction(run)
+        if not coalesced:
+            self._pool.submit(self._run, job_id, func)
+        return job_id, coalesced
+
+    def _update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _run(self, job_id, func):
+        self._update(job_id, state='running')
+        last = [None, 0.0]
+
+        def progress(stage, done=0, total=0):
+            # Per-node updates are frequent; write at most ~10 per second per stage
+            now = time.monotonic()
+            if stage == last[0] and now - last[1] < 0.1 and done < total:
+                return
+            last[:] = [stage, now]
+            self._update(job_id, stage=stage, done=done, total=total)
+
+        try:
+            result = func(progress)
+        except Exception as e:
+            print(f"Job Error: {e}")
+            self._update(job_id, state='error', error=str(e))
+            return
+        self._update(job_id, state='done', stage='done', result=json.dumps(result))
+
+    def get(self, job_id):
+        """Status of JOB_ID (no result), or None if unknown or expired."""
+        row = self._query('SELECT id, state, stage, done, total, error, created, updated, pid FROM jobs '
+                          'WHERE id = ?', (job_id,))
+        if row is None:
+            return None
+        job = dict(zip(('id', 'state', 'stage', 'done', 'total', 'error', 'created', 'updated'), row))
+        if self._interrupted(job['state'], row[-1]):
+            job['state'], job['error'] = 'error', INTERRUPTED
+        return job
+
+    def result(self, job_id):
+        row = self._query("SELECT result FROM jobs WHERE id = ? AND state = 'done'", (job_id,))
+        return json.loads(row[0]) if row else None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return {'jobs': counts, 'ttl': self.ttl}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,98 @@
+import re
+import time
+import hashlib
+import unicodedata
+
+from .sqlite_store import SQLiteStore
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def normalize_text(text):
+    """Canonical form used for keys: NFC, no trailing spaces, runs of blanks collapsed."""
+    text = unicodedata.normalize('NFC', text or '')
+    text = re.sub(r'[ \t　]+', ' ', text)
+    return '\n'.join(line.strip() for line in text.strip().splitlines())
+
+
+class LLMResponseCache(SQLiteStore):
+    """Persistent cache of model answers in a SQLite file.
+
+    Keys hash the normalized input, the instruction and the model name, so a
+    repeated request is answered locally.  Entries expire after TTL seconds
+    and the least recently used ones are dropped once the stored answers
+    exceed MAX_BYTES.  Safe to share between threads and worker processes.
+    """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind, text, instruction, model):
+        raw = '\x1f'.join([kind, model or '', normalize_text(instruction), normalize_text(text)])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        def run(db):
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (key, value, size, now, now))
+            self._evict(db, now)
+        self._transaction(run)
+
+    def _evict(self, db, now):
+        db.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+            db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        entries, total = self._query('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses')
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,280 @@
+import json
+import time
+import queue
+import asyncio
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+MODEL_NAME = 'gemini-2.5-flash'
+
+REPHRASE_PROMPT = "Please rephrase the following text to be more professional and clear while maintaining the original meaning. Keep the same language (Chinese or English). Only return the rephrased text without any explanations:\n\n{text}"
+
+BATCH_REPHRASE_PROMPT = """Please rephrase each of the following texts to be more professional and clear while maintaining the original meaning. Keep the same language (Chinese or English) as each input.
+Return ONLY a JSON array of strings with exactly {count} elements, the i-th element being the rephrased i-th input. No explanations, no Markdown.
+
+Inputs (JSON array):
+{items}"""
+
+
+class GeminiBackend:
+    """google-generativeai models, one per API key, reused across requests.
+
+    Each key gets its own async client instead of going through
+    genai.configure(), which is process-global and races between users.
+    Must be used from the gateway's event loop.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, max_keys=64):
+        self.model_name = model_name
+        self.max_keys = max_keys
+        self._models = OrderedDict()
+
+    def _model(self, api_key):
+        model = self._models.get(api_key)
+        if model is None:
+            import google.generativeai as genai
+            from google.generativeai import client as genai_client
+            manager = genai_client._ClientManager()
+            manager.configure(api_key=api_key)
+            model = genai.GenerativeModel(self.model_name)
+            model._async_client = manager.make_client('generative_async')
+            self._models[api_key] = model
+            while len(self._models) > self.max_keys:
+                self._models.popitem(last=False)
+        else:
+            self._models.move_to_end(api_key)
+        return model
+
+    async def generate(self, api_key, prompt):
+        response = await self._model(api_key).generate_content_async(prompt)
+        return response.text
+
+    async def stream(self, api_key, prompt):
+        response = await self._model(api_key).generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                yield chunk.text
+            except ValueError:
+                continue  # chunk without text parts (e.g. only finish metadata)
+
+
+class FakeBackend:
+    """Offline stand-in for Gemini with a fixed latency.
+
+    Single prompts come back as "[fake] <input>", HTML fix prompts echo
+    their input HTML, and batch prompts are answered with a JSON array, so
+    batching can be exercised without a network.
+    """
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.calls = 0
+
+    async def generate(self, api_key, prompt):
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        return self._reply(prompt)
+
+    async def stream(self, api_key, prompt):
+        """Same answer as generate(), a few words at a time."""
+        await asyncio.sleep(self.latency / 2)
+        self.calls += 1
+        words = self._reply(prompt).split(' ')
+        for i in range(0, len(words), 4):
+            yield ' '.join(words[i:i + 4]) + (' ' if i + 4 < len(words) else '')
+            await asyncio.sleep(self.latency / 20)
+
+    def _reply(self, prompt):
+        head, _, payload = prompt.rpartition('Inputs (JSON array):\n')
+        if head:
+            return json.dumps([f"[fake] {item}" for item in json.loads(payload)], ensure_ascii=False)
+        head, _, payload = prompt.rpartition('Input HTML:')
+        if head:
+            return payload.strip()
+        return "[fake] " + prompt.split(':\n\n', 1)[-1].strip()
+
+
+def make_backend(name, model_name=MODEL_NAME, latency=0.2):
+    if name == 'fake':
+        return FakeBackend(latency=latency)
+    return GeminiBackend(model_name)
+
+
+class LLMGateway:
+    """Runs every model call on one long-lived event loop in its own thread.
+
+    Calls are capped at MAX_CONCURRENCY in flight.  Rephrase requests for
+    the same key that arrive within BATCH_WINDOW seconds are sent as a single
+    prompt (up to MAX_BATCH texts); if the model's answer cannot be split
+    back up, each text is retried on its own.  The blocking helpers are meant
+    for WSGI request threads.
+    """
+
+    def __init__(self, backend, max_concurrency=8, batch_window=0.03, max_batch=8):
+        self.backend = backend
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.loop = asyncio.new_event_loop()
+        self._sem = None
+        self._pending = {}
+        self._max_concurrency = max_concurrency
+        self.batches = 0
+        self.batched_requests = 0
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='llm-gateway', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._sem = asyncio.Semaphore(self._max_concurrency)
+        self._ready.set()
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _call(self, api_key, prompt, timeout=None):
+        """The model's reply to PROMPT; TIMEOUT bounds the call itself, not the wait for a free slot."""
+        async with self._sem:
+            try:
+                return await asyncio.wait_for(self.backend.generate(api_key, prompt), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"No model response within {timeout} seconds") from None
+
+    # --- BLOCKING API ---
+    def _wait(self, coro, timeout=None):
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"No model response within {timeout} seconds") from None
+
+    def generate(self, api_key, prompt, timeout=None):
+        return self._wait(self._call(api_key, prompt, timeout))
+
+    def generate_many(self, api_key, prompts, timeout=None, limit=None):
+        """Run PROMPTS concurrently, at most LIMIT at a time for this caller.
+
+        TIMEOUT applies to each prompt on its own, so a long batch is not cut
+        off as a whole.  Returns one entry per prompt, in order: the reply,
+        or the exception that prompt raised (TimeoutError if it ran out of
+        time).
+        """
+        return self._wait(self._gather(api_key, prompts, limit, timeout))
+
+    async def _gather(self, api_key, prompts, limit, timeout=None):
+        sem = asyncio.Semaphore(limit or len(prompts) or 1)
+
+        async def one(prompt):
+            async with sem:
+                return await self._call(api_key, prompt, timeout)
+
+        return await asyncio.gather(*(one(p) for p in prompts), return_exceptions=True)
+
+    def stream(self, api_key, prompts, idle_timeout=None, limit=None, heartbeat=10):
+        """Yield (index, chunk) pairs while the model answers PROMPTS.
+
+        The prompts run concurrently, at most LIMIT at a time.  When prompt
+        INDEX finishes (index, None) is yielded, when it fails (index, error).
+        (None, None) is yielded after HEARTBEAT quiet seconds so the caller
+        can keep its connection alive; IDLE_TIMEOUT limits the silence between
+        chunks, not the length of the answer.  Closing the generator cancels
+        whatever is still running.
+        """
+        events = queue.Queue()
+        future = self.submit(self._stream_all(api_key, prompts, limit, events))
+        remaining = len(prompts)
+        last = time.monotonic()
+        try:
+            while remaining:
+                try:
+                    index, item = events.get(timeout=heartbeat)
+                except queue.Empty:
+                    if idle_timeout and time.monotonic() - last > idle_timeout:
+                        raise TimeoutError(f"No model output for {idle_timeout} seconds")
+                    yield None, None
+                    continue
+                last = time.monotonic()
+                if not isinstance(item, str):
+                    remaining -= 1
+                yield index, item
+        finally:
+            future.cancel()
+
+    async def _stream_all(self, api_key, prompts, limit, events):
+        sem = asyncio.Semaphore(limit or len(prompts) or 1)
+
+        async def one(index, prompt):
+            try:
+                async with sem, self._sem:
+                    async for chunk in self.backend.stream(api_key, prompt):
+                        if chunk:
+                            events.put((index, chunk))
+                events.put((index, None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                events.put((index, e))
+
+        await asyncio.gather(*(one(i, p) for i, p in enumerate(prompts)))
+
+    def rephrase(self, api_key, text, timeout=None):
+        return self._wait(self._enqueue_rephrase(api_key, text), timeout)
+
+    # --- MICRO-BATCHING ---
+    async def _enqueue_rephrase(self, api_key, text):
+        future = self.loop.create_future()
+        batch = self._pending.setdefault(api_key, [])
+        batch.append((text, future))
+        if len(batch) == 1:
+            self.loop.call_later(self.batch_window, self._flush, api_key, batch)
+        if len(batch) >= self.max_batch:
+            self._flush(api_key, batch)
+        return await future
+
+    def _flush(self, api_key, batch):
+        if self._pending.get(api_key) is not batch:
+            return  # already flushed when it filled up
+        del self._pending[api_key]
+        self.loop.create_task(self._run_batch(api_key, batch))
+
+    async def _run_batch(self, api_key, batch):
+        if len(batch) > 1:
+            self.batches += 1
+            self.batched_requests += len(batch)
+            texts = [text for text, _ in batch]
+            try:
+                raw = await self._call(api_key, BATCH_REPHRASE_PROMPT.format(
+                    count=len(texts), items=json.dumps(texts, ensure_ascii=False)))
+                results = json.loads(raw.replace('```json', '').replace('```', '').strip())
+                if isinstance(results, list) and len(results) == len(batch) and all(isinstance(r, str) for r in results):
+                    for (_, future), result in zip(batch, results):
+                        if not future.done():
+                            future.set_result(result.strip())
+                    return
+            except Exception as e:
+                print(f"Batch rephrase fell back to single requests: {e}")
+        await asyncio.gather(*(self._run_single(api_key, text, future) for text, future in batch))
+
+    async def _run_single(self, api_key, text, future):
+        try:
+            result = await self._call(api_key, REPHRASE_PROMPT.format(text=text))
+            if not future.done():
+                future.set_result((result or '').strip())
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'batches': self.batches,
+            'batched_requests': self.batched_requests,
+            'pending_keys': len(self._pending),
+        }
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
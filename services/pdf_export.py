@@ -0,0 +1,180 @@
+import io
+import os
+import re
+import base64
+import hashlib
+import mimetypes
+import functools
+import threading
+import multiprocessing
+from urllib.parse import urlsplit, unquote
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import weasyprint
+    from weasyprint.text.fonts import FontConfiguration
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # optional; /api/export-pdf answers 501 without them
+    weasyprint = None
+
+from .html_fix import div_spans
+from .export_bundle import ASSET_SRC_RE
+
+STYLE_RE = re.compile(r'<style[^>]*>(.*?)</style>', re.IGNORECASE | re.DOTALL)
+# Web font imports (Google Fonts); the PDF uses the stacks' local fallbacks instead
+IMPORT_RE = re.compile(r'''@import\s+(?:url\(\s*(?:'[^']*'|"[^"]*"|[^)]*)\s*\)|'[^']*'|"[^"]*")[^;]*;''', re.IGNORECASE)
+MAX_CACHED_RESOURCE_BYTES = 64 * 1024 * 1024
+
+
+def available():
+    return weasyprint is not None
+
+
+def split_pages(html_doc):
+    """(prefix, pages, suffix): the markup around the .page divs and the divs themselves."""
+    spans = div_spans(html_doc, 'page')
+    if not spans:
+        return html_doc, [], ''
+    pages = [html_doc[start:end] for start, _, _, end in spans]
+    return html_doc[:spans[0][0]], pages, html_doc[spans[-1][3]:]
+
+
+# --- WORKER SIDE (state lives for the life of each worker process) ---
+_fonts = None
+_stylesheets = {}
+_resources = {}
+_resource_bytes = 0
+
+
+class FetchRefused(ValueError):
+    pass
+
+
+def local_asset(url, root):
+    """Path of a file:// URL when it names a file inside ROOT, else None."""
+    parts = urlsplit(url)
+    if parts.scheme != 'file' or parts.netloc not in ('', 'localhost'):
+        return None
+    path = os.path.realpath(unquote(parts.path))
+    root = os.path.realpath(root)
+    return path if os.path.commonpath([path, root]) == root and os.path.isfile(path) else None
+
+
+def _data_uri(url):
+    header, _, payload = url[5:].partition(',')
+    mime_type = header.split(';')[0] or 'text/plain'
+    data = base64.b64decode(payload) if header.endswith(';base64') else unquote(payload).encode('utf-8')
+    return {'string': data, 'mime_type': mime_type}
+
+
+def _fetch(url, root):
+    """weasyprint url_fetcher: data: URIs and files inside ROOT (the uploads), nothing else.
+
+    User HTML decides which URLs are requested, so http(s), other schemes
+    and local files elsewhere are refused rather than fetched.  Upload
+    files are kept in memory between jobs.
+    """
+    global _resource_bytes
+    if url.startswith('data:'):
+        return _data_uri(url)
+    cached = _resources.get(url)
+    if cached is None:
+        filepath = local_asset(url, root)
+        if filepath is None:
+            raise FetchRefused(f"Not an uploaded file: {url[:200]}")
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        cached = {'string': data, 'mime_type': mimetypes.guess_type(filepath)[0], 'redirected_url': url}
+        if _resource_bytes + len(data) <= MAX_CACHED_RESOURCE_BYTES:
+            _resources[url] = cached
+            _resource_bytes += len(data)
+    return dict(cached)
+
+
+def render_chunk(html_doc, css, base_url, asset_root):
+    """PDF bytes for one self-contained chunk of the document; only files in ASSET_ROOT are read."""
+    global _fonts
+    if _fonts is None:
+        _fonts = FontConfiguration()
+    fetch = functools.partial(_fetch, root=asset_root)
+    key = hashlib.blake2b(f'{asset_root}\0{css}'.encode('utf-8'), digest_size=16).hexdigest()
+    stylesheet = _stylesheets.get(key)
+    if stylesheet is None:
+        # Parsed once per worker; every chunk of every document shares it
+        stylesheet = _stylesheets[key] = weasyprint.CSS(string=css, base_url=base_url, url_fetcher=fetch,
+                                                        font_config=_fonts)
+    document = weasyprint.HTML(string=html_doc, base_url=base_url, url_fetcher=fetch)
+    return document.write_pdf(stylesheets=[stylesheet], font_config=_fonts)
+
+
+class PDFExporter:
+    """Renders generated HTML documents to PDF with WeasyPrint.
+
+    The document is cut at its .page divs into chunks of PAGES_PER_CHUNK
+    pages, which worker processes render independently; pypdf joins the
+    parts in order.  Each worker keeps its font configuration, parsed
+    stylesheets and upload images between jobs.  Upload links are
+    rewritten to local files under ASSET_ROOT, the only files the renderer
+    may read; remote URLs (web fonts included) are never fetched.
+    """
+
+    def __init__(self, workers=2, pages_per_chunk=8, base_url=None, asset_root=None):
+        self.workers = workers
+        self.pages_per_chunk = pages_per_chunk
+        self.base_url = base_url
+        self.asset_root = asset_root
+        self._pool = None
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.chunks = 0
+
+    def _executor(self):
+        # Request threads race here on first use; only one may start the pool
+        if self._pool is None and self.workers > 0:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def export(self, html_doc, resolve_path=None):
+        """PDF bytes for HTML_DOC; RESOLVE_PATH maps /static/uploads URLs to files."""
+        if resolve_path:
+            def local(m):
+                filepath = resolve_path(m.group(2))
+                return f"{m.group(1)}file://{filepath}{m.group(3)}" if filepath else m.group(0)
+            html_doc = ASSET_SRC_RE.sub(local, html_doc)
+        css = IMPORT_RE.sub('', '\n'.join(STYLE_RE.findall(html_doc)))
+        html_doc = STYLE_RE.sub('', html_doc)
+
+        prefix, pages, suffix = split_pages(html_doc)
+        step = self.pages_per_chunk
+        chunks = [prefix + ''.join(pages[i:i + step]) + suffix for i in range(0, len(pages), step)] or [html_doc]
+        self.documents += 1
+        self.chunks += len(chunks)
+
+        pool = self._executor() if len(chunks) > 1 else None
+        if pool is None:
+            parts = [render_chunk(chunk, css, self.base_url, self.asset_root) for chunk in chunks]
+        else:
+            n = len(chunks)
+            parts = list(pool.map(render_chunk, chunks, [css] * n, [self.base_url] * n, [self.asset_root] * n))
+        if len(parts) == 1:
+            return parts[0]
+
+        writer = PdfWriter()
+        for part in parts:
+            for page in PdfReader(io.BytesIO(part)).pages:
+                writer.add_page(page)
+        out = io.BytesIO()
+        writer.write(out)
+        return out.getvalue()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self):
+        return {'available': available(), 'workers': self.workers, 'running': self._pool is not None,
+                'documents': self.documents, 'chunks': self.chunks}
@@ -0,0 +1,103 @@
+import json
+import hashlib
+
+from template_strings.utils import render_recursive_tree
+from .lru import SizedLRU
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+def fingerprint(*parts):
+    """Stable hash of JSON-serialisable PARTS (key order does not matter)."""
+    raw = json.dumps(parts, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def node_content(section):
+    """The part of SECTION its own HTML depends on (children are cached separately)."""
+    return section._replace(subsections=())
+
+
+class RenderCache(SizedLRU):
+    """Rendered HTML of individual section nodes, keyed by content fingerprint."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(max_bytes)
+
+    def begin(self, render_content, *salt):
+        """Start a render pass; SALT (template, formatting, ...) goes into every key."""
+        return RenderPass(self, render_content, salt)
+
+
+class RenderPass:
+    """One document render against a RenderCache.
+
+    plan() fingerprints every node of the layout before images are resolved
+    and returns the nodes that missed, so only those need their images
+    prepared.
+    render_tree() then splices cached fragments for the hits and renders the
+    misses, storing them for the next request.
+    """
+
+    def __init__(self, cache, render_content, salt):
+        self.cache = cache
+        self.render_content = render_content
+        self.salt = salt
+        self._keys = {}
+        self._html = {}
+        self._misses = []
+        self.hits = 0
+        self.misses = 0
+
+    def plan(self, nodes):
+        """Look up NODES, [(numbering, section)] as in Layout.nodes; returns the missed ones."""
+        misses = []
+        for numbering, section in nodes:
+            key = fingerprint(self.salt, numbering, node_content(section))
+            self._keys[(id(section), numbering)] = key
+            # Hold on to hits now so a concurrent eviction cannot turn them into
+            # misses whose images were never prepared
+            cached = self.cache.get(key)
+            if cached is None:
+                self.misses += 1
+                misses.append((numbering, section))
+                self._misses.append((section, numbering, key))
+            else:
+                self.hits += 1
+                self._html[key] = cached
+        return misses
+
+    def render_misses(self, pool, progress=None, prepare=None):
+        """Render every missed node up front through POOL (a RenderPool).
+
+        PREPARE(node), if given, returns the node to render instead (e.g. with
+        its images embedded); render_tree() then only splices fragments
+        together.  PROGRESS(done, total) follows along.
+        """
+        todo = [(section, numbering, key) for section, numbering, key in self._misses if key not in self._html]
+        report = (lambda done: progress(done, len(todo))) if progress else None
+        nodes = [node_content(s) for s, _, _ in todo]
+        if prepare:
+            nodes = [prepare(node) for node in nodes]
+        rendered = pool.render(self.render_content, [(node, n) for node, (_, n, _) in zip(nodes, todo)], report)
+        for (_, _, key), html_out in zip(todo, rendered):
+            self.cache.put(key, html_out)
+            self._html[key] = html_out
+
+    def _render_node(self, section, numbering):
+        key = self._keys.get((id(section), numbering))
+        html_out = self._html.get(key) if key else None
+        if html_out is None:
+            html_out = self.render_content(section, numbering)
+            if key:
+                self.cache.put(key, html_out)
+                self._html[key] = html_out
+        return html_out
+
+    def render_tree(self, section, numbering=""):
+        return render_recursive_tree(section, numbering, self._render_node)
+
+    def header(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return f"hits={self.hits}; misses={self.misses}; ratio={ratio:.2f}"
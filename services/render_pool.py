@@ -0,0 +1,92 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _ping(_):
+    return os.getpid()
+
+
+def render_nodes(render_content, items, progress=None):
+    """RENDER_CONTENT(node, numbering) for each (node, numbering) in ITEMS."""
+    out = []
+    for node, numbering in items:
+        out.append(render_content(node, numbering))
+        if progress:
+            progress(len(out))
+    return out
+
+
+class RenderPool:
+    """Renders section nodes in worker processes, off the request threads' GIL.
+
+    Only passes with at least MIN_NODES nodes to render go to the pool,
+    split into chunks of CHUNK nodes; smaller ones are cheaper to render in
+    place than to pickle.  With WORKERS=0 everything renders in place.
+    Processes are spawned, not forked, so they never inherit the app's
+    threads, and are started on first use.
+    """
+
+    def __init__(self, workers=2, min_nodes=24, chunk=16):
+        self.workers = workers
+        self.min_nodes = min_nodes
+        self.chunk = chunk
+        self._pool = None
+        self._lock = threading.Lock()
+        self.pooled = 0
+        self.inline = 0
+
+    def _executor(self):
+        # Request threads race here on first use; only one may start the pool
+        if self._pool is None and self.workers > 0:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def start(self):
+        """Spawn the worker processes now (e.g. right after a server fork)."""
+        pool = self._executor()
+        if pool is not None:
+            # Spawning is lazy; one round trip per worker gets them all up
+            list(pool.map(_ping, range(self.workers)))
+        return self
+
+    def render(self, render_content, items, progress=None):
+        """HTML for every (node, numbering) in ITEMS, in order.
+
+        PROGRESS, if given, is called with the number of nodes done so far.
+        """
+        items = list(items)
+        pool = self._executor() if len(items) >= self.min_nodes else None
+        if pool is None:
+            self.inline += len(items)
+            return render_nodes(render_content, items, progress)
+        self.pooled += len(items)
+        chunks = [items[i:i + self.chunk] for i in range(0, len(items), self.chunk)]
+        try:
+            futures = [pool.submit(render_nodes, render_content, chunk) for chunk in chunks]
+            done = 0
+            for future in as_completed(futures):
+                done += len(future.result())
+                if progress:
+                    progress(done)
+            return [html_out for future in futures for html_out in future.result()]
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed by the OOM killer); start over next time
+            print(f"Render pool Error: {e}")
+            self.shutdown(wait=False)
+            return render_nodes(render_content, items, progress)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {'workers': self.workers, 'running': self._pool is not None, 'pooled_nodes': self.pooled,
+                'inline_nodes': self.inline}
@@ -0,0 +1,60 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """Base for the stores kept in a SQLite file that every server worker shares.
+
+    Subclasses set SCHEMA.  Each process opens its own connection on first
+    use and again after a fork (a preforking server imports the app before
+    it forks, and a SQLite connection must not be used across a fork).  The
+    connection is in autocommit mode with WAL, so readers never wait for a
+    writer; statements that belong together go through _transaction().
+    """
+
+    SCHEMA = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _conn(self):
+        """This process's connection; call with _lock held."""
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(self.SCHEMA)
+            self._pid = os.getpid()
+            self._opened(self._db)
+        return self._db
+
+    def _opened(self, db):
+        """Called once per process after the schema is in place, e.g. for migrations."""
+
+    def _query(self, sql, args=()):
+        """First row of SQL, or None."""
+        with self._lock:
+            return self._conn().execute(sql, args).fetchone()
+
+    def _execute(self, sql, args=()):
+        """Run one statement; returns the number of rows it changed."""
+        with self._lock:
+            return self._conn().execute(sql, args).rowcount
+
+    def _transaction(self, fn):
+        """FN(db) inside BEGIN IMMEDIATE ... COMMIT, rolled back if it raises."""
+        with self._lock:
+            db = self._conn()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(db)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            return result
@@ -0,0 +1,94 @@
+import sys
+import time
+import importlib
+import threading
+
+
+class Warmup:
+    """Runs start-up work once per process and records how long each part took.
+
+    Steps are registered with add(); import() steps load modules and record
+    the per-module import time.  start() runs everything on a background
+    thread so the worker can accept requests meanwhile; stats() reports the
+    breakdown.  A step that fails is recorded and skipped, never fatal.
+    """
+
+    def __init__(self):
+        self._steps = []
+        self._results = []
+        self._imports = []
+        self._thread = None
+        self._done = threading.Event()
+        self.started = None
+        self.finished = None
+
+    def add(self, name, func):
+        self._steps.append((name, func))
+        return self
+
+    def imports(self, name, *modules):
+        """Register step NAME importing MODULES (in order)."""
+        return self.add(name, lambda: [self.timed_import(m) for m in modules])
+
+    def record(self, name, ms):
+        """Add a timing measured elsewhere (e.g. importing the app itself)."""
+        self._results.append({'step': name, 'ms': round(ms, 1), 'error': None})
+
+    def timed_import(self, module):
+        already = module in sys.modules
+        before = len(sys.modules)
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(module)
+            error = None
+        except ImportError as e:
+            error = str(e)
+        self._imports.append({
+            'module': module,
+            'ms': round((time.perf_counter() - t0) * 1000, 1),
+            'cached': already,
+            'new_modules': len(sys.modules) - before,
+            'error': error,
+        })
+
+    def run(self):
+        self.started = time.time()
+        for name, func in self._steps:
+            t0 = time.perf_counter()
+            try:
+                func()
+                error = None
+            except Exception as e:
+                print(f"Warmup Error ({name}): {e}")
+                error = str(e)
+            self._results.append({'step': name, 'ms': round((time.perf_counter() - t0) * 1000, 1), 'error': error})
+        self.finished = time.time()
+        self._done.set()
+
+    def start(self, background=True):
+        """Run the steps once; later calls are no-ops."""
+        if self._thread is not None or self._done.is_set():
+            return self
+        if not background:
+            self.run()
+            return self
+        self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def stats(self):
+        if self._done.is_set():
+            state = 'done'
+        elif self.started:
+            state = 'running'
+        else:
+            state = 'idle'
+        return {
+            'state': state,
+            'total_ms': round((self.finished - self.started) * 1000, 1) if self.finished else None,
+            'steps': list(self._results),
+            'imports': list(self._imports),
+        }
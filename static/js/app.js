@@ -95,8 +95,47 @@ function checkApiKeyStatus() {
     }
 }
 
+// --- SERVER-SENT EVENTS ---
+// POST a JSON body and read the text/event-stream reply (EventSource only does GET).
+// onEvent(event, data) sees every event; resolves with the `done` payload, rejects on `error`.
+async function postEventStream(url, body, onEvent) {
+    const response = await fetch(url, {
+        method: 'POST',
+        ...await jsonRequest(body)
+    });
+    if (!response.ok) {
+        const err = await response.json().catch(() => ({}));
+        throw new Error(err.error || `Request failed (${response.status})`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const raw = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            let event = 'message', data = '';
+            raw.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            if (!data) continue;  // keep-alive comment
+            const payload = JSON.parse(data);
+            if (onEvent) onEvent(event, payload);
+            if (event === 'done') return payload;
+            if (event === 'error') throw new Error(payload.error || 'Stream failed');
+        }
+        if (done) throw new Error('Stream ended unexpectedly');
+    }
+}
+
 // --- REPHRASE WITH GEMINI ---
 let currentRephraseData = null;
+let lastDeclinedRephrase = null;  // asking again after a decline bypasses the server cache
 
 async function rephraseBlock(sectionId, blockIndex, buttonElement) {
     const sec = findSectionById(sections, sectionId);
@@ -131,24 +170,23 @@ async function rephraseBlock(sectionId, blockIndex, buttonElement) {
     loadingDiv.style.display = 'block';
     resultDiv.style.display = 'none';
     
-    currentRephraseData = { sectionId, blockIndex };
+    currentRephraseData = { sectionId, blockIndex, text };
     
     try {
-        const response = await fetch('/api/rephrase', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({ text: text, api_key: geminiApiKey })
-        });
-        
-        const data = await response.json();
-        
-        if(!data.success) {
-            throw new Error(data.error || 'Rephrase failed');
-        }
+        // Tokens are shown as they arrive instead of after the whole answer
+        rephrasedText.textContent = '';
+        const done = await postEventStream('/api/rephrase/stream',
+            { text: text, api_key: geminiApiKey, no_cache: text === lastDeclinedRephrase },
+            (event, data) => {
+                if (event !== 'delta') return;
+                loadingDiv.style.display = 'none';
+                resultDiv.style.display = 'block';
+                rephrasedText.textContent += data.text;
+            });
         
         loadingDiv.style.display = 'none';
         resultDiv.style.display = 'block';
-        rephrasedText.textContent = data.rephrased;
+        rephrasedText.textContent = done.rephrased;
         
     } catch(err) {
         showToast('Rephrase failed: ' + err.message, 'warning');
@@ -223,6 +261,7 @@ function animateTextReplace(sectionId, blockIndex, newText) {
 }
 
 function declineRephrase() {
+    if (currentRephraseData) lastDeclinedRephrase = currentRephraseData.text;
     closeRephraseDialog();
 }
 
@@ -870,6 +909,82 @@ function renderSectionList(list, parentNum = '', indent = 0) {
     }).join('');
 }
 
+// --- DOCUMENT SESSION (send JSON Patch diffs instead of the whole tree) ---
+let docSession = null;  // { id, version, state } as last acknowledged by the server
+// ETags of what is on screen; the server answers 304 when nothing changed
+let documentETag = null;
+const previewCache = {};  // section id -> { etag, html } of its last preview
+
+function jsonPointerEscape(key) { return String(key).replace(/~/g, '~0').replace(/\//g, '~1'); }
+function isPlainObject(v) { return v !== null && typeof v === 'object' && !Array.isArray(v); }
+
+function jsonDiff(a, b, path = '', ops = []) {
+    if(a === b) return ops;
+    if(Array.isArray(a) && Array.isArray(b)) {
+        const n = Math.min(a.length, b.length);
+        for(let i = 0; i < n; i++) jsonDiff(a[i], b[i], `${path}/${i}`, ops);
+        for(let i = n; i < b.length; i++) ops.push({ op: 'add', path: `${path}/${i}`, value: b[i] });
+        for(let i = a.length - 1; i >= n; i--) ops.push({ op: 'remove', path: `${path}/${i}` });
+    } else if(isPlainObject(a) && isPlainObject(b)) {
+        for(const k of Object.keys(a)) {
+            if(!(k in b)) ops.push({ op: 'remove', path: `${path}/${jsonPointerEscape(k)}` });
+        }
+        for(const k of Object.keys(b)) {
+            const p = `${path}/${jsonPointerEscape(k)}`;
+            if(k in a) jsonDiff(a[k], b[k], p, ops);
+            else ops.push({ op: 'add', path: p, value: b[k] });
+        }
+    } else {
+        ops.push({ op: 'replace', path: path, value: b });
+    }
+    return ops;
+}
+
+// Whole-document uploads are gzipped when large and the browser can do it natively
+const GZIP_BODY_MIN = 32 * 1024;
+async function jsonRequest(payload, headers = {}) {
+    const json = JSON.stringify(payload);
+    headers = Object.assign({'Content-Type': 'application/json'}, headers);
+    if(json.length < GZIP_BODY_MIN || typeof CompressionStream === 'undefined') return { headers: headers, body: json };
+    const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+    headers['Content-Encoding'] = 'gzip';
+    return { headers: headers, body: await new Response(stream).arrayBuffer() };
+}
+
+async function syncDocument(doc) {
+    const state = JSON.parse(JSON.stringify(doc));
+    if(docSession) {
+        const ops = jsonDiff(docSession.state, state);
+        if(!ops.length) return docSession.id;
+        const res = await fetch(`/api/documents/${docSession.id}`, {
+            method: 'PATCH',
+            ...await jsonRequest({ ops: ops, base_version: docSession.version })
+        });
+        if(res.ok) {
+            const data = await res.json();
+            docSession.version = data.version;
+            docSession.state = state;
+            return docSession.id;
+        }
+        // Expired or out of sync: fall through and upload the whole document once
+    }
+    const res = await fetch('/api/documents', { method: 'POST', ...await jsonRequest(state) });
+    const data = await res.json();
+    if(!data.success) throw new Error(data.error || 'Could not create document session');
+    docSession = { id: data.session_id, version: data.version, state: state };
+    return docSession.id;
+}
+
+// POST to /api/documents/<id>SUFFIX for DOC, uploading it again once if the session has expired
+async function sessionRequest(doc, suffix, init) {
+    let res = await fetch(`/api/documents/${await syncDocument(doc)}${suffix}`, init);
+    if(res.status === 404) {
+        docSession = null;
+        res = await fetch(`/api/documents/${await syncDocument(doc)}${suffix}`, init);
+    }
+    return res;
+}
+
 // --- API FUNCTIONS ---
 async function previewSingleSection(sectionId) {
     const sec = findSectionById(sections, sectionId); 
@@ -878,11 +993,11 @@ async function previewSingleSection(sectionId) {
     const templateSelect = document.getElementById('templateSelect');
     const template = templateSelect ? templateSelect.value : 'nctu';
     
+    const cached = previewCache[sectionId];
     try {
         const res = await fetch('/api/generate-document', { 
             method:'POST', 
-            headers:{'Content-Type':'application/json'}, 
-            body:JSON.stringify({
+            ...await jsonRequest({
                 sections:[sec], 
                 formatting:{
                     englishFont: document.getElementById('englishFont').value,
@@ -891,11 +1006,15 @@ async function previewSingleSection(sectionId) {
                     lineHeight: document.getElementById('lineHeight').value
                 }, 
                 include_toc: false,
-                template: template
-            })
+                template: template,
+                export_mode: 'assets',  // link uploads instead of inlining Base64
+                purpose: 'preview'      // small image renditions are enough on screen
+            }, cached ? {'If-None-Match': cached.etag} : {})
         });
+        if(res.status === 304) { showPreview(cached.html); return; }
         const data = await res.json();
         if(data.success) {
+            if(res.headers.get('ETag')) previewCache[sectionId] = { etag: res.headers.get('ETag'), html: data.html };
             showPreview(data.html);
         } else {
             alert("Error: " + data.error);
@@ -915,70 +1034,117 @@ async function generateDocument() {
     };
     
     const template = document.getElementById('templateSelect').value;
-    const pageBreakMode = document.getElementById('pageBreakMode').value;  // NEW
     
     try {
-        const res = await fetch('/api/generate-document', { 
+        const doc = {
+            sections:sections, 
+            formatting:fmt, 
+            include_toc:document.getElementById('includeToc').checked,
+            template: template
+        };
+        const res = await sessionRequest(doc, '/stream', { 
             method:'POST', 
-            headers:{'Content-Type':'application/json'}, 
-            body:JSON.stringify({
-                sections:sections, 
-                formatting:fmt, 
-                include_toc:document.getElementById('includeToc').checked,
-                template: template,
-                page_break_mode: pageBreakMode  // NEW
-            })
+            ...await jsonRequest({}, documentETag ? {'If-None-Match': documentETag} : {})
         });
-        const data = await res.json();
-        if(data.success) { 
-            generatedHTML=data.html; 
-            updateProgress(100,'Done'); 
-            setTimeout(()=>{
-                hideProgress(); 
-                showPreview(generatedHTML); 
-                document.getElementById('exportSection').style.display='block';
-            },500); 
+        if(res.status === 304) {
+            // Same document as last time: show the copy we already have
+            showPreview(generatedHTML);
+            updateProgress(100,'Unchanged');
+            setTimeout(()=>{ hideProgress(); document.getElementById('exportSection').style.display='block'; },300);
+            return;
+        }
+        if(!res.ok) { const data = await res.json(); throw new Error(data.error || 'Generation failed'); }
+
+        // Pages are written into the preview as they arrive; progress counts them
+        // against the page count the server's layout pass announces
+        document.getElementById('previewPanel').style.display='block';
+        const d=document.getElementById('visualPreviewFrame').contentWindow.document; d.open();
+        const reader=res.body.getReader(); const decoder=new TextDecoder(); const parts=[];
+        const expectedPages = Number(res.headers.get('X-Document-Pages')) || Math.max(1, sections.length + (document.getElementById('includeToc').checked ? 1 : 0));
+        let pages = 0;
+        for(;;) {
+            const {done, value} = await reader.read();
+            if(done) break;
+            const chunk=decoder.decode(value, {stream:true}); parts.push(chunk); d.write(chunk);
+            pages += (chunk.match(/<div class="page">/g) || []).length;
+            updateProgress(Math.min(95, 20 + Math.round(75 * pages / expectedPages)), `Generating... ${pages} pages`);
         }
+        d.close();
+        generatedHTML=parts.join('');
+        documentETag=res.headers.get('ETag');
+        updateProgress(100,'Done'); 
+        setTimeout(()=>{
+            hideProgress(); 
+            document.getElementById('exportSection').style.display='block';
+        },500); 
     } catch(e) { hideProgress(); alert(e); }
 }
+function showPreview(html) { document.getElementById('previewPanel').style.display='block'; const d=document.getElementById('visualPreviewFrame').contentWindow.document; d.open(); d.write(html); d.close(); }
+function closePreview() { document.getElementById('previewPanel').style.display='none'; }
+function exportHTML() { const b=new Blob([generatedHTML],{type:'text/html'}); const u=URL.createObjectURL(b); const a=document.createElement('a'); a.href=u; a.download=(document.getElementById('exportFilename').value||'document')+'.html'; a.click(); }
+function exportBundle() { return exportAsJob('bundle', 'zip'); }
+function exportPDF() { return exportAsJob('pdf', 'pdf'); }
 
-async function generateDocument() {
-    showProgress('Generating...', 20);
+async function exportAsJob(exportMode, extension) {
     const fmt = { 
         englishFont: document.getElementById('englishFont').value, 
         chineseFont: document.getElementById('chineseFont').value, 
         bodySize: document.getElementById('bodySize').value, 
         lineHeight: document.getElementById('lineHeight').value 
     };
-    
-    const template = document.getElementById('templateSelect').value;
-    
+    const filename = document.getElementById('exportFilename').value || 'document';
+    showProgress('Queued...', 0);
     try {
-        const res = await fetch('/api/generate-document', { 
+        // Rendered as a background job so large documents don't hit request timeouts
+        const doc = {
+            sections:sections, 
+            formatting:fmt, 
+            include_toc:document.getElementById('includeToc').checked,
+            template: document.getElementById('templateSelect').value
+        };
+        const submit = await sessionRequest(doc, '/jobs', { 
             method:'POST', 
-            headers:{'Content-Type':'application/json'}, 
-            body:JSON.stringify({
-                sections:sections, 
-                formatting:fmt, 
-                include_toc:document.getElementById('includeToc').checked,
-                template: template
-            })
+            ...await jsonRequest({ export_mode: exportMode, filename: filename })
         });
-        const data = await res.json();
-        if(data.success) { 
-            generatedHTML=data.html; 
-            updateProgress(100,'Done'); 
-            setTimeout(()=>{
-                hideProgress(); 
-                showPreview(generatedHTML); 
-                document.getElementById('exportSection').style.display='block';
-            },500); 
-        }
+        const job = await submit.json();
+        if(!job.success) throw new Error(job.error || 'Export failed');
+        await followJob(job.job_id);
+
+        const res = await fetch(`/api/jobs/${job.job_id}/result`);
+        if(!res.ok) { const data = await res.json(); throw new Error(data.error || 'Export failed'); }
+        const u=URL.createObjectURL(await res.blob()); const a=document.createElement('a'); a.href=u; a.download=filename+'.'+extension; a.click();
+        updateProgress(100,'Done'); 
+        setTimeout(hideProgress, 500);
     } catch(e) { hideProgress(); alert(e); }
 }
-function showPreview(html) { document.getElementById('previewPanel').style.display='block'; const d=document.getElementById('visualPreviewFrame').contentWindow.document; d.open(); d.write(html); d.close(); }
-function closePreview() { document.getElementById('previewPanel').style.display='none'; }
-function exportHTML() { const b=new Blob([generatedHTML],{type:'text/html'}); const u=URL.createObjectURL(b); const a=document.createElement('a'); a.href=u; a.download=(document.getElementById('exportFilename').value||'document')+'.html'; a.click(); }
+
+// Stage -> [start %, end %] of the progress bar
+const JOB_STAGES = { queued:[0,5], planning:[5,10], images:[10,30], rendering:[30,80], assembling:[80,85], pdf:[85,98], done:[100,100] };
+
+function jobProgressText(job) {
+    const stage = job.state === 'queued' ? 'queued' : (job.stage || 'planning');
+    const [from, to] = JOB_STAGES[stage] || [0, 5];
+    const pct = job.total ? from + (to - from) * job.done / job.total : from;
+    const label = stage.charAt(0).toUpperCase() + stage.slice(1);
+    return [Math.round(pct), job.total ? `${label} ${job.done}/${job.total} sections...` : `${label}...`];
+}
+
+// Follow a background job's progress events; resolves when it is done.
+function followJob(jobId) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`/api/jobs/${jobId}/events`);
+        source.addEventListener('progress', e => {
+            const [pct, text] = jobProgressText(JSON.parse(e.data));
+            updateProgress(pct, text);
+        });
+        source.addEventListener('done', e => { source.close(); resolve(JSON.parse(e.data)); });
+        source.addEventListener('error', e => {
+            // Also fired by the browser itself when the connection drops (no data then)
+            source.close();
+            reject(new Error(e.data ? (JSON.parse(e.data).error || 'Job failed') : 'Lost connection to the server'));
+        });
+    });
+}
 function printDocument() { document.getElementById('visualPreviewFrame').contentWindow.print(); }
 function showProgress(t,p) { document.getElementById('progressContainer').style.display='block'; document.getElementById('progressBar').style.width=p+'%'; document.getElementById('progressText').innerText=t; }
 function updateProgress(p,t) { showProgress(t,p); } function hideProgress() { document.getElementById('progressContainer').style.display='none'; }
@@ -1053,28 +1219,28 @@ async function processHtmlFix() {
 
     // UI Loading State
     document.getElementById('htmlFixLoading').style.display = 'block';
+    const streamOutput = document.getElementById('htmlFixStream');
+    streamOutput.textContent = '';
     
     try {
-        const response = await fetch('/api/fix-html', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                html: currentHtml,
-                api_key: apiKey,
-                instruction: instruction
-            })
+        // Pages are fixed in parallel; show the model's output live while it writes
+        const data = await postEventStream('/api/fix-html/stream', {
+            html: currentHtml,
+            api_key: apiKey,
+            instruction: instruction
+        }, (event, payload) => {
+            if (event === 'start') {
+                streamOutput.textContent = `Polishing ${payload.resubmitted} of ${payload.fragments} pages...\n`;
+            } else if (event === 'delta') {
+                streamOutput.textContent += payload.text;
+                streamOutput.scrollTop = streamOutput.scrollHeight;
+            }
         });
 
-        const data = await response.json();
-
-        if (data.success) {
-            generatedFixedHtml = data.fixed_html;
-            showHtmlComparison(currentHtml, generatedFixedHtml);
-        } else {
-            showToast(data.error || "AI Error", "error");
-        }
+        generatedFixedHtml = data.fixed_html;
+        showHtmlComparison(currentHtml, generatedFixedHtml);
     } catch (e) {
-        showToast("Network error occurred.", "error");
+        showToast(e.message || "AI Error", "error");
         console.error(e);
     } finally {
         document.getElementById('htmlFixLoading').style.display = 'none';
@@ -1,6 +1,31 @@
 import html
-import re
+from .utils import (get_formatter, render_table, render_recursive_tree, align_class, cached_css,
+                    SectionRenderer, PAGE_BREAK)
+from .layout import MM, PT, PageMetrics, paginate, to_number, FONT_SIZE_RANGE, LINE_HEIGHT_RANGE
 
+# Body rows of a table that fit on one page; longer tables continue on new pages
+TABLE_ROWS_PER_PAGE = 26
+
+ROMAN = ['i', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii', 'ix', 'x']
+
+def page_metrics(formatting):
+    """Page geometry for the layout pass; mirrors the CSS in generate_css (pt sizes, mm margins)."""
+    size = to_number(formatting.get('bodySize', '12'), 12, *FONT_SIZE_RANGE)
+    lh = to_number(formatting.get('lineHeight', '1.8'), 1.8, *LINE_HEIGHT_RANGE)
+    return PageMetrics(
+        content_height=(297 - 50) * MM, content_width=(210 - 55) * MM,
+        font_px=size * PT, line_height=lh,
+        headings=((18 * 1.3 + 8) * PT, (14 * lh + 24 + 12 + 5) * PT, (12 * lh + 18 + 10) * PT),
+        block_gap=(12 + 14) * PT, list_item_gap=8 * PT, list_margin=24 * PT,
+        table_font_px=11 * PT, table_cell_pad=17 * PT, table_margin=36 * PT,
+        caption_height=(10 * 1.4 + 6) * PT, figure_row_gap=10 * PT, figure_margin=48 * PT,
+        toc_heading=(18 * 1.3 + 8) * PT, toc_entry=(12 * lh + 10) * PT)
+
+def layout_document(sections, formatting, include_toc, image_size=None):
+    """Paginate SECTIONS for this template; see layout.paginate."""
+    return paginate(sections, page_metrics(formatting), include_toc, image_size, TABLE_ROWS_PER_PAGE)
+
+@cached_css
 def generate_css(formatting):
     en_font = formatting.get('englishFont', "'Garamond', 'Georgia', serif")
     zh_font = formatting.get('chineseFont', "'SimSun', '宋体', serif")
@@ -352,151 +377,119 @@ def generate_css(formatting):
     </style>
     """
 
+_format_text = get_formatter(italic=True, link_style="color: #000; text-decoration: underline;")
+
 def process_text_formatting(text, theme_color='#000'):
-    if not text: return ""
-    s = html.escape(text)
-    s = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', s)
-    s = re.sub(r'\*(.*?)\*', r'<em>\1</em>', s)
-    s = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2" target="_blank" style="color: #000; text-decoration: underline;">\1</a>', s)
-    return s.replace('\n', '<br>')
-
-def render_section_content(section, numbering=""):
-    lvl = section.get('level', 1)
-    ttl = section.get('title', 'Untitled')
-    
+    return _format_text(text)
+
+def render_heading(section, numbering, ctx):
+    lvl = section.level
+    ttl = section.title
     tag = ['h1','h2','h3'][min(lvl-1, 2)]
     cls = ['title','subtitle','subsubtitle'][min(lvl-1, 2)]
     num_html = f'<span class="section-number">{numbering}</span>' if numbering else ''
-    html_content = f'<{tag} class="{cls}">{num_html}{html.escape(ttl)}</{tag}>'
-    
-    # Blocks
-    blocks = section.get('blocks') or ([{'type':'text','content':section.get('content'),'align':'left'}] if section.get('content') else [])
-    
-    for blk in blocks:
-        b_type = blk.get('type', 'text')
-        align = blk.get('align', 'left')
-        
-        # IMAGE BLOCK
-        if b_type == 'image':
-            images = blk.get('images', [])
-            if images:
-                layout = blk.get('layout', 'standalone')
-                group_width = blk.get('groupWidth', 80)
-                count = len(images)
-                
-                if count == 1:
-                    rows_html = f'''
-                    <div class="figure-row">
-                        <div class="figure-item">
-                            <img src="{images[0]['url']}" alt="{html.escape(images[0].get('caption', ''))}">
-                            <div class="figure-caption">Figure: {html.escape(images[0].get('caption', ''))}</div>
-                        </div>
-                    </div>
-                    '''
-                else:
-                    rows_html = '<div class="figure-row">'
-                    for idx, img in enumerate(images):
-                        rows_html += f'''
-                        <div class="figure-item">
-                            <img src="{img['url']}" alt="{html.escape(img.get('caption', ''))}">
-                            <div class="figure-caption">Figure {idx+1}: {html.escape(img.get('caption', ''))}</div>
-                        </div>
-                        '''
-                        if (idx + 1) % 2 == 0 and idx + 1 < count:
-                            rows_html += '</div><div class="figure-row">'
-                    rows_html += '</div>'
-                
-                wrapper_class = f"figure-group {layout}"
-                html_content += f'<div class="{wrapper_class}" style="max-width: {group_width}%;">{rows_html}</div>'
-                
-        # TABLE BLOCK
-        elif b_type == 'table':
-            table_data = blk.get('tableData', [])
-            if table_data:
-                align_cls = "align-center" if align == "center" else "align-left"
-                table_html = '<table class="content-table">'
-                
-                for row_idx, row in enumerate(table_data):
-                    table_html += '<tr>'
-                    for cell in row:
-                        cell_content = process_text_formatting(cell) if cell else '—'
-                        if row_idx == 0:
-                            table_html += f'<th>{cell_content}</th>'
-                        else:
-                            table_html += f'<td>{cell_content}</td>'
-                    table_html += '</tr>'
-                
-                table_html += '</table>'
-                html_content += f'<div class="content-block {align_cls}">{table_html}</div>'
-                
-        # TEXT BLOCK
-        elif b_type == 'text':
-            raw = blk.get('content', '')
-            align_cls = "align-center" if align == "center" else "align-left"
-            html_content += f'<div class="content-block {align_cls}"><p>{process_text_formatting(raw)}</p></div>'
-            
-        # LIST BLOCK
-        elif b_type == 'list':
-            raw = blk.get('content', '')
-            items = [x.strip() for x in raw.split('\n') if x.strip()]
-            style = blk.get('listStyle', 'bullets')
-            ul_cls = "custom-list " + ({'1':'list-parens','roman':'list-roman'}.get(style, 'list-bullets'))
-            align_cls = "align-center" if align == "center" else "align-left"
-            html_content += f'<ul class="{ul_cls} {align_cls}">' + ''.join([f'<li>{process_text_formatting(i)}</li>' for i in items]) + '</ul>'
-
-    return html_content
+    return f'<{tag} class="{cls}">{num_html}{html.escape(ttl)}</{tag}>'
+
+# --- BLOCK RENDERERS: (block, ctx) -> HTML ---
+def render_figure_item(img, label):
+    caption = html.escape(img.caption)
+    return f'<div class="figure-item"><img src="{img.url}" alt="{caption}"><div class="figure-caption">{label}: {caption}</div></div>'
+
+def render_image_block(blk, ctx):
+    images = blk.images
+    if not images: return ''
+    if len(images) == 1:
+        items = [render_figure_item(images[0], 'Figure')]
+    else:
+        items = [render_figure_item(img, f'Figure {idx+1}') for idx, img in enumerate(images)]
+    # Two figures per row
+    rows_html = ''.join('<div class="figure-row">' + ''.join(items[i:i+2]) + '</div>' for i in range(0, len(items), 2))
+    width = 80 if blk.width is None else blk.width
+    return f'<div class="figure-group {blk.layout}" style="max-width: {width}%;">{rows_html}</div>'
+
+def render_table_block(blk, ctx):
+    if not blk.rows: return ''
+    tables = render_table(blk.rows, process_text_formatting, '—', max_rows=TABLE_ROWS_PER_PAGE)
+    return PAGE_BREAK.join(f'<div class="content-block {align_class(blk)}">{t}</div>' for t in tables)
+
+def render_text_block(blk, ctx):
+    return f'<div class="content-block {align_class(blk)}"><p>{process_text_formatting(blk.content)}</p></div>'
+
+def render_list_block(blk, ctx):
+    style = blk.style
+    ul_cls = "custom-list " + ({'1':'list-parens','roman':'list-roman'}.get(style, 'list-bullets'))
+    start = f' style="counter-reset:list-counter {blk.start-1} list-item {blk.start-1};"' if blk.start else ''
+    return f'<ul class="{ul_cls} {align_class(blk)}"{start}>' + ''.join([f'<li>{process_text_formatting(i)}</li>' for i in blk.items]) + '</ul>'
+
+render_section_content = SectionRenderer(
+    render_heading,
+    {'image': render_image_block, 'table': render_table_block, 'text': render_text_block, 'list': render_list_block})
 
 def render_section_tree(section, numbering=""):
-    html_out = render_section_content(section, numbering)
-    if 'subsections' in section:
-        for i, subsec in enumerate(section['subsections']): 
-            html_out += render_section_tree(subsec, f"{numbering}.{i+1}" if numbering else f"{i+1}")
-    return html_out
-
-def get_toc_html(sections, doc_title="Document"):
-    flat = []
-    def flatten(secs, p_num=""):
-        for i, s in enumerate(secs):
-            n = f"{p_num}{i+1}"
-            flat.append({**s, '_num': n, '_idx': len(flat)})
-            if 'subsections' in s: flatten(s['subsections'], f"{n}.")
-    flatten(sections)
-    
-    items = "".join([
-        f'<li class="toc-item indent-{s.get("level",1)-1}">'
-        f'<span class="toc-label">{s["_num"]} {html.escape(s.get("title","Untitled"))}</span>'
+    return render_recursive_tree(section, numbering, render_section_content)
+
+def get_toc_html(sections, doc_title="Document", layout=None):
+    layout = layout or layout_document(sections, {}, True)
+    items = [
+        f'<li class="toc-item indent-{s.level-1}">'
+        f'<span class="toc-label">{n} {html.escape(s.title)}</span>'
         f'<span class="toc-dots"></span>'
-        f'<span class="toc-page">{s["_idx"]+2}</span>'
+        f'<span class="toc-page">{layout.page_number(n)}</span>'
         f'</li>' 
-        for s in flat
-    ])
+        for n, s in layout.nodes
+    ]
     
-    return f'''
+    step = layout.toc_per_page
+    return "".join(f'''
     <div class="page">
         <div class="running-header">{html.escape(doc_title)}</div>
         <div class="page-content">
             <h1 class="title">Table of Contents</h1>
-            <ul class="toc-list">{items}</ul>
+            <ul class="toc-list">{"".join(items[i:i+step])}</ul>
         </div>
-        <div class="page-number">i</div>
+        <div class="page-number">{ROMAN[i // step] if i // step < len(ROMAN) else i // step + 1}</div>
     </div>
-    '''
+    ''' for i in range(0, max(len(items), 1), step))
+
+def iter_full_html(sections, formatting, include_toc, doc_title="Academic Document", prepare=None, render_tree=None,
+                   layout=None, stylesheet=None):
+    """Yield the document one page at a time.
 
-def generate_full_html(sections, formatting, include_toc, doc_title="Academic Document"):
-    css = generate_css(formatting)
-    body = get_toc_html(sections, doc_title) if include_toc else ""
+    PREPARE, if given, is called with each top-level section right before it
+    is rendered and returns the section to render (e.g. with images embedded).
+    RENDER_TREE replaces render_section_tree (e.g. with a cached version).
+    LAYOUT is the result of layout_document; without one SECTIONS are laid
+    out here.  STYLESHEET replaces the inline <style> in the head (e.g. with
+    a <link> to the shared stylesheet).
+    """
+    render_tree = render_tree or render_section_tree
+    layout = layout or layout_document(sections, formatting, include_toc)
+    sections = layout.sections
+    css = stylesheet or generate_css(formatting)
+    yield f"<!DOCTYPE html><html lang='zh-TW'><head><meta charset='UTF-8'><meta name='viewport' content='width=device-width, initial-scale=1.0'><title>{html.escape(doc_title)}</title>{css}</head><body>"
+    if include_toc:
+        yield get_toc_html(sections, doc_title, layout)
     
+    # TOC pages count towards the numbering, as in layout.page_number
+    page_display = layout.toc_pages + 1
     for page_num, sec in enumerate(sections):
-        page_display = page_num + 1 if not include_toc else page_num + 2
-        body += f'''
+        if prepare: sec = prepare(sec)
+        for part in render_tree(sec, str(page_num+1)).split(PAGE_BREAK):
+            yield f'''
         <div class="page">
             <div class="running-header">{html.escape(doc_title)}</div>
-            <div class="page-content">{render_section_tree(sec, str(page_num+1))}</div>
+            <div class="page-content">{part}</div>
             <div class="page-number">{page_display}</div>
         </div>
         '''
+            page_display += 1
     
-    return f"<!DOCTYPE html><html lang='zh-TW'><head><meta charset='UTF-8'><meta name='viewport' content='width=device-width, initial-scale=1.0'><title>{html.escape(doc_title)}</title>{css}</head><body>{body}</body></html>"
+    yield "</body></html>"
+
+def generate_full_html(sections, formatting, include_toc, doc_title="Academic Document", render_tree=None, layout=None,
+                       stylesheet=None):
+    return "".join(iter_full_html(sections, formatting, include_toc, doc_title, render_tree=render_tree, layout=layout,
+                                  stylesheet=stylesheet))
 
 def generate_preview_html(sections, formatting, doc_title="Academic Document"):
     """Generate preview for a single section or multiple sections without TOC"""
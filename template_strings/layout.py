@@ -0,0 +1,353 @@
+"""Pagination: flow section content across fixed-size pages.
+
+The layout pass works on the parsed sections (model.py) before rendering.
+It estimates the height of every block from the page geometry of the
+template (text metrics for the body font size and line height, image
+aspect ratios, table rows), splits text, lists and tables that do not fit,
+and inserts PageBreak blocks (or sets page_break_before on a section) where
+a new page has to start.  The templates turn those into PAGE_BREAK markers,
+so rendering, caching and streaming work on the laid-out tree unchanged.
+
+It is also the one walk over the tree: the resulting Layout is the document
+index the later stages read (every node with its numbering and page, and
+the image URLs per node) instead of traversing the sections again.
+"""
+import math
+
+from .model import PageBreak
+
+# CSS px per unit at 96 dpi
+MM = 96 / 25.4
+PT = 96 / 72
+
+# Average advance of a narrow (Latin) glyph in em; CJK glyphs are 1em wide
+NARROW_EM = 0.5
+
+PAGE_BREAK_BLOCK = PageBreak()
+
+# Body sizes and line heights the layout accepts; formatting outside them
+# (e.g. 0 typed into the form) falls back to the template default
+FONT_SIZE_RANGE = (1, 200)
+LINE_HEIGHT_RANGE = (0.5, 10)
+
+
+def to_number(value, default, minimum=None, maximum=None):
+    """VALUE as a float ('14px' and '12pt' too); DEFAULT if unparsable, not finite or outside MINIMUM..MAXIMUM."""
+    try:
+        number = float(str(value).strip().rstrip('ptx'))
+    except (TypeError, ValueError):
+        return default
+    if not math.isfinite(number) or (minimum is not None and number < minimum) or \
+            (maximum is not None and number > maximum):
+        return default
+    return number
+
+
+def text_width(text, font_px):
+    """Estimated width of TEXT on one line, in px.
+
+    CJK characters take three bytes in UTF-8 and Latin ones one, so the
+    wide-glyph count falls out of the encoded length without a Python loop.
+    """
+    n = len(text)
+    wide = (len(text.encode('utf-8')) - n) // 2
+    return ((n - wide) * NARROW_EM + wide) * font_px
+
+
+def line_count(text, font_px, width):
+    """Lines TEXT wraps to in a box WIDTH px wide."""
+    return max(1, math.ceil(text_width(text, font_px) / width))
+
+
+def split_paragraph(text, lines, font_px, width):
+    """Cut TEXT after roughly LINES wrapped lines; returns (head, tail)."""
+    per_char = text_width(text, font_px) / max(len(text), 1)
+    n = int(lines * width / per_char)
+    if n <= 0:
+        return '', text
+    if n >= len(text):
+        return text, ''
+    cut = text.rfind(' ', int(n * 0.8), n)
+    cut = cut if cut > 0 else n
+    head = text[:cut]
+    # Do not cut through **bold** markup
+    if head.count('**') % 2:
+        cut = head.rfind('**') or cut
+    return text[:cut].rstrip(), text[cut:].lstrip()
+
+
+class PageMetrics:
+    """Page geometry of a template in CSS px, as the layout pass sees it.
+
+    HEADINGS holds the full height (margins included) of h1, h2 and h3;
+    FIGURE_ROWS(count) gives the number of figure rows for COUNT images and
+    FIGURE_COLUMNS(count) the images per row.  IMAGE_HEIGHT is a fixed image
+    height, or None when images keep their aspect ratio.
+    """
+
+    def __init__(self, content_height, content_width, font_px, line_height, headings, block_gap,
+                 list_item_gap=8, list_indent=None, list_margin=20, table_font_px=None, table_cell_pad=17,
+                 table_margin=20, image_height=None, caption_height=20, figure_row_gap=12, figure_margin=40,
+                 figure_rows=None, figure_columns=None, toc_heading=60, toc_entry=30):
+        self.content_height = content_height
+        self.content_width = content_width
+        self.font_px = font_px
+        self.line_px = font_px * line_height
+        self.line_height = line_height
+        self.headings = headings
+        self.block_gap = block_gap
+        self.list_item_gap = list_item_gap
+        self.list_indent = font_px * 2.5 if list_indent is None else list_indent
+        self.list_margin = list_margin
+        self.table_font_px = table_font_px or font_px
+        self.table_cell_pad = table_cell_pad
+        self.table_margin = table_margin
+        self.image_height = image_height
+        self.caption_height = caption_height
+        self.figure_row_gap = figure_row_gap
+        self.figure_margin = figure_margin
+        self.figure_rows = figure_rows or (lambda n: math.ceil(n / 2))
+        self.figure_columns = figure_columns or (lambda n: 1 if n == 1 else 2)
+        self.toc_heading = toc_heading
+        self.toc_entry = toc_entry
+
+
+class Layout:
+    """Result of paginate(): the laid-out sections and what was learnt walking them.
+
+    NODES lists (numbering, section) for every laid-out node in document
+    order (the TOC entries), PAGE_OF maps a numbering to its body page and
+    IMAGES a numbering to the URLs of the node's images.
+    """
+
+    def __init__(self, sections, nodes, page_of, images, body_pages, toc_pages, toc_per_page):
+        self.sections = sections
+        self.nodes = nodes
+        self.page_of = page_of
+        self.images = images
+        self.body_pages = body_pages
+        self.toc_pages = toc_pages
+        self.toc_per_page = toc_per_page
+
+    @property
+    def pages(self):
+        return self.toc_pages + self.body_pages
+
+    def page_number(self, numbering):
+        """1-based page of the section numbered NUMBERING ("2.1"), TOC pages included."""
+        return self.toc_pages + self.page_of.get(numbering, 0) + 1
+
+    def image_urls(self, numberings=None):
+        """Image URLs of the nodes numbered NUMBERINGS (all nodes by default)."""
+        if numberings is None:
+            return [url for urls in self.images.values() for url in urls]
+        return [url for n in numberings for url in self.images.get(n, ())]
+
+
+class _Pager:
+    def __init__(self, metrics, image_size=None, max_table_rows=None):
+        self.m = metrics
+        self.image_size = image_size
+        self.max_table_rows = max_table_rows
+        self.page = -1
+        self.used = 0.0
+        self.page_of = {}
+        self.nodes = []
+        self.images = {}
+
+    def new_page(self):
+        self.page += 1
+        self.used = 0.0
+
+    def fits(self, height):
+        return self.used + height <= self.m.content_height
+
+    def page_break(self, out):
+        out.append(PAGE_BREAK_BLOCK)
+        self.new_page()
+
+    # --- SECTIONS ---
+    def place(self, section, numbering, top):
+        m = self.m
+        heading = m.headings[min(section.level, 3) - 1]
+        # PAGE_BREAK on the laid-out node means "the renderer starts a new page
+        # here"; a top-level section is on a page of its own anyway
+        page_break = False
+        if top:
+            self.new_page()
+        elif self.used and (section.page_break_before or not self.fits(heading + 2 * m.line_px)):
+            # Requested by the section, or to keep a heading together with the start of its content
+            self.new_page()
+            page_break = True
+        self.page_of[numbering] = self.page
+        slot = len(self.nodes)
+        self.nodes.append(None)  # filled in below, so NODES stays in document order
+        self.used += heading
+
+        out = []
+        for blk in section.blocks:
+            kind = blk.type
+            if kind == 'text':
+                self.flow_text(blk, out)
+            elif kind == 'list':
+                self.flow_list(blk, out)
+            elif kind == 'table' and blk.rows:
+                self.flow_table(blk, out)
+            elif kind == 'image' and blk.images:
+                self.images.setdefault(numbering, []).extend(img.url for img in blk.images)
+                self.place_atomic(blk, self.figure_height(blk), out)
+            elif kind == 'page-break':
+                self.page_break(out)
+            else:
+                out.append(blk)
+        node = section._replace(blocks=tuple(out), page_break_before=page_break,
+                                subsections=tuple(self.place(sub, f"{numbering}.{j + 1}", False)
+                                                  for j, sub in enumerate(section.subsections)))
+        self.nodes[slot] = (numbering, node)
+        return node
+
+    def place_atomic(self, blk, height, out):
+        if self.used and not self.fits(height):
+            self.page_break(out)
+        out.append(blk)
+        self.used += height
+
+    # --- TEXT ---
+    def flow_text(self, blk, out):
+        m = self.m
+        paras = blk.content.split('\n')
+        counts = [line_count(p, m.font_px, m.content_width) for p in paras]
+        split = False
+        while True:
+            height = sum(counts) * m.line_px + m.block_gap
+            if self.fits(height):
+                out.append(blk._replace(content='\n'.join(paras)) if split else blk)
+                self.used += height
+                return
+            room = int((m.content_height - self.used - m.block_gap) // m.line_px)
+            if room < 2 and self.used:
+                self.page_break(out)  # no orphaned single line at the bottom
+                continue
+            room = max(room, 1)
+            k, lines = 0, 0
+            while k < len(paras) and lines + counts[k] <= room:
+                lines += counts[k]
+                k += 1
+            head = paras[:k]
+            if k < len(paras) and lines < room:
+                first, rest = split_paragraph(paras[k], room - lines, m.font_px, m.content_width)
+                if first:
+                    head.append(first)
+                    paras[k] = rest
+                    counts[k] = line_count(rest, m.font_px, m.content_width)
+            if not head and not self.used:
+                head, paras[0], counts[0] = [paras[0]], '', 0  # guarantee progress on an empty page
+            paras, counts = paras[k:], counts[k:]
+            split = True
+            if head:
+                out.append(blk._replace(content='\n'.join(head)))
+            self.page_break(out)
+
+    def flow_list(self, blk, out):
+        m = self.m
+        items = blk.items
+        if not items:
+            out.append(blk)
+            return
+        width = m.content_width - m.list_indent
+        heights = [line_count(i, m.font_px, width) * m.line_px + m.list_item_gap for i in items]
+        start = 0
+        while start < len(items):
+            end, height = start, m.list_margin
+            while end < len(items) and self.fits(height + heights[end]):
+                height += heights[end]
+                end += 1
+            if end == start:
+                if self.used:
+                    self.page_break(out)
+                    continue
+                end, height = start + 1, height + heights[start]  # taller than a page
+            if (start, end) == (0, len(items)):
+                out.append(blk)
+            else:
+                out.append(blk._replace(items=items[start:end], start=start + 1 if start else blk.start))
+            self.used += height
+            start = end
+            if start < len(items):
+                self.page_break(out)
+
+    # --- TABLES ---
+    def flow_table(self, blk, out):
+        m = self.m
+        table = blk.rows
+        cols = max(len(row) for row in table) or 1
+        cell_width = max(m.content_width / cols - m.table_cell_pad, 8)
+        line = m.table_font_px * m.line_height
+        one_line = int(cell_width // m.table_font_px)  # characters that fit even if all are CJK
+
+        def row_height(row):
+            cells = [c for c in row if c]
+            if all(len(c) <= one_line for c in cells):
+                return line + m.table_cell_pad
+            return max(line_count(c, m.table_font_px, cell_width) for c in cells) * line + m.table_cell_pad
+
+        head_h = row_height(table[0]) + m.table_margin + m.block_gap
+        rows = table[1:]
+        heights = [row_height(r) for r in rows]
+        limit = self.max_table_rows or len(rows) or 1
+        start = 0
+        while True:
+            end, height = start, head_h
+            while end < len(rows) and end - start < limit and self.fits(height + heights[end]):
+                height += heights[end]
+                end += 1
+            if end == start and start < len(rows):
+                if self.used:
+                    self.page_break(out)
+                    continue
+                end, height = start + 1, height + heights[start]
+            out.append(blk if (start, end) == (0, len(rows)) else blk._replace(rows=(table[0],) + rows[start:end]))
+            self.used += height
+            start = end
+            if start >= len(rows):
+                return
+            if not self.fits(head_h + heights[start]):
+                self.page_break(out)
+
+    # --- FIGURES ---
+    def figure_height(self, blk):
+        m = self.m
+        images = blk.images
+        rows = m.figure_rows(len(images))
+        if not rows:
+            return m.figure_margin
+        if m.image_height is not None:
+            row_h = [m.image_height + m.caption_height] * rows
+        else:
+            cols = m.figure_columns(len(images))
+            share = to_number(80 if blk.width is None else blk.width, 80) / 100
+            width = m.content_width * min(share, 1) / cols - m.figure_row_gap
+            row_h = []
+            for r in range(rows):
+                ratios = [self.aspect(img.url) for img in images[r * cols:(r + 1) * cols]] or [0.75]
+                row_h.append(width * max(ratios) + m.caption_height)
+        return sum(row_h) + (rows - 1) * m.figure_row_gap + m.figure_margin
+
+    def aspect(self, url):
+        size = self.image_size(url) if self.image_size and url else None
+        return size[1] / size[0] if size and size[0] else 0.75
+
+
+def paginate(sections, metrics, include_toc=False, image_size=None, max_table_rows=None):
+    """Lay SECTIONS (parsed, see model.parse_sections) out on pages of METRICS; returns a Layout.
+
+    Every top-level section starts a new page.  IMAGE_SIZE(url) may return
+    an image's (width, height) for aspect-ratio based figure heights, and
+    MAX_TABLE_ROWS caps the body rows of a table piece.  The input is not
+    modified (nodes are immutable); changed nodes and blocks are copies.
+    """
+    pager = _Pager(metrics, image_size, max_table_rows)
+    laid = [pager.place(sec, str(i + 1), True) for i, sec in enumerate(sections)]
+    per_page = max(1, int((metrics.content_height - metrics.toc_heading) // metrics.toc_entry))
+    toc_pages = max(1, math.ceil(len(pager.nodes) / per_page)) if include_toc else 0
+    return Layout(laid, pager.nodes, pager.page_of, pager.images, pager.page + 1, toc_pages, per_page)
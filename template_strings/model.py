@@ -0,0 +1,292 @@
+"""Document model: the validated, immutable form of a draft.
+
+Payloads arrive as nested JSON dicts.  parse_sections() checks them once,
+where a request enters the app, and turns them into Section and block nodes
+with every default filled in, so the layout pass and the renderers read
+attributes instead of repeating dict.get(key, default) on the raw tree.
+
+Nodes are named tuples with no per-instance __dict__: compact, immutable,
+picklable for the render pool and serialised by json as plain lists (for
+render-cache fingerprints).  Every node carries its type as the first
+field.  The layout pass and image embedding build changed copies with
+_replace(); the request data itself is never modified.
+"""
+import re
+import math
+from collections import namedtuple
+
+# Deeper nesting than this is rejected rather than walked
+MAX_DEPTH = 32
+
+COLOR_RE = re.compile(r'#[0-9a-fA-F]{3,8}|[a-zA-Z]{1,32}')
+TOKEN_RE = re.compile(r'[\w-]{1,32}')
+
+
+class ValidationError(ValueError):
+    """A payload that does not describe a document; PATH says where ("sections[2].blocks[0].align")."""
+
+    def __init__(self, path, message):
+        super().__init__(f'{path} {message}')
+        self.path = path
+        self.message = message
+
+    def within(self, prefix):
+        """The same error for the payload nested under PREFIX."""
+        return ValidationError(prefix + self.path, self.message)
+
+
+class Section(namedtuple('Section', 'type id title level color blocks subsections page_break_before',
+                         defaults=('other', None, 'Untitled', 1, None, (), (), False))):
+    __slots__ = ()
+
+
+class TextBlock(namedtuple('TextBlock', 'type content align', defaults=('text', '', 'left'))):
+    __slots__ = ()
+
+
+class ListBlock(namedtuple('ListBlock', 'type items style align start', defaults=('list', (), '', 'left', None))):
+    """ITEMS are the non-empty lines of the list; START numbers a continued list from there."""
+    __slots__ = ()
+
+
+class TableBlock(namedtuple('TableBlock', 'type rows align', defaults=('table', (), 'left'))):
+    """ROWS are tuples of cell strings; the first row is the header."""
+    __slots__ = ()
+
+
+class ImageBlock(namedtuple('ImageBlock', 'type images layout width align',
+                            defaults=('image', (), 'standalone', None, 'left'))):
+    """WIDTH is the figure group's width in percent, or None for the template's default."""
+    __slots__ = ()
+
+
+class Image(namedtuple('Image', 'url caption', defaults=('', ''))):
+    __slots__ = ()
+
+
+class PageBreak(namedtuple('PageBreak', 'type', defaults=('page-break',))):
+    __slots__ = ()
+
+
+# --- VALIDATION ---
+# Paths are only put together when something is wrong: each level adds its
+# part while the ValidationError propagates (see ValidationError.within)
+def _text(value, field, default=''):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValidationError(f'.{field}', 'must be a string')
+
+
+def _number(value, field):
+    """A percentage or similar: int when whole, None when absent."""
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        number = None
+    if number is None or not math.isfinite(number):
+        raise ValidationError(f'.{field}', 'must be a number')
+    return int(number) if number.is_integer() else number
+
+
+def _level(value):
+    if value is None:
+        return 1
+    try:
+        level = int(value) if not isinstance(value, (bool, float)) else None
+    except (TypeError, ValueError):
+        level = None
+    if level is None or level < 1:
+        raise ValidationError('.level', 'must be a positive integer')
+    return level
+
+
+def _pattern(value, pattern, field, default, what):
+    if value is None or value == '':
+        return default
+    if not isinstance(value, str) or not pattern.fullmatch(value):
+        raise ValidationError(f'.{field}', f'must be {what}')
+    return value
+
+
+def _list(value, field, what='a list'):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValidationError(f'.{field}', f'must be {what}')
+    return value
+
+
+def _cell(value, r, c):
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValidationError(f'.tableData[{r}][{c}]', 'must be a string')
+
+
+def _text_block(raw):
+    return TextBlock(content=_text(raw.get('content'), 'content'), align=_text(raw.get('align'), 'align', 'left'))
+
+
+def _list_block(raw):
+    content = _text(raw.get('content'), 'content')
+    return ListBlock(items=tuple(x.strip() for x in content.split('\n') if x.strip()),
+                     style=_text(raw.get('listStyle'), 'listStyle'), align=_text(raw.get('align'), 'align', 'left'))
+
+
+def _table_block(raw):
+    rows = []
+    for r, row in enumerate(_list(raw.get('tableData'), 'tableData', 'a list of rows')):
+        if not isinstance(row, list):
+            raise ValidationError(f'.tableData[{r}]', 'must be a list of cells')
+        rows.append(tuple([cell if type(cell) is str else _cell(cell, r, c) for c, cell in enumerate(row)]))
+    return TableBlock(rows=tuple(rows), align=_text(raw.get('align'), 'align', 'left'))
+
+
+def _image_block(raw):
+    images = []
+    for i, img in enumerate(_list(raw.get('images'), 'images')):
+        try:
+            if not isinstance(img, dict):
+                raise ValidationError('', 'must be an object')
+            images.append(Image(_text(img.get('url'), 'url'), _text(img.get('caption'), 'caption')))
+        except ValidationError as e:
+            raise e.within(f'.images[{i}]')
+    legacy = raw.get('url') or raw.get('src')
+    if not images and legacy:
+        # Older single-image blocks keep the image on the block itself
+        images.append(Image(_text(legacy, 'url'), _text(raw.get('caption'), 'caption')))
+    return ImageBlock(images=tuple(images),
+                      layout=_pattern(raw.get('layout'), TOKEN_RE, 'layout', 'standalone', 'a layout name'),
+                      width=_number(raw.get('groupWidth'), 'groupWidth'), align=_text(raw.get('align'), 'align', 'left'))
+
+
+BLOCK_PARSERS = {
+    'text': _text_block,
+    'list': _list_block,
+    'table': _table_block,
+    'image': _image_block,
+    'page-break': lambda raw: PageBreak(),
+}
+
+
+def _block(raw):
+    if not isinstance(raw, dict):
+        raise ValidationError('', 'must be an object')
+    kind = raw.get('type') or 'text'
+    parse = BLOCK_PARSERS.get(kind) if isinstance(kind, str) else None
+    if parse is None:
+        raise ValidationError('.type', f'must be one of {", ".join(BLOCK_PARSERS)} (got {kind!r})')
+    return parse(raw)
+
+
+def _section(raw, depth):
+    if not isinstance(raw, dict):
+        raise ValidationError('', 'must be an object')
+    if depth > MAX_DEPTH:
+        raise ValidationError('', f'is nested more than {MAX_DEPTH} levels deep')
+    blocks = []
+    for i, blk in enumerate(_list(raw.get('blocks'), 'blocks')):
+        try:
+            blocks.append(_block(blk))
+        except ValidationError as e:
+            raise e.within(f'.blocks[{i}]')
+    if not blocks and raw.get('content'):
+        # Legacy sections hold their text in a plain `content` string
+        blocks.append(TextBlock(content=_text(raw['content'], 'content')))
+    subsections = []
+    for i, sub in enumerate(_list(raw.get('subsections'), 'subsections')):
+        try:
+            subsections.append(_section(sub, depth + 1))
+        except ValidationError as e:
+            raise e.within(f'.subsections[{i}]')
+    return Section(
+        type=_text(raw.get('type'), 'type', 'other'),
+        id=raw.get('id') if isinstance(raw.get('id'), str) else None,
+        title=_text(raw.get('title'), 'title', 'Untitled'),
+        level=_level(raw.get('level')),
+        color=_pattern(raw.get('customColor'), COLOR_RE, 'customColor', None, 'a CSS colour'),
+        blocks=tuple(blocks),
+        subsections=tuple(subsections),
+        page_break_before=bool(raw.get('pageBreakBefore')))
+
+
+def parse_sections(data, path='sections'):
+    """Validate DATA, a list of section dicts, and return it as a tuple of Sections.
+
+    Raises ValidationError naming the offending field, e.g.
+    "sections[2].blocks[0].tableData[1] must be a list of cells".
+    """
+    if data is None:
+        return ()
+    if not isinstance(data, list):
+        raise ValidationError(path, 'must be a list of sections')
+    sections = []
+    for i, sec in enumerate(data):
+        try:
+            sections.append(_section(sec, 1))
+        except ValidationError as e:
+            raise e.within(f'{path}[{i}]')
+    return tuple(sections)
+
+
+# Top-level payload fields besides sections; all optional
+OPTION_FIELDS = ('template', 'export_mode', 'purpose', 'filename')
+FORMATTING_TEXT = ('englishFont', 'chineseFont')
+FORMATTING_NUMBERS = ('bodySize', 'lineHeight')
+
+
+def validate_options(data):
+    """Check the top level of a document payload DATA: everything but its sections.
+
+    The render options stay as sent (null meaning the default); they are
+    only checked, so the renderers can read them without tripping over a
+    list where a name or an object was expected.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError('request body', 'must be a JSON object')
+    for field in OPTION_FIELDS:
+        if data.get(field) is not None and not isinstance(data[field], str):
+            raise ValidationError(field, 'must be a string')
+    if data.get('include_toc') is not None and not isinstance(data['include_toc'], bool):
+        raise ValidationError('include_toc', 'must be true or false')
+    formatting = data.get('formatting')
+    if formatting is None:
+        return
+    if not isinstance(formatting, dict):
+        raise ValidationError('formatting', 'must be an object')
+    try:
+        for field in FORMATTING_TEXT:
+            _text(formatting.get(field), field)
+        for field in FORMATTING_NUMBERS:
+            _number(formatting.get(field), field)
+    except ValidationError as e:
+        raise e.within('formatting')
+
+
+# --- IMAGES ---
+def image_urls(sections):
+    """URL of every image in SECTIONS and their subsections, in document order."""
+    urls = []
+    stack = list(reversed(sections))
+    while stack:
+        section = stack.pop()
+        urls.extend(img.url for blk in section.blocks if blk.type == 'image' for img in blk.images)
+        stack.extend(reversed(section.subsections))
+    return urls
+
+
+def embed_images(section, resolved, deep=False):
+    """SECTION with each image URL replaced by RESOLVED[url] (e.g. a data URI), subsections too if DEEP."""
+    blocks = tuple(blk._replace(images=tuple(img._replace(url=resolved.get(img.url, img.url)) for img in blk.images))
+                   if blk.type == 'image' else blk for blk in section.blocks)
+    if deep:
+        return section._replace(blocks=blocks,
+                                subsections=tuple(embed_images(sub, resolved, True) for sub in section.subsections))
+    return section._replace(blocks=blocks)
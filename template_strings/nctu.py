@@ -1,5 +1,36 @@
 import html
-import re
+from bisect import bisect_left
+from .utils import (process_text_formatting, render_table, render_recursive_tree, align_class, cached_css,
+                    SectionRenderer, PAGE_BREAK)
+from .layout import MM, PageMetrics, paginate, to_number, FONT_SIZE_RANGE, LINE_HEIGHT_RANGE
+
+# Body rows of a table that fit on one page; longer tables continue on new pages
+TABLE_ROWS_PER_PAGE = 22
+
+# Images per figure row by image count; larger groups are not drawn
+FIGURE_ROWS = {1: (1,), 2: (2,), 3: (2, 1), 4: (2, 2), 5: (2, 3), 6: (3, 3)}
+
+# Nav pills that fit down the sidebar of a page; longer documents show a window around the current section
+NAV_PILLS_PER_PAGE = 12
+
+def page_metrics(formatting):
+    """Page geometry for the layout pass; mirrors the CSS in generate_css."""
+    font = to_number(formatting.get('bodySize', '14'), 14, *FONT_SIZE_RANGE)
+    lh = to_number(formatting.get('lineHeight', '1.6'), 1.6, *LINE_HEIGHT_RANGE)
+    return PageMetrics(
+        content_height=297 * MM - 100, content_width=210 * MM - 65 - 50 - 50,
+        font_px=font, line_height=lh,
+        headings=(26 * 1.4 + 12 + 3 + 26 * 0.67 + 25, 20 * lh + 30 + 18, 16 * lh + 25 + 15),
+        block_gap=18, list_item_gap=8, list_margin=20, table_cell_pad=17, table_margin=20,
+        image_height=180, caption_height=11 * lh + 6, figure_row_gap=12, figure_margin=50,
+        figure_rows=lambda n: len(FIGURE_ROWS.get(n, ())),
+        toc_heading=26 * 1.4 + 12 + 3 + 26 * 0.67 + 25, toc_entry=16 * lh + 8 + 18 + 1)
+
+def layout_document(sections, formatting, include_toc, image_size=None):
+    """Paginate SECTIONS for this template; see layout.paginate."""
+    return paginate(sections, page_metrics(formatting), include_toc, image_size, TABLE_ROWS_PER_PAGE)
+
+@cached_css
 def generate_css(formatting):
     en_font = formatting.get('englishFont', "'Times New Roman', serif")
     zh_font = formatting.get('chineseFont', "'DFKai-SB', '標楷體', serif")
@@ -16,10 +47,10 @@ def generate_css(formatting):
         body {{ background: #fff; font-family: {en_font}, {zh_font}, sans-serif; font-size: {base_size}px; line-height: {line_height}; color: #333; }}
 
         /* LAYOUT */
-        .page {{ position: relative; width: 210mm; min-height: 297mm; max-height: 297mm; margin: 0 auto; background: white; page-break-after: always; break-after: page; overflow: hidden; }}
+        .page {{ position: relative; width: 210mm; min-height: 297mm; margin: 0 auto; background: white; page-break-after: always; break-after: page; }}
         .page:last-child {{ page-break-after: auto; }}
         .page-sidebar {{ position: absolute; top: 0; left: 0; bottom: 0; width: var(--sidebar-width); background-color: #fcfcfc; border-right: 1px solid #e0e0e0; }}
-        .page-content {{ margin-left: calc(var(--sidebar-width) + var(--content-padding)); margin-right: var(--content-padding); padding: 50px 0; min-height: calc(297mm - 100px); max-height: calc(297mm - 100px); overflow: visible; }}
+        .page-content {{ margin-left: calc(var(--sidebar-width) + var(--content-padding)); margin-right: var(--content-padding); padding: 50px 0; min-height: calc(297mm - 100px); overflow: visible; }}
         
         /* SECTION WRAPPER */
         .section-wrapper {{ page-break-inside: avoid; break-inside: avoid; }}
@@ -91,6 +122,11 @@ def generate_css(formatting):
             text-align: center;
         }}
 
+        /* TABLES */
+        .content-table {{ width: 100%; border-collapse: collapse; margin: 10px 0; }}
+        .content-table th, .content-table td {{ border: 1px solid #ddd; padding: 8px; }}
+        .content-table th {{ background: var(--table-head-bg, #f5f5f5); font-weight: 600; text-align: left; }}
+
         /* LISTS */
         ul.custom-list {{ margin: 10px 0; padding-left: 0; list-style: none; }}
         ul.custom-list li {{ margin-bottom: 8px; position: relative; text-align: justify; }}
@@ -117,186 +153,117 @@ def generate_css(formatting):
     </style>
     """
 def get_section_color(section):
-    return section.get('customColor') or {'autobiography':'#3498db','study_plan':'#2ecc71','resume':'#7f8c8d'}.get(section.get('type'), '#95a5a6')
+    return section.color or {'autobiography':'#3498db','study_plan':'#2ecc71','resume':'#7f8c8d'}.get(section.type, '#95a5a6')
 
 def get_pill_text(section):
-    t = section.get('title', '')
-    st = section.get('type', 'other')
+    t = section.title
+    st = section.type
     if t and st == 'other': return t[:2]
     return {'autobiography':'自傳','study_plan':'計畫','resume':'簡歷'}.get(st, t[:2] if t else '其他')
 
-def process_text_formatting(text, theme_color):
-    if not text: return ""
-    s = html.escape(text)
-    s = re.sub(r'\*\*(.*?)\*\*', f'<strong style="color: {theme_color}">\\1</strong>', s)
-    s = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2" target="_blank" style="text-decoration: underline; color: inherit;">\1</a>', s)
-    return s.replace('\n', '<br>')
+def render_nav_pill(section, active):
+    col = get_section_color(section) if active else "#f5f5f5"
+    return f'<div class="section-nav-pill {"active" if active else ""}" style="background-color:{col};">{html.escape(get_pill_text(section))}</div>'
 
-def generate_nav_pills(sections, current_index):
-    pills = ""
-    for i, sec in enumerate(sections):
-        if sec.get('level', 1) > 1: continue
-        col = get_section_color(sec)
-        active = i == current_index
-        pills += f'<div class="section-nav-pill {"active" if active else ""}" style="background-color:{col if active else "#f5f5f5"};">{html.escape(get_pill_text(sec))}</div>'
-    return pills
-
-def render_section_content(section, numbering=""):
-    lvl = section.get('level', 1)
-    col = get_section_color(section)
-    ttl = section.get('title', 'Untitled')
-    
+def nav_pill_bars(sections):
+    """bar(i) -> the nav pills on the pages of top-level section I.
+
+    Pill labels are rendered once per document rather than once per page.
+    """
+    tops = [i for i, sec in enumerate(sections) if sec.level <= 1]
+    inactive = [render_nav_pill(sections[i], False) for i in tops]
+    def bar(i):
+        k = bisect_left(tops, i)
+        start = max(min(k - NAV_PILLS_PER_PAGE // 2, len(tops) - NAV_PILLS_PER_PAGE), 0)
+        pills = inactive[start:start + NAV_PILLS_PER_PAGE]
+        if k < len(tops) and tops[k] == i:
+            pills[k - start] = render_nav_pill(sections[i], True)
+        return ''.join(pills)
+    return bar
+
+def render_heading(section, numbering, col):
+    lvl = section.level
+    ttl = section.title
     tag = ['h1','h2','h3'][min(lvl-1, 2)]
     cls = ['title','subtitle','subsubtitle'][min(lvl-1, 2)]
     sty = f'color:{col};' + (f'border-color:{col};' if lvl==1 else '')
     num_html = f'<span class="section-number">{numbering}</span>' if numbering else ''
-    html_content = f'<{tag} class="{cls}" style="{sty}">{num_html}{html.escape(ttl)}</{tag}>'
-    
-    # Blocks
-    blocks = section.get('blocks') or ([{'type':'text','content':section.get('content'),'align':'left'}] if section.get('content') else [])
-    for blk in blocks:
-        b_type = blk.get('type', 'text')
-        align = blk.get('align', 'left')
-        
-        # --- IMAGE BLOCK (NEW MULTI-IMAGE SYSTEM) ---
-        if b_type == 'image':
-            images = blk.get('images', [])
-            if images:
-                layout = blk.get('layout', 'standalone')
-                group_width = blk.get('groupWidth', 75)
-                count = len(images)
-                
-                # Build figure rows based on count
-                if count == 1:
-                    rows_html = f'''
-                    <div class="figure-row">
-                        <div class="figure-item">
-                            <img src="{images[0]['url']}" alt="{html.escape(images[0].get('caption', ''))}">
-                            <div class="figure-caption">{html.escape(images[0].get('caption', ''))}</div>
-                        </div>
-                    </div>
-                    '''
-                elif count == 2:
-                    rows_html = '<div class="figure-row">'
-                    for img in images:
-                        rows_html += f'''
-                        <div class="figure-item">
-                            <img src="{img['url']}" alt="{html.escape(img.get('caption', ''))}">
-                            <div class="figure-caption">{html.escape(img.get('caption', ''))}</div>
-                        </div>
-                        '''
-                    rows_html += '</div>'
-                elif count in [3, 5]:
-                    # 2 top, 1 bottom OR 2 top, 3 bottom
-                    top_count = 2
-                    rows_html = '<div class="figure-row">'
-                    for i in range(top_count):
-                        rows_html += f'''
-                        <div class="figure-item">
-                            <img src="{images[i]['url']}" alt="{html.escape(images[i].get('caption', ''))}">
-                            <div class="figure-caption">{html.escape(images[i].get('caption', ''))}</div>
-                        </div>
-                        '''
-                    rows_html += '</div><div class="figure-row">'
-                    for i in range(top_count, count):
-                        rows_html += f'''
-                        <div class="figure-item">
-                            <img src="{images[i]['url']}" alt="{html.escape(images[i].get('caption', ''))}">
-                            <div class="figure-caption">{html.escape(images[i].get('caption', ''))}</div>
-                        </div>
-                        '''
-                    rows_html += '</div>'
-                elif count in [4, 6]:
-                    # 2x2 grid OR 2x3 grid
-                    half = count // 2
-                    rows_html = '<div class="figure-row">'
-                    for i in range(half):
-                        rows_html += f'''
-                        <div class="figure-item">
-                            <img src="{images[i]['url']}" alt="{html.escape(images[i].get('caption', ''))}">
-                            <div class="figure-caption">{html.escape(images[i].get('caption', ''))}</div>
-                        </div>
-                        '''
-                    rows_html += '</div><div class="figure-row">'
-                    for i in range(half, count):
-                        rows_html += f'''
-                        <div class="figure-item">
-                            <img src="{images[i]['url']}" alt="{html.escape(images[i].get('caption', ''))}">
-                            <div class="figure-caption">{html.escape(images[i].get('caption', ''))}</div>
-                        </div>
-                        '''
-                    rows_html += '</div>'
-                else:
-                    rows_html = ''
-                
-                wrapper_class = f"figure-group {layout}"
-                html_content += f'<div class="{wrapper_class}" style="max-width: {group_width}%;">{rows_html}</div>'
-                
-        # --- TABLE BLOCK ---
-        elif b_type == 'table':
-            table_data = blk.get('tableData', [])
-            if table_data:
-                align_cls = "align-center" if align == "center" else "align-left"
-                
-                table_html = '<table class="content-table" style="width:100%; border-collapse:collapse; margin:10px 0;">'
-                
-                for row_idx, row in enumerate(table_data):
-                    table_html += '<tr>'
-                    for cell in row:
-                        cell_content = process_text_formatting(cell, col) if cell else '&nbsp;'
-                        # First row as header
-                        if row_idx == 0:
-                            table_html += f'<th style="border:1px solid #ddd; padding:8px; background:{col}15; font-weight:600; text-align:left;">{cell_content}</th>'
-                        else:
-                            table_html += f'<td style="border:1px solid #ddd; padding:8px;">{cell_content}</td>'
-                    table_html += '</tr>'
-                
-                table_html += '</table>'
-                html_content += f'<div class="content-block {align_cls}">{table_html}</div>'
-        # --- TEXT BLOCK ---
-        elif b_type == 'text':
-            raw = blk.get('content', '')
-            align_cls = "align-center" if align == "center" else "align-left"
-            html_content += f'<div class="content-block {align_cls}"><p>{process_text_formatting(raw, col)}</p></div>'
-            
-        # --- LIST BLOCK ---
-        elif b_type == 'list':
-            raw = blk.get('content', '')
-            items = [x.strip() for x in raw.split('\n') if x.strip()]
-            style = blk.get('listStyle', 'dot')
-            ul_cls = "custom-list " + ({'1':'list-parens','arrow':'list-arrows'}.get(style, 'list-dot'))
-            mk_sty = f"color:{col};" if style=='arrow' else ""
-            align_cls = "align-center" if align == "center" else "align-left"
-            html_content += f'<ul class="{ul_cls} {align_cls}" style="{mk_sty}">' + ''.join([f'<li style="color:#333;">{process_text_formatting(i,col)}</li>' for i in items]) + '</ul>'
-
-    # Clear floats at end of section just in case
-    html_content += '<div style="clear:both;"></div>'
-    
-    return html_content
+    return f'<{tag} class="{cls}" style="{sty}">{num_html}{html.escape(ttl)}</{tag}>'
+
+# --- BLOCK RENDERERS: (block, section colour) -> HTML ---
+def render_figure_item(img):
+    caption = html.escape(img.caption)
+    return f'<div class="figure-item"><img src="{img.url}" alt="{caption}"><div class="figure-caption">{caption}</div></div>'
+
+def render_image_block(blk, col):
+    images = blk.images
+    if not images: return ''
+    rows, start = [], 0
+    for n in FIGURE_ROWS.get(len(images), ()):
+        rows.append('<div class="figure-row">' + ''.join([render_figure_item(img) for img in images[start:start+n]]) + '</div>')
+        start += n
+    width = 75 if blk.width is None else blk.width
+    return f'<div class="figure-group {blk.layout}" style="max-width: {width}%;">{"".join(rows)}</div>'
+
+def render_table_block(blk, col):
+    if not blk.rows: return ''
+    tables = render_table(blk.rows, lambda c: process_text_formatting(c, col), '&nbsp;',
+                          f'class="content-table" style="--table-head-bg:{col}15;"', TABLE_ROWS_PER_PAGE)
+    return PAGE_BREAK.join(f'<div class="content-block {align_class(blk)}">{t}</div>' for t in tables)
+
+def render_text_block(blk, col):
+    return f'<div class="content-block {align_class(blk)}"><p>{process_text_formatting(blk.content, col)}</p></div>'
+
+def render_list_block(blk, col):
+    style = blk.style
+    ul_cls = "custom-list " + ({'1':'list-parens','arrow':'list-arrows'}.get(style, 'list-dot'))
+    mk_sty = f"color:{col};" if style=='arrow' else ""
+    if blk.start: mk_sty += f"counter-reset:list-counter {blk.start-1};"
+    return f'<ul class="{ul_cls} {align_class(blk)}" style="{mk_sty}">' + ''.join([f'<li style="color:#333;">{process_text_formatting(i,col)}</li>' for i in blk.items]) + '</ul>'
+
+render_section_content = SectionRenderer(
+    render_heading,
+    {'image': render_image_block, 'table': render_table_block, 'text': render_text_block, 'list': render_list_block},
+    context=get_section_color,
+    footer='<div style="clear:both;"></div>')  # clear floats at the end of each section
 
 def render_section_tree(section, numbering=""):
-    html_out = render_section_content(section, numbering)
-    if 'subsections' in section:
-        for i, subsec in enumerate(section['subsections']): html_out += render_section_tree(subsec, f"{numbering}.{i+1}" if numbering else f"{i+1}")
-    return html_out
-
-def get_toc_html(sections):
-    flat = []
-    def flatten(secs, p_num=""):
-        for i, s in enumerate(secs):
-            n = f"{p_num}{i+1}"
-            flat.append({**s, '_num': n, '_idx': len(flat)})
-            if 'subsections' in s: flatten(s['subsections'], f"{n}.")
-    flatten(sections)
-    items = "".join([f'<li class="toc-item indent-{s.get("level",1)-1}"><span class="toc-label">{s["_num"]} {html.escape(s.get("title","Untitled"))}</span><span class="toc-page">Page {s["_idx"]+2}</span></li>' for s in flat])
-    return f'<div class="page"><div class="page-sidebar"></div><div class="section-nav-container"><div class="section-nav-pill active" style="background-color:#2c3e50;">目錄</div></div><div class="page-content"><h1 class="title" style="border-color:#2c3e50;">目錄 (Table of Contents)</h1><ul class="toc-list">{items}</ul></div></div>'
-
-def generate_full_html(sections, formatting, include_toc):
-    css = generate_css(formatting)
-    body = get_toc_html(sections) if include_toc else ""
+    return render_recursive_tree(section, numbering, render_section_content)
+
+def get_toc_html(sections, layout=None):
+    layout = layout or layout_document(sections, {}, True)
+    items = [f'<li class="toc-item indent-{s.level-1}"><span class="toc-label">{n} {html.escape(s.title)}</span><span class="toc-page">Page {layout.page_number(n)}</span></li>' for n, s in layout.nodes]
+    step = layout.toc_per_page
+    return "".join(f'<div class="page"><div class="page-sidebar"></div><div class="section-nav-container"><div class="section-nav-pill active" style="background-color:#2c3e50;">目錄</div></div><div class="page-content"><h1 class="title" style="border-color:#2c3e50;">目錄 (Table of Contents)</h1><ul class="toc-list">{"".join(items[i:i+step])}</ul></div></div>' for i in range(0, max(len(items), 1), step))
+
+def iter_full_html(sections, formatting, include_toc, prepare=None, render_tree=None, layout=None, stylesheet=None):
+    """Yield the document one page at a time.
+
+    PREPARE, if given, is called with each top-level section right before it
+    is rendered and returns the section to render (e.g. with images embedded).
+    RENDER_TREE replaces render_section_tree (e.g. with a cached version).
+    LAYOUT is the result of layout_document; without one SECTIONS are laid
+    out here.  STYLESHEET replaces the inline <style> in the head (e.g. with
+    a <link> to the shared stylesheet).
+    """
+    render_tree = render_tree or render_section_tree
+    layout = layout or layout_document(sections, formatting, include_toc)
+    sections = layout.sections
+    css = stylesheet or generate_css(formatting)
+    yield f"<!DOCTYPE html><html lang='zh-TW'><head><meta charset='UTF-8'><meta name='viewport' content='width=device-width, initial-scale=1.0'><title>Portfolio Document</title>{css}</head><body>"
+    if include_toc:
+        yield get_toc_html(sections, layout)
+    nav_pills = nav_pill_bars(sections)
     for i, sec in enumerate(sections):
-        body += f'<div class="page"><div class="page-sidebar"></div><div class="section-nav-container">{generate_nav_pills(sections, i)}</div><div class="page-content">{render_section_tree(sec, str(i+1))}</div></div>'
-    return f"<!DOCTYPE html><html lang='zh-TW'><head><meta charset='UTF-8'><meta name='viewport' content='width=device-width, initial-scale=1.0'><title>Portfolio Document</title>{css}</head><body>{body}</body></html>"
+        if prepare: sec = prepare(sec)
+        pills = nav_pills(i)
+        for part in render_tree(sec, str(i+1)).split(PAGE_BREAK):
+            yield f'<div class="page"><div class="page-sidebar"></div><div class="section-nav-container">{pills}</div><div class="page-content">{part}</div></div>'
+    yield "</body></html>"
+
+def generate_full_html(sections, formatting, include_toc, render_tree=None, layout=None, stylesheet=None):
+    return "".join(iter_full_html(sections, formatting, include_toc, render_tree=render_tree, layout=layout,
+                                  stylesheet=stylesheet))
 
 def generate_preview_html(sections, formatting):
     """Generate preview for a single section or multiple sections without TOC"""
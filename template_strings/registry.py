@@ -0,0 +1,93 @@
+"""Document templates by name.
+
+Each template is a module that declares its stylesheet (generate_css), its
+page geometry (page_metrics / layout_document) and its section renderer, a
+utils.SectionRenderer built once from the template's heading and block
+renderers at import time.  Modules are imported the first time a name is
+asked for, so a registered template costs nothing until it is used.
+"""
+import re
+import hashlib
+import importlib
+import threading
+from functools import lru_cache
+
+from .utils import render_recursive_tree, css_options
+
+DEFAULT_TEMPLATE = 'nctu'
+
+# name -> module path; register() adds more
+TEMPLATE_MODULES = {
+    'nctu': 'template_strings.nctu',
+    'academic': 'template_strings.academic',
+}
+
+_loaded = {}
+_lock = threading.Lock()
+
+STYLE_BLOCK_RE = re.compile(r'<style[^>]*>(.*)</style>', re.DOTALL)
+
+
+class Template:
+    """A loaded template: its module's entry points, looked up once."""
+
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+        self.generate_css = module.generate_css
+        self.render_section_content = module.render_section_content
+        self.layout_document = module.layout_document
+        self.iter_full_html = module.iter_full_html
+        self.generate_full_html = module.generate_full_html
+        self._stylesheet = lru_cache(maxsize=64)(self._build_stylesheet)
+
+    def _build_stylesheet(self, options):
+        style = self.generate_css(dict(options))
+        m = STYLE_BLOCK_RE.search(style)
+        css = (m.group(1) if m else style).strip()
+        return css, hashlib.blake2b(css.encode('utf-8'), digest_size=8).hexdigest()
+
+    def stylesheet(self, formatting):
+        """(css, version) of the bare stylesheet for FORMATTING; VERSION is a content hash."""
+        return self._stylesheet(css_options(formatting))
+
+    def css_stats(self):
+        info = self.generate_css.cache_info()
+        return {'stylesheets': info.currsize, 'hits': info.hits, 'misses': info.misses}
+
+    def render_tree(self, section, numbering=""):
+        return render_recursive_tree(section, numbering, self.render_section_content)
+
+
+def register(name, module_path):
+    """Make the template module at MODULE_PATH available as NAME."""
+    with _lock:
+        TEMPLATE_MODULES[name] = module_path
+        _loaded.pop(name, None)
+
+
+def names():
+    return list(TEMPLATE_MODULES)
+
+
+def get_template(name=None):
+    """The template registered as NAME (the default one for unknown names), loading it on first use."""
+    if name not in TEMPLATE_MODULES:
+        name = DEFAULT_TEMPLATE
+    template = _loaded.get(name)
+    if template is None:
+        with _lock:
+            template = _loaded.get(name)
+            if template is None:
+                template = _loaded[name] = Template(name, importlib.import_module(TEMPLATE_MODULES[name]))
+    return template
+
+
+def stats():
+    """Stylesheet cache counters of the templates loaded so far."""
+    return {name: template.css_stats() for name, template in list(_loaded.items())}
+
+
+def load_all():
+    """Import every registered template (e.g. during warm-up); returns them."""
+    return [get_template(name) for name in names()]
@@ -1,15 +1,88 @@
 import html
 import re
+from functools import lru_cache
+
+BOLD_RE = re.compile(r'\*\*(.*?)\*\*')
+ITALIC_RE = re.compile(r'\*(.*?)\*')
+LINK_RE = re.compile(r'\[(.*?)\]\((.*?)\)')
+DEFAULT_LINK_STYLE = "text-decoration: underline; color: inherit;"
+
+class InlineFormatter:
+    """Escape text and render **bold**, *italic* and [text](url).
+
+    The patterns are compiled once and applied in the templates' original
+    order (bold, then italic, then links, each on the previous result), so
+    ``2*3 and **bold**`` keeps its literal ``*``; a pass is skipped when
+    its delimiter does not occur.  Results are memoized,
+    since table cells and list items repeat a lot.
+    """
+
+    def __init__(self, bold_color=None, italic=False, link_style=DEFAULT_LINK_STYLE, cache_size=4096):
+        # Replacement templates: only \1 / \2 are group references, any other backslash is literal
+        bold_open = f'<strong style="color: {html.escape(bold_color)}">' if bold_color else '<strong>'
+        self.steps = [('**', BOLD_RE, bold_open.replace('\\', r'\\') + r'\1</strong>')]
+        if italic:
+            self.steps.append(('*', ITALIC_RE, r'<em>\1</em>'))
+        self.steps.append(('](', LINK_RE, r'<a href="\2" target="_blank" style="' + link_style.replace('\\', r'\\') + r'">\1</a>'))
+        self._cached = lru_cache(maxsize=cache_size)(self._format)
+
+    def _format(self, text):
+        s = html.escape(text)
+        for marker, pattern, repl in self.steps:
+            if marker in s:  # most cells have no markup at all
+                s = pattern.sub(repl, s)
+        return s.replace('\n', '<br>')
+
+    def __call__(self, text):
+        if not text: return ""
+        return self._cached(text)
+
+@lru_cache(maxsize=64)
+def get_formatter(bold_color=None, italic=False, link_style=DEFAULT_LINK_STYLE):
+    """Shared formatter per option set (one per theme colour in practice)."""
+    return InlineFormatter(bold_color, italic, link_style)
 
 def process_text_formatting(text, theme_color=None):
     if not text: return ""
-    s = html.escape(text)
-    if theme_color:
-        s = re.sub(r'\*\*(.*?)\*\*', f'<strong style="color: {theme_color}">\\1</strong>', s)
-    else:
-        s = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', s)
-    s = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2" target="_blank" style="text-decoration: underline; color: inherit;">\1</a>', s)
-    return s.replace('\n', '<br>')
+    return get_formatter(theme_color)(text)
+
+# Formatting options the stylesheets depend on
+CSS_OPTIONS = ('englishFont', 'chineseFont', 'bodySize', 'lineHeight')
+
+def css_options(formatting):
+    """FORMATTING reduced to the options stylesheets use, as a hashable, ordered key."""
+    return tuple((k, str(formatting[k]).strip()) for k in CSS_OPTIONS if formatting.get(k) not in (None, ''))
+
+def cached_css(generate_css):
+    """Memoize a template's generate_css(formatting) per normalized option set.
+
+    Only a handful of font / size / line-height combinations occur, so each
+    stylesheet string is built once and shared by every document using it.
+    """
+    cached = lru_cache(maxsize=64)(lambda options: generate_css(dict(options)))
+    def wrapper(formatting):
+        return cached(css_options(formatting))
+    wrapper.cache_info = cached.cache_info
+    return wrapper
+
+# Rendered section HTML may contain this marker; the page loop starts a new
+# page wherever it appears
+PAGE_BREAK = '<!--page-break-->'
+
+def render_table(table_data, format_cell, empty_cell, table_attrs='class="content-table"', max_rows=None):
+    """Render TABLE_DATA (first row is the header) as a list of <table> segments.
+
+    Rows are built with list joins, and repeated styling is left to CSS
+    classes.  With MAX_ROWS, body rows are split into segments of at most
+    that many rows, each repeating the header, so callers can place them on
+    separate pages; otherwise a single table is returned.
+    """
+    fmt = lambda cell: format_cell(cell) if cell else empty_cell
+    head = '<thead><tr>' + ''.join([f'<th>{fmt(c)}</th>' for c in table_data[0]]) + '</tr></thead>'
+    rows = ['<tr>' + ''.join([f'<td>{fmt(c)}</td>' for c in row]) + '</tr>' for row in table_data[1:]]
+    step = max_rows if max_rows and len(rows) > max_rows else max(len(rows), 1)
+    return [f'<table {table_attrs}>{head}<tbody>{"".join(rows[i:i + step])}</tbody></table>'
+            for i in range(0, max(len(rows), 1), step)]
 
 def get_chinese_number(num):
     chinese_nums = ['', '壹', '貳', '參', '肆', '伍', '陸', '柒', '捌', '玖', '拾']
@@ -23,11 +96,56 @@ def get_parenthesis_number(num):
     chinese_nums = ['', '一', '二', '三', '四', '五', '六', '七', '八', '九', '十']
     return f"({chinese_nums[num]})" if num < len(chinese_nums) else f"({num})"
 
+def align_class(blk):
+    return "align-center" if blk.align == "center" else "align-left"
+
+def render_page_break(blk, ctx):
+    return PAGE_BREAK
+
+class SectionRenderer:
+    """Renders one section node: its heading, then each block by type.
+
+    A template declares HEADING(section, numbering, ctx) and BLOCKS, a dict
+    of block type -> renderer(block, ctx), over the nodes of model.py;
+    CONTEXT(section), if given, is computed once per node (e.g. the theme
+    colour) and passed to both.
+    Page breaks placed by the layout pass are handled here for every
+    template.  Instances hold only module-level functions, so they pickle
+    for the render pool.
+    """
+
+    def __init__(self, heading, blocks, context=None, footer=''):
+        self.heading = heading
+        self.blocks = dict(blocks, **{'page-break': render_page_break})
+        self.context = context
+        self.footer = footer
+
+    def __call__(self, section, numbering=""):
+        ctx = self.context(section) if self.context else None
+        parts = [PAGE_BREAK] if section.page_break_before else []
+        parts.append(self.heading(section, numbering, ctx))
+        blocks = self.blocks
+        for blk in section.blocks:
+            render = blocks.get(blk.type)
+            if render:
+                parts.append(render(blk, ctx))
+        parts.append(self.footer)
+        return ''.join(parts)
+
 def render_recursive_tree(section, numbering, render_content_func):
-    """Recursively render sections using the provided render function."""
-    html_out = render_content_func(section, numbering)
-    if 'subsections' in section:
-        for i, subsec in enumerate(section['subsections']):
-            sub_num = f"{numbering}.{i+1}" if numbering else f"{i+1}"
-            html_out += render_recursive_tree(subsec, sub_num, render_content_func)
-    return html_out
\ No newline at end of file
+    """Render SECTION and its subsections, depth first, with RENDER_CONTENT_FUNC(node, numbering).
+
+    Every template and the render cache go through this walk.  It is
+    iterative and joins once, so deep or wide trees cost no recursion or
+    repeated string copies.
+    """
+    parts = []
+    stack = [(section, numbering)]
+    while stack:
+        node, num = stack.pop()
+        parts.append(render_content_func(node, num))
+        subs = node.subsections
+        if subs:
+            prefix = f"{num}." if num else ""
+            stack.extend((subs[i], f"{prefix}{i+1}") for i in range(len(subs) - 1, -1, -1))
+    return ''.join(parts)
\ No newline at end of file